@@ -0,0 +1,122 @@
+"""
+Benchmark the vectorized analysis engine against the per-exercise loops it replaced.
+
+Builds a synthetic set history (100k rows by default), runs the old
+``df[df['exercise__name'] == exercise]`` loops for weight series, volume
+series, personal records and rest times, then runs ``summarize_sets`` on the
+same rows, checks the results agree and prints the timings.
+
+Usage:
+    python benchmarks/analysis_engine.py [--rows 100000] [--exercises 40] [--repeat 5]
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workouts.engine import summarize_sets  # noqa: E402
+
+
+def synthetic_history(rows, exercises, seed=42):
+    rng = np.random.default_rng(seed)
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    offsets = np.sort(rng.integers(0, 4 * 365 * 24 * 3600, size=rows))
+    names = [f'Exercise {i}' for i in range(exercises)]
+    return [
+        {
+            'exercise__name': names[rng_name],
+            'weight': float(weight),
+            'reps': int(reps),
+            'performed_at': start + timedelta(seconds=int(offset)),
+        }
+        for rng_name, weight, reps, offset in zip(
+            rng.integers(0, exercises, size=rows),
+            rng.integers(20, 400, size=rows) / 2,
+            rng.integers(1, 15, size=rows),
+            offsets,
+        )
+    ]
+
+
+def legacy(rows):
+    """The pre-engine workout_analysis loops, minus the figure building"""
+    df = pd.DataFrame(rows)
+    weight_progress = {}
+    for exercise in df['exercise__name'].unique():
+        exercise_data = df[df['exercise__name'] == exercise]
+        weight_progress[exercise] = exercise_data[['performed_at', 'weight']]
+
+    df['volume'] = df['weight'] * df['reps']
+    volume_progress = {}
+    for exercise in df['exercise__name'].unique():
+        exercise_data = df[df['exercise__name'] == exercise]
+        volume_progress[exercise] = exercise_data.groupby('performed_at')['volume'].sum().reset_index()
+
+    prs = {}
+    for exercise in df['exercise__name'].unique():
+        exercise_data = df[df['exercise__name'] == exercise]
+        prs[exercise] = {
+            'max_weight': exercise_data['weight'].max(),
+            'max_volume': exercise_data['volume'].max(),
+            'max_reps': exercise_data['reps'].max(),
+            'total_volume': exercise_data['volume'].sum()
+        }
+
+    rest_times = {}
+    for exercise in df['exercise__name'].unique():
+        exercise_data = df[df['exercise__name'] == exercise].sort_values('performed_at')
+        if len(exercise_data) > 1:
+            rest_time = exercise_data['performed_at'].diff().mean()
+            if pd.notnull(rest_time):
+                rest_times[exercise] = rest_time.total_seconds() / 60
+    return weight_progress, volume_progress, prs, rest_times
+
+
+def check(old, new):
+    _, volume_progress, prs, rest_times = old
+    assert set(prs) == set(new)
+    for exercise, records in prs.items():
+        stats = new[exercise]['stats']
+        assert np.isclose(records['max_weight'], stats['max_weight'])
+        assert np.isclose(records['max_volume'], stats['max_volume'])
+        assert records['max_reps'] == stats['max_reps']
+        assert np.isclose(records['total_volume'], stats['total_volume'])
+        assert np.allclose(volume_progress[exercise]['volume'].to_numpy(), new[exercise]['volume'])
+        assert np.isclose(rest_times[exercise], new[exercise]['avg_rest'])
+
+
+def best_of(func, rows, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(rows)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--exercises', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = synthetic_history(args.rows, args.exercises)
+    legacy_time, old = best_of(legacy, rows, args.repeat)
+    engine_time, new = best_of(lambda r: summarize_sets(r, 'performed_at'), rows, args.repeat)
+    check(old, new)
+
+    print(f"rows={args.rows} exercises={args.exercises} (best of {args.repeat})")
+    print(f"  per-exercise loops: {legacy_time * 1000:9.1f} ms")
+    print(f"  vectorized engine:  {engine_time * 1000:9.1f} ms")
+    print(f"  speedup:            {legacy_time / engine_time:9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Compare the analysis pages served over WSGI (gunicorn) and ASGI (uvicorn).
+
+Both servers run one worker process against the same database, as a user
+seeded by ``benchmarks/routes.py``. The runner sends --requests GETs per page
+from --concurrency client threads, then reports the median and 95th
+percentile latency and the throughput. Under uvicorn the async analysis views
+run their independent queries concurrently (ANALYSIS_QUERY_THREADS); under
+gunicorn the same views run in its --threads worker threads.
+
+uvicorn isn't a dependency of the app: ``pip install uvicorn`` first.
+
+Usage:
+    python benchmarks/asgi.py [--user bench-10k-0] [--requests 200]
+                              [--concurrency 8] [--servers wsgi,asgi]
+
+The database comes from DATABASE_URL and defaults to benchmarks/bench.sqlite3.
+"""
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gym_ebros.settings')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{ROOT / 'benchmarks' / 'bench.sqlite3'}")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.contrib.sessions.backends.db import SessionStore  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from workouts.models import Workout  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(kind, port, threads):
+    if kind == 'wsgi':
+        return [sys.executable, '-m', 'gunicorn', 'gym_ebros.wsgi:application',
+                '--bind', f'127.0.0.1:{port}', '--workers', '1', '--threads', str(threads)]
+    return [sys.executable, '-m', 'uvicorn', 'gym_ebros.asgi:application',
+            '--host', '127.0.0.1', '--port', str(port), '--workers', '1', '--no-access-log']
+
+
+def wait_until_up(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server didn't start")
+
+
+def login_cookie(user):
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+def fetch(port, path, cookie):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    started = time.perf_counter()
+    try:
+        conn.request('GET', path, headers={'Cookie': cookie})
+        response = conn.getresponse()
+        response.read()
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise RuntimeError(f"GET {path} returned {response.status}")
+    return time.perf_counter() - started
+
+
+def run(kind, paths, cookie, args):
+    port = free_port()
+    env = {**os.environ, 'QUERY_STATS_SAMPLE_RATE': '0'}
+    process = subprocess.Popen(
+        server_command(kind, port, args.concurrency), cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_up(port, process)
+        results = {}
+        with ThreadPoolExecutor(args.concurrency) as clients:
+            for label, path in paths.items():
+                for _ in range(args.concurrency):
+                    fetch(port, path, cookie)  # warm up
+                started = time.perf_counter()
+                latencies = sorted(clients.map(lambda _: fetch(port, path, cookie), range(args.requests)))
+                elapsed = time.perf_counter() - started
+                results[label] = {
+                    'p50_ms': statistics.median(latencies) * 1000,
+                    'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+                    'rps': len(latencies) / elapsed,
+                }
+        return results
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--user', default='bench-10k-0', help="Seeded user to request the pages as")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per page and server")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--servers', default='wsgi,asgi')
+    args = parser.parse_args()
+
+    user = User.objects.filter(username=args.user).first()
+    if user is None:
+        parser.error(f"No user {args.user}; seed one with benchmarks/routes.py first")
+    workout = Workout.objects.filter(user=user).order_by('pk').first()
+    paths = {
+        'analysis': reverse('workouts:analysis'),
+        'workout_analysis': reverse('workouts:workout_analysis', args=[workout.pk]),
+    }
+    cookie = login_cookie(user)
+
+    print(f"{args.requests} requests per page, {args.concurrency} concurrent clients, as {args.user}")
+    for kind in args.servers.split(','):
+        for label, result in run(kind, paths, cookie, args).items():
+            print(f"  {kind:4} {label:18} p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  "
+                  f"{result['rps']:6.1f} req/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+"""
+Benchmark every named route in workouts/urls.py against seeded data.
+
+For each scale (total sets in the database) the runner seeds users with
+``seed_gym`` (once; later runs reuse them) and requests every route as the
+first of those users through the Django test client. Per route it records
+the median wall time, the number of SQL queries and their total time, and
+the peak Python memory allocated while serving the request.
+
+Results are written as JSON. Given a previous result file with --baseline,
+the runner exits non-zero when a route got slower, issued more queries or
+used more memory than the baseline by more than --threshold.
+
+Usage:
+    python benchmarks/routes.py [--scales 1k,100k,1M] [--repeat 5]
+                                [--output results.json] [--baseline old.json]
+                                [--threshold 0.25] [--only analysis,session_detail]
+
+The database comes from DATABASE_URL and defaults to benchmarks/bench.sqlite3.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gym_ebros.settings')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{ROOT / 'benchmarks' / 'bench.sqlite3'}")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.cache import caches  # noqa: E402
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import get_resolver, reverse  # noqa: E402
+
+from workouts import jobs  # noqa: E402
+from workouts.models import (  # noqa: E402
+    Exercise, ExercisePerformance, SharedWorkout, Workout, WorkoutSession,
+)
+
+SCALES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1M': 1_000_000}
+SETS_PER_SESSION = 20  # seed_gym: ~5 exercises per workout x 4 sets
+
+
+class Route:
+    """How to call one named route; the callables receive the Fixtures"""
+
+    def __init__(self, method='get', kwargs=None, query=None, data=None, setup=None, content_type=None, headers=None):
+        self.method = method
+        self.content_type = content_type
+        self.headers = headers or {}
+        self.kwargs = kwargs or (lambda f: {})
+        self.query = query or (lambda f: {})
+        self.data = data or (lambda f: {})
+        self.setup = setup
+
+
+def _fresh_set(f):
+    f.spare_set = ExercisePerformance.objects.create(
+        workout_session=f.open_session, exercise=f.exercise, set_number=0, reps=5, weight=20
+    )
+
+
+def _fresh_share(f):
+    # Accepting keeps the share and declining deletes it, so start from a new one
+    SharedWorkout.objects.filter(workout=f.other_workout, shared_with=f.user).delete()
+    f.incoming_share = SharedWorkout.objects.create(
+        workout=f.other_workout, shared_by=f.other_user, shared_with=f.user
+    )
+
+
+def _import_file(f, rows=500):
+    # A new workout name per run, so no set is skipped as already imported
+    workout = f'Import {uuid.uuid4().hex[:8]}'
+    lines = ''.join(
+        json.dumps({'workout': workout, 'exercise': f.exercise.name, 'reps': 5, 'weight': 60,
+                    'performed_at': f'2020-01-{1 + i // 25:02d}T18:{i % 25:02d}:00'}) + '\n'
+        for i in range(rows)
+    )
+    return SimpleUploadedFile('history.jsonl', lines.encode(), content_type='application/x-ndjson')
+
+
+ROUTES = {
+    'index': Route(),
+    'exercise_list': Route(),
+    'exercise_create': Route(),
+    'exercise_edit': Route(kwargs=lambda f: {'pk': f.exercise.pk}),
+    'exercise_delete': Route(kwargs=lambda f: {'pk': f.exercise.pk}),
+    'workout_list': Route(),
+    'workout_create': Route(),
+    'workout_detail': Route(kwargs=lambda f: {'pk': f.workout.pk}),
+    'workout_edit': Route(kwargs=lambda f: {'pk': f.workout.pk}),
+    'workout_delete': Route(kwargs=lambda f: {'pk': f.workout.pk}),
+    'workout_analysis': Route(kwargs=lambda f: {'pk': f.workout.pk}),
+    'workout_chart_data': Route(
+        kwargs=lambda f: {'pk': f.workout.pk, 'kind': 'session_weight'},
+        query=lambda f: {'exercise': f.workout_exercise_id},
+    ),
+    'add_exercise_form': Route(query=lambda f: {'form_index': 1}),
+    'session_list': Route(),
+    'start_session': Route(),
+    'session_detail': Route(kwargs=lambda f: {'pk': f.open_session.pk}),
+    'batch_log_sets': Route(
+        method='post',
+        kwargs=lambda f: {'pk': f.open_session.pk},
+        data=lambda f: {
+            'sets-TOTAL_FORMS': 4, 'sets-INITIAL_FORMS': 0,
+            **{f'sets-{i}-{field}': value for i in range(4)
+               for field, value in (('exercise', f.open_exercise.pk), ('reps', 8), ('weight', '60'))},
+        },
+    ),
+    'session_sync': Route(
+        method='post',
+        kwargs=lambda f: {'pk': f.open_session.pk},
+        data=lambda f: json.dumps({'cursor': 0, 'events': [
+            {'id': str(uuid.uuid4()), 'type': 'add', 'exercise': f.open_exercise.pk, 'reps': 8, 'weight': 60}
+            for _ in range(10)
+        ]}),
+        content_type='application/json',
+    ),
+    'delete_performance': Route(
+        method='post',
+        kwargs=lambda f: {'session_pk': f.open_session.pk, 'performance_pk': f.spare_set.pk},
+        setup=_fresh_set,
+    ),
+    'export_history': Route(query=lambda f: {'format': 'csv'}),
+    'queue_export': Route(method='post', data=lambda f: {'format': 'csv'}),
+    'import_history': Route(),
+    'job_detail': Route(kwargs=lambda f: {'pk': f.export_job.pk}),
+    'job_download': Route(kwargs=lambda f: {'pk': f.export_job.pk}),
+    'analysis': Route(),
+    'analysis_chart_data': Route(
+        kwargs=lambda f: {'kind': 'weight'},
+        query=lambda f: {'exercise': f.exercise.pk},
+    ),
+    'chart_cache_stats': Route(),
+    'share_workout': Route(kwargs=lambda f: {'pk': f.workout.pk}),
+    'shared_workouts': Route(),
+    'accept_shared_workout': Route(kwargs=lambda f: {'pk': f.incoming_share.pk}, setup=_fresh_share),
+    'decline_shared_workout': Route(kwargs=lambda f: {'pk': f.incoming_share.pk}, setup=_fresh_share),
+}
+
+# Extra variants of routes worth tracking separately
+VARIANTS = {
+    'session_detail [record set]': ('session_detail', Route(
+        method='post',
+        kwargs=lambda f: {'pk': f.open_session.pk},
+        data=lambda f: {'exercise': f.open_exercise.pk, 'reps': 8, 'weight': '60'},
+    )),
+    'session_detail [record set, htmx]': ('session_detail', Route(
+        method='post',
+        kwargs=lambda f: {'pk': f.open_session.pk},
+        data=lambda f: {'exercise': f.open_exercise.pk, 'reps': 8, 'weight': '60'},
+        headers={'HX-Request': 'true'},
+    )),
+    'delete_performance [htmx]': ('delete_performance', Route(
+        method='post',
+        kwargs=lambda f: {'session_pk': f.open_session.pk, 'performance_pk': f.spare_set.pk},
+        setup=_fresh_set,
+        headers={'HX-Request': 'true'},
+    )),
+    'import_history [500 sets]': ('import_history', Route(method='post', data=lambda f: {'file': _import_file(f)})),
+    'export_history [jsonl]': ('export_history', Route(query=lambda f: {'format': 'jsonl'})),
+    'job_detail [htmx]': ('job_detail', Route(kwargs=lambda f: {'pk': f.export_job.pk}, headers={'HX-Request': 'true'})),
+    'analysis_chart_data [frequency]': ('analysis_chart_data', Route(kwargs=lambda f: {'kind': 'frequency'})),
+    'analysis_chart_data [monthly]': ('analysis_chart_data', Route(kwargs=lambda f: {'kind': 'monthly'})),
+    'analysis_chart_data [completion]': ('analysis_chart_data', Route(kwargs=lambda f: {'kind': 'completion'})),
+    'analysis_chart_data [rest]': ('analysis_chart_data', Route(kwargs=lambda f: {'kind': 'rest'})),
+}
+
+
+class Fixtures:
+    """Objects of the benchmarked user that the routes are called with"""
+
+    def __init__(self, user):
+        self.user = user
+        self.exercise = Exercise.objects.filter(user=user).order_by('pk').first()
+        self.workout = Workout.objects.filter(user=user).order_by('pk').first()
+        self.workout_exercise_id = self.workout.workoutexercise_set.first().exercise_id
+        # A new open session per run, so sets logged by earlier runs don't pile up
+        WorkoutSession.objects.filter(user=user, finished_at__isnull=True).delete()
+        self.open_session = WorkoutSession.objects.create(user=user, workout=self.workout)
+        self.open_exercise = self.workout.workoutexercise_set.first().exercise
+        self.other_user, _ = User.objects.get_or_create(username=f'{user.username}-friend')
+        self.other_workout, _ = Workout.objects.get_or_create(name='Shared', user=self.other_user)
+        # A finished export, for the job status and download pages
+        self.export_job = jobs.run_job(jobs.enqueue('export_history', user=user, format='csv').pk)
+
+
+class QueryTimer:
+    """connection.execute_wrapper hook counting queries and their total time"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+def seed(label, sets, max_user_sets):
+    prefix = f'bench-{label}-'
+    user = User.objects.filter(username=f'{prefix}0').first()
+    if user is None:
+        per_user = min(sets, max_user_sets)
+        users = max(1, round(sets / per_user))
+        print(f"Seeding {label}: {users} users x ~{per_user} sets")
+        call_command(
+            'seed_gym', users=users, sessions=max(1, per_user // SETS_PER_SESSION),
+            prefix=prefix, seed=42, stdout=open(os.devnull, 'w'),
+        )
+        user = User.objects.get(username=f'{prefix}0')
+    if not user.is_staff:
+        user.is_staff = True
+        user.save(update_fields=['is_staff'])
+    return user
+
+
+def measure(client, fixtures, route, name, repeat, warm):
+    call = getattr(client, route.method)
+    walls, sql_times, queries, peaks, status = [], [], [], [], None
+
+    for run in range(repeat * 2):
+        if route.setup:
+            route.setup(fixtures)
+        if not warm:
+            caches['charts'].clear()
+        url = reverse(f'workouts:{name}', kwargs=route.kwargs(fixtures))
+        args = route.data(fixtures) if route.method == 'post' else route.query(fixtures)
+
+        # Alternate plain timing runs with tracemalloc runs, which slow Python down
+        tracing = run % 2 == 1
+        timer = QueryTimer()
+        if tracing:
+            tracemalloc.start()
+        started = time.perf_counter()
+        extra = {'content_type': route.content_type} if route.content_type else {}
+        if route.headers:
+            extra['headers'] = route.headers
+        with connection.execute_wrapper(timer):
+            response = call(url, args, **extra)
+            if response.streaming:
+                # Streamed bodies are only produced as they are read
+                for _ in response.streaming_content:
+                    pass
+        elapsed = time.perf_counter() - started
+        if tracing:
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+            tracemalloc.stop()
+        else:
+            walls.append(elapsed * 1000)
+            sql_times.append(timer.seconds * 1000)
+            queries.append(timer.count)
+        status = response.status_code
+
+    return {
+        'status': status,
+        'wall_ms': round(statistics.median(walls), 2),
+        'sql_ms': round(statistics.median(sql_times), 2),
+        'queries': int(statistics.median(queries)),
+        'peak_kb': round(max(peaks), 1),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Regressions of wall time, query count or peak memory beyond the threshold"""
+    regressions = []
+    for scale, routes in results.items():
+        for name, current in routes.items():
+            previous = baseline.get(scale, {}).get(name)
+            if previous is None:
+                continue
+            for metric in ('wall_ms', 'queries', 'peak_kb'):
+                before, after = previous[metric], current[metric]
+                if before and (after - before) / before > threshold:
+                    regressions.append(f"{scale} {name}: {metric} {before} -> {after}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scales', default='1k,100k,1M')
+    parser.add_argument('--max-user-sets', type=int, default=50_000,
+                        help="History size of one seeded user; larger scales add users")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', help="Comma separated route names to run")
+    parser.add_argument('--warm', action='store_true', help="Keep the chart cache between requests")
+    parser.add_argument('--output', default=str(ROOT / 'benchmarks' / 'results.json'))
+    parser.add_argument('--baseline', help="Previous result file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25)
+    args = parser.parse_args()
+
+    named = {
+        p.name for p in get_resolver('workouts.urls').url_patterns if getattr(p, 'name', None)
+    }
+    missing = named - set(ROUTES)
+    if missing:
+        parser.error(f"No benchmark spec for routes: {', '.join(sorted(missing))}")
+    routes = {name: (name, route) for name, route in ROUTES.items()}
+    routes.update(VARIANTS)
+    if args.only:
+        wanted = set(args.only.split(','))
+        routes = {label: spec for label, spec in routes.items() if spec[0] in wanted}
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+
+    results = {}
+    for label in args.scales.split(','):
+        if label not in SCALES:
+            parser.error(f"Unknown scale {label}; choose from {', '.join(SCALES)}")
+        user = seed(label, SCALES[label], args.max_user_sets)
+        fixtures = Fixtures(user)
+        client = Client()
+        client.force_login(user)
+
+        results[label] = {}
+        print(f"\n{label} sets ({ExercisePerformance.objects.filter(workout_session__user=user).count()} for {user.username})")
+        print(f"  {'route':40} {'status':>6} {'wall ms':>9} {'queries':>8} {'sql ms':>8} {'peak KB':>9}")
+        for route_label, (name, route) in routes.items():
+            result = measure(client, fixtures, route, name, args.repeat, args.warm)
+            results[label][route_label] = result
+            print(f"  {route_label:40} {result['status']:>6} {result['wall_ms']:>9.1f} "
+                  f"{result['queries']:>8} {result['sql_ms']:>8.1f} {result['peak_kb']:>9.0f}")
+
+    Path(args.output).write_text(json.dumps({
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'repeat': args.repeat,
+            'warm': args.warm,
+        },
+        'results': results,
+    }, indent=2))
+    print(f"\nWrote {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == '__main__':
+    main()
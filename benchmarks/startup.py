@@ -0,0 +1,89 @@
+"""
+Measure cold worker startup: ``django.setup()`` plus URL resolution.
+
+Each sample runs in a fresh interpreter, like a newly forked gunicorn worker
+before its first request. It reports wall time, resident memory (RSS) and
+whether numpy, pandas or plotly got imported. ``--with-analytics`` also
+imports the analysis engine, which is what every worker paid up front
+before the analytics stack was loaded lazily.
+
+Usage:
+    python benchmarks/startup.py [--samples 5] [--with-analytics]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PROBE = r'''
+import json, os, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver, resolve
+resolver = get_resolver()
+resolver.url_patterns
+for url in ('/', '/sessions/', '/sessions/1/', '/workouts/', '/exercises/'):
+    resolve(url)
+if {with_analytics}:
+    import workouts.engine
+elapsed = time.perf_counter() - started
+
+rss_kb = None
+with open('/proc/self/status') as status:
+    for line in status:
+        if line.startswith('VmRSS:'):
+            rss_kb = int(line.split()[1])
+if rss_kb is None:
+    import resource
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+print(json.dumps({{
+    'seconds': elapsed,
+    'rss_mb': rss_kb / 1024,
+    'loaded': sorted(m for m in ('numpy', 'pandas', 'plotly') if m in sys.modules),
+}}))
+'''
+
+
+def sample(with_analytics):
+    env = {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': 'gym_ebros.settings',
+        'DATABASE_URL': os.environ.get('DATABASE_URL', 'sqlite:///:memory:'),
+    }
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(with_analytics=with_analytics)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(label, samples):
+    seconds = [s['seconds'] * 1000 for s in samples]
+    rss = [s['rss_mb'] for s in samples]
+    print(f"{label}:")
+    print(f"  startup  median {statistics.median(seconds):7.1f} ms  (min {min(seconds):.1f})")
+    print(f"  RSS      median {statistics.median(rss):7.1f} MB")
+    print(f"  loaded   {', '.join(samples[0]['loaded']) or 'none of numpy/pandas/plotly'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--with-analytics', action='store_true',
+                        help="Also measure a worker that imports the analytics stack")
+    args = parser.parse_args()
+
+    report('lazy (default worker)', [sample(False) for _ in range(args.samples)])
+    if args.with_analytics:
+        report('with analytics loaded', [sample(True) for _ in range(args.samples)])
+
+
+if __name__ == '__main__':
+    main()
@@ -17,4 +17,7 @@ GRANT ALL ON SCHEMA public TO public;
 EOF
 
 # Apply migrations
-python manage.py migrate 
\ No newline at end of file
+python manage.py migrate
+
+# Create the table used when CHART_CACHE_BACKEND=db
+python manage.py createcachetable
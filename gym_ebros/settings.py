@@ -36,6 +36,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'workouts.middleware.QueryStatsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -72,6 +73,79 @@ DATABASES = {
     )
 }
 
+# Caches
+# Rendered analysis charts go to the 'charts' alias. CHART_CACHE_BACKEND picks
+# local memory (per process, LRU), file or database storage; the last two are
+# shared between workers. The database backend needs `manage.py createcachetable`.
+CHART_CACHE_BACKEND = os.environ.get('CHART_CACHE_BACKEND', 'locmem')
+CHART_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'gym-ebros-charts',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CHART_CACHE_DIR', BASE_DIR / '.chart_cache'),
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'chart_cache',
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'charts': {
+        **CHART_CACHE_BACKENDS[CHART_CACHE_BACKEND],
+        'TIMEOUT': int(os.environ.get('CHART_CACHE_TIMEOUT', 60 * 60 * 24 * 7)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('CHART_CACHE_MAX_ENTRIES', 2000)),
+        },
+    },
+}
+
+# SQL query instrumentation (workouts.middleware.QueryStatsMiddleware):
+# fraction of requests measured, 0 disables it, and how often one statement
+# shape may run in a request before it is logged as a likely N+1
+QUERY_STATS_SAMPLE_RATE = float(os.environ.get('QUERY_STATS_SAMPLE_RATE', '1.0' if DEBUG else '0.05'))
+QUERY_STATS_REPEAT_THRESHOLD = int(os.environ.get('QUERY_STATS_REPEAT_THRESHOLD', 10))
+
+# Async analysis views (workouts.concurrency): threads, each with its own
+# database connection, running a request's independent queries at once;
+# 0 runs them one after another
+ANALYSIS_QUERY_THREADS = int(os.environ.get('ANALYSIS_QUERY_THREADS', 4))
+
+# Chart building (workouts.chart_workers): worker processes summarizing chart
+# data off the request thread, 0 (the default) summarizes inline. Only worth
+# it with spare cores. Smaller inputs than CHART_PROCESS_MIN_ROWS always run
+# inline, and so does a call the pool doesn't answer within
+# CHART_PROCESS_TIMEOUT seconds
+CHART_PROCESSES = int(os.environ.get('CHART_PROCESSES', 0))
+CHART_PROCESS_MIN_ROWS = int(os.environ.get('CHART_PROCESS_MIN_ROWS', 5000))
+CHART_PROCESS_TIMEOUT = float(os.environ.get('CHART_PROCESS_TIMEOUT', 10))
+
+# Background jobs (workouts.jobs). By default each job runs in the process
+# that queued it once its transaction commits, on one of JOBS_INLINE_THREADS
+# threads so the request doesn't wait for it (0 runs it in the request); set
+# JOBS_RUN_INLINE to false to leave them to `manage.py run_workers`, which
+# needs a shared chart cache (CHART_CACHE_BACKEND file or db). Uploaded
+# imports and finished exports are kept under JOB_FILES_DIR, which workers
+# and web processes must share.
+JOBS_RUN_INLINE = os.environ.get('JOBS_RUN_INLINE', 'True').lower() == 'true'
+JOBS_INLINE_THREADS = int(os.environ.get('JOBS_INLINE_THREADS', 2))
+JOB_FILES_DIR = os.environ.get('JOB_FILES_DIR', BASE_DIR / 'job_files')
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+# Attempts and first backoff (seconds) for transient database errors
+JOB_RETRY_ATTEMPTS = int(os.environ.get('JOB_RETRY_ATTEMPTS', 3))
+JOB_RETRY_WAIT = float(os.environ.get('JOB_RETRY_WAIT', 1))
+# A running job is given back to the queue after JOB_LOCK_TIMEOUT seconds,
+# unless it has been claimed JOB_MAX_ATTEMPTS times already
+JOB_LOCK_TIMEOUT = int(os.environ.get('JOB_LOCK_TIMEOUT', 15 * 60))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
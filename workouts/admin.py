@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Exercise, Workout, WorkoutExercise, WorkoutSession, ExercisePerformance
+from .models import Exercise, Workout, WorkoutExercise, WorkoutSession, ExercisePerformance, ExerciseDailyStats, TrainingPeriodStats, PersonalRecord, Job
 
 @admin.register(Exercise)
 class ExerciseAdmin(admin.ModelAdmin):
@@ -30,3 +30,27 @@ class ExercisePerformanceAdmin(admin.ModelAdmin):
     list_display = ('workout_session', 'exercise', 'set_number', 'reps', 'weight')
     search_fields = ('workout_session__workout__name', 'exercise__name')
     list_filter = ('workout_session__user', 'exercise')
+
+@admin.register(ExerciseDailyStats)
+class ExerciseDailyStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'exercise', 'day', 'set_count', 'max_weight', 'total_volume')
+    search_fields = ('exercise__name', 'user__username')
+    list_filter = ('user', 'day')
+
+@admin.register(TrainingPeriodStats)
+class TrainingPeriodStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'period', 'start', 'session_count', 'set_count', 'total_volume')
+    search_fields = ('user__username',)
+    list_filter = ('period', 'user')
+
+@admin.register(PersonalRecord)
+class PersonalRecordAdmin(admin.ModelAdmin):
+    list_display = ('user', 'exercise', 'max_weight', 'max_reps', 'max_set_volume', 'estimated_1rm', 'set_count')
+    search_fields = ('exercise__name', 'user__username')
+    list_filter = ('user',)
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'user', 'status', 'attempts', 'created_at', 'finished_at')
+    search_fields = ('kind', 'user__username')
+    list_filter = ('status', 'kind')
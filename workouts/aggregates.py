@@ -0,0 +1,63 @@
+"""
+Database aggregates not shipped with Django.
+
+PercentileCont compiles to PostgreSQL's ordered-set aggregate
+``percentile_cont(q) WITHIN GROUP (ORDER BY expr)``. SQLite has no
+percentile aggregate, so on SQLite connections the same interpolation is
+registered as a Python aggregate, ``percentile_cont(expr, q)``, when the
+connection is created. Either way it runs inside a normal grouped query.
+"""
+import math
+
+from django.db.backends.signals import connection_created
+from django.db.models import Aggregate, FloatField
+from django.dispatch import receiver
+
+
+class PercentileCont(Aggregate):
+    """Continuous percentile: linear interpolation between the two nearest values"""
+
+    function = 'percentile_cont'
+    name = 'PercentileCont'
+    output_field = FloatField()
+    template = '%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+
+    def __init__(self, expression, fraction, **extra):
+        if not 0 <= fraction <= 1:
+            raise ValueError("fraction must be between 0 and 1")
+        self.fraction = float(fraction)
+        super().__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, fraction=self.fraction, **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='%(function)s(%(distinct)s%(expressions)s, %(fraction)s)', **extra_context
+        )
+
+
+class _SQLitePercentileCont:
+    def __init__(self):
+        self.values = []
+        self.fraction = None
+
+    def step(self, value, fraction):
+        self.fraction = fraction
+        if value is not None:
+            self.values.append(float(value))
+
+    def finalize(self):
+        if not self.values:
+            return None
+        self.values.sort()
+        position = (len(self.values) - 1) * self.fraction
+        lower, upper = math.floor(position), math.ceil(position)
+        return self.values[lower] + (self.values[upper] - self.values[lower]) * (position - lower)
+
+
+@receiver(connection_created)
+def register_sqlite_aggregates(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        connection.connection.create_aggregate('percentile_cont', 2, _SQLitePercentileCont)
@@ -1,97 +1,102 @@
-from django.shortcuts import render
+from asgiref.sync import async_to_sync, sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db import models
-from django.db.models import Count, F, ExpressionWrapper, FloatField
-from django.db.models.functions import ExtractWeek, ExtractYear
-from .models import ExercisePerformance, WorkoutSession, WorkoutExercise
-import pandas as pd
-import plotly.express as px
+from django.db.models import Avg, Count, F, ExpressionWrapper, FloatField, Max, Sum
+from django.http import Http404, JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from .models import (
+    Exercise, ExerciseDailyStats, ExercisePerformance, PersonalRecord, SharedWorkout, TrainingPeriodStats, Workout,
+    WorkoutSession, WorkoutExercise
+)
+from . import chart_cache, chart_workers, concurrency
+from .aggregates import PercentileCont
+from .rollups import SET_VOLUME
+from functools import partial
+import hashlib
 
-@login_required
-def workout_analysis(request):
-    # Get user's workout data
-    performances = ExercisePerformance.objects.filter(
-        workout_session__user=request.user,
-        workout_session__finished_at__isnull=False
-    ).select_related('exercise', 'workout_session')
-    
-    if not performances.exists():
-        messages.info(request, "No completed workout sessions found. Complete some workouts to see your progress!")
-        return render(request, 'workouts/analysis.html')
-    
-    # Convert to DataFrame for easier analysis
-    df = pd.DataFrame(list(performances.values(
-        'exercise__name', 'reps', 'weight', 'performed_at',
-        'workout_session__started_at', 'workout_session__finished_at'
-    )))
-    
-    # 1. Weight Progression
-    weight_progress = {}
-    for exercise in df['exercise__name'].unique():
-        exercise_data = df[df['exercise__name'] == exercise]
-        fig = px.line(
-            exercise_data,
-            x='performed_at',
-            y='weight',
-            title=f'Weight Progression - {exercise}',
-            labels={'weight': 'Weight (kg)', 'performed_at': 'Date'}
-        )
-        weight_progress[exercise] = fig.to_html(full_html=False)
-    
-    # 2. Volume Progression (weight × reps)
-    df['volume'] = df['weight'] * df['reps']
-    volume_progress = {}
-    for exercise in df['exercise__name'].unique():
-        exercise_data = df[df['exercise__name'] == exercise]
-        daily_volume = exercise_data.groupby('performed_at')['volume'].sum().reset_index()
-        fig = px.line(
-            daily_volume,
-            x='performed_at',
-            y='volume',
-            title=f'Volume Progression - {exercise}',
-            labels={'volume': 'Volume (kg × reps)', 'performed_at': 'Date'}
-        )
-        volume_progress[exercise] = fig.to_html(full_html=False)
-    
-    # 3. Workout Frequency Analysis
-    sessions = WorkoutSession.objects.filter(
-        user=request.user,
-        finished_at__isnull=False
-    ).annotate(
-        week=ExtractWeek('started_at'),
-        year=ExtractYear('started_at')
-    ).values('week', 'year').annotate(
-        count=Count('id')
-    ).order_by('year', 'week')
-    
-    freq_data = pd.DataFrame(list(sessions))
-    if not freq_data.empty:
-        fig = px.bar(
-            freq_data,
-            x='week',
-            y='count',
-            title='Workouts per Week',
-            labels={'count': 'Number of Workouts', 'week': 'Week Number'}
-        )
-        workout_frequency = fig.to_html(full_html=False)
-    else:
-        workout_frequency = None
-    
-    # 4. Personal Records
-    prs = {}
-    for exercise in df['exercise__name'].unique():
-        exercise_data = df[df['exercise__name'] == exercise]
-        prs[exercise] = {
-            'max_weight': exercise_data['weight'].max(),
-            'max_volume': exercise_data['volume'].max(),
-            'max_reps': exercise_data['reps'].max(),
-            'total_volume': exercise_data['volume'].sum()
-        }
-    
-    # 5. Exercise Completion Rate
-    completion_data = WorkoutExercise.objects.filter(
-        workout__user=request.user
+WEIGHT_PERCENTILES = {'25th': 0.25, '50th': 0.50, '75th': 0.75}
+
+def _engine():
+    # The engine pulls in numpy and pandas. Importing it on first use keeps
+    # them out of workers that only serve session logging and CRUD pages.
+    from . import engine
+    return engine
+
+def chart_payload(chart_type, title, x, y, x_label, y_label, **layout):
+    """Compact columnar chart description, rendered client-side with Plotly.js"""
+    return {
+        'type': chart_type,
+        'title': title,
+        'x': list(x),
+        'y': list(y),
+        'labels': {'x': x_label, 'y': y_label},
+        'layout': layout,
+    }
+
+def _daily_summary(user, exercise=None):
+    daily_stats = ExerciseDailyStats.objects.filter(user=user)
+    if exercise is not None:
+        daily_stats = daily_stats.filter(exercise_id=exercise)
+    fields = (
+        'exercise_id', 'exercise__name', 'day', 'max_weight', 'max_reps', 'max_set_volume',
+        'total_volume', 'rest_seconds', 'rest_intervals'
+    )
+    rows = chart_workers.columns(daily_stats.values_list(*fields), fields)
+    return chart_workers.run(_engine().summarize_daily, rows)
+
+def _weight_payload(data):
+    # Heaviest set per day
+    days, weights = (data['days'], data['max_weight'].tolist()) if data else ([], [])
+    return chart_payload(
+        'line', f"Weight Progression - {data['name'] if data else ''}", _engine().iso_dates(days), weights,
+        'Date', 'Weight (kg)'
+    )
+
+def _volume_payload(data):
+    # Weight × reps, summed per day
+    days, volume = (data['days'], data['volume'].tolist()) if data else ([], [])
+    return chart_payload(
+        'line', f"Volume Progression - {data['name'] if data else ''}", _engine().iso_dates(days), volume,
+        'Date', 'Volume (kg × reps)'
+    )
+
+def _weight_data(user, exercise):
+    return _weight_payload(_daily_summary(user, exercise).get(exercise))
+
+def _volume_data(user, exercise):
+    return _volume_payload(_daily_summary(user, exercise).get(exercise))
+
+def _period_stats(user, period):
+    return TrainingPeriodStats.objects.filter(user=user, period=period)
+
+def _frequency_data(user, exercise=None):
+    # Read from the weekly rollups, labelled with the ISO week
+    weeks = [
+        (start.isocalendar(), count)
+        for start, count in _period_stats(user, TrainingPeriodStats.WEEK).values_list('start', 'session_count')
+    ]
+    return chart_payload(
+        'bar', 'Workouts per Week',
+        [f"{iso.year}-W{iso.week:02d}" for iso, _ in weeks],
+        [count for _, count in weeks],
+        'Week', 'Number of Workouts'
+    )
+
+def _monthly_data(user, exercise=None):
+    months = list(_period_stats(user, TrainingPeriodStats.MONTH).values_list('start', 'total_volume'))
+    return chart_payload(
+        'bar', 'Training Volume per Month',
+        [start.strftime('%Y-%m') for start, _ in months],
+        [float(volume) for _, volume in months],
+        'Month', 'Volume (kg × reps)'
+    )
+
+def _completion_data(user, exercise=None):
+    completion_data = list(WorkoutExercise.objects.filter(
+        workout__user=user
     ).annotate(
         completed_count=Count('workout__workoutsession__exerciseperformance',
                             filter=models.Q(
@@ -102,53 +107,281 @@ def workout_analysis(request):
             F('completed_count') * 100.0 / Count('workout__workoutsession'),
             output_field=FloatField()
         )
+    ))
+
+    return chart_payload(
+        'bar', 'Exercise Completion Rate',
+        [row['exercise__name'] for row in completion_data],
+        [row['completion_rate'] for row in completion_data],
+        'Exercise', 'Completion Rate (%)'
+    )
+
+def _rest_data(user, exercise=None):
+    # Gaps between sets within the same day
+    rest_times = [
+        (data['name'], data['avg_rest'])
+        for data in _daily_summary(user).values()
+        if data['avg_rest'] is not None
+    ]
+    return chart_payload(
+        'bar', 'Average Rest Time Between Sets',
+        [name for name, _ in rest_times],
+        [avg_rest for _, avg_rest in rest_times],
+        'Exercise', 'Rest Time (minutes)'
+    )
+
+CHART_BUILDERS = {
+    'weight': _weight_data,
+    'volume': _volume_data,
+    'frequency': _frequency_data,
+    'monthly': _monthly_data,
+    'completion': _completion_data,
+    'rest': _rest_data,
+}
+
+def _session_weight_summary(workout, exercises):
+    fields = ('exercise_id', 'exercise__name', 'weight', 'reps', 'workout_session__started_at')
+    performances = ExercisePerformance.objects.filter(
+        workout_session__workout=workout,
+        exercise_id__in=exercises,
+        workout_session__finished_at__isnull=False
+    ).values_list(*fields)
+    rows = chart_workers.columns(performances, fields)
+    return chart_workers.run(_engine().summarize_sets, rows, 'workout_session__started_at')
+
+def _session_weight_payload(exercise, data):
+    # Average weight per completed session of this workout
+    times, weights = (data['times'], data['avg_weight'].tolist()) if data else ([], [])
+    return chart_payload(
+        'line', f'Weight Progression - {exercise.name}', _engine().iso_dates(times, unit='m'), weights,
+        'Date', 'Average Weight (kg)',
+        height=400, displayModeBar=False
+    )
+
+def _session_weight_data(workout, exercise):
+    return _session_weight_payload(exercise, _session_weight_summary(workout, [exercise.pk]).get(exercise.pk))
+
+def prerender_charts(user, workout=None):
+    """
+    Build what the analysis pages will ask for next into the chart cache:
+    the user's personal records and charts, and with ``workout`` its
+    statistics and charts. Returns the kinds built.
+
+    A finished session moves the whole scope to a new data version, so every
+    exercise's charts are built, each group from one summary query rather
+    than one per exercise.
+    """
+    scope = chart_cache.user_scope(user.pk)
+    async_to_sync(chart_cache.aget_or_render)(scope, 'prs', partial(_personal_records, user))
+    kinds = ['prs']
+    for kind in ('frequency', 'monthly', 'completion', 'rest'):
+        chart_cache.get_or_render(scope, f'data:{kind}', partial(CHART_BUILDERS[kind], user))
+        kinds.append(kind)
+    for exercise, data in _daily_summary(user).items():
+        chart_cache.get_or_render(scope, 'data:weight', partial(_weight_payload, data), exercise=str(exercise))
+        chart_cache.get_or_render(scope, 'data:volume', partial(_volume_payload, data), exercise=str(exercise))
+    kinds += ['weight', 'volume']
+
+    if workout is not None:
+        async_to_sync(workout_stats)(workout)
+        scope = chart_cache.workout_scope(workout.pk)
+        exercises = [
+            workout_exercise.exercise for workout_exercise in workout.workoutexercise_set.select_related('exercise')
+        ]
+        summary = _session_weight_summary(workout, [exercise.pk for exercise in exercises])
+        for exercise in exercises:
+            chart_cache.get_or_render(
+                scope, 'data:session_weight', partial(_session_weight_payload, exercise, summary.get(exercise.pk)),
+                exercise=str(exercise.pk)
+            )
+        kinds += ['workout_stats', 'session_weight']
+    return kinds
+
+def _etag(scope, kind, exercise):
+    exercise_part = hashlib.md5((exercise or '').encode()).hexdigest()[:8]
+    return f"{kind}-{exercise_part}-{chart_cache.data_version(scope)}"
+
+def _user_chart_etag(request, kind):
+    return _etag(chart_cache.user_scope(request.user.pk), kind, request.GET.get('exercise'))
+
+def _user_chart_last_modified(request, kind):
+    return chart_cache.last_modified(chart_cache.user_scope(request.user.pk))
+
+def _workout_chart_etag(request, pk, kind):
+    return _etag(chart_cache.workout_scope(pk), kind, request.GET.get('exercise'))
+
+def _workout_chart_last_modified(request, pk, kind):
+    return chart_cache.last_modified(chart_cache.workout_scope(pk))
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_user_chart_etag, last_modified_func=_user_chart_last_modified)
+def analysis_chart_data(request, kind):
+    """JSON data for one chart of the analysis page"""
+    builder = CHART_BUILDERS.get(kind)
+    if builder is None:
+        raise Http404(f"Unknown chart {kind}")
+    # Exercises are passed by id, as two of them may share a name
+    exercise = request.GET.get('exercise')
+    if kind in ('weight', 'volume') and not (exercise and exercise.isdigit()):
+        raise Http404("An exercise is required for this chart")
+
+    payload = chart_cache.get_or_render(
+        chart_cache.user_scope(request.user.pk), f'data:{kind}',
+        lambda: builder(request.user, exercise and int(exercise)), exercise=exercise
+    )
+    return JsonResponse(payload)
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_workout_chart_etag, last_modified_func=_workout_chart_last_modified)
+def workout_chart_data(request, pk, kind):
+    """JSON data for one chart of the workout-specific analysis"""
+    workout = get_object_or_404(Workout, pk=pk)
+    if not (workout.user_id == request.user.pk or SharedWorkout.objects.filter(
+        workout=workout, shared_with=request.user, is_accepted=True
+    ).exists()):
+        raise Http404("Workout not found")
+    exercise = request.GET.get('exercise')
+    if kind != 'session_weight' or not (exercise and exercise.isdigit()):
+        raise Http404(f"Unknown chart {kind}")
+
+    def render_chart():
+        exercises = Exercise.objects.filter(workoutexercise__workout=workout).distinct()
+        return _session_weight_data(workout, get_object_or_404(exercises, pk=exercise))
+
+    payload = chart_cache.get_or_render(
+        chart_cache.workout_scope(workout.pk), f'data:{kind}', render_chart, exercise=exercise
+    )
+    return JsonResponse(payload)
+
+async def _personal_records(user):
+    # One indexed read of the ledger, which is kept up to date as sets are logged
+    personal_records = PersonalRecord.objects.filter(user=user).values(
+        'exercise_id', 'exercise__name', 'max_weight', 'max_reps', 'max_set_volume', 'estimated_1rm', 'total_volume',
+    ).order_by('first_performed_at', 'exercise__name')
+
+    return {row['exercise_id']: row async for row in personal_records}
+
+@concurrency.login_required
+async def workout_analysis(request):
+    # Only the personal records are computed here, or read from the chart
+    # cache; the page fetches every chart lazily from analysis_chart_data
+    prs = await chart_cache.aget_or_render(
+        chart_cache.user_scope(request.user.pk), 'prs', partial(_personal_records, request.user)
+    )
+
+    if not prs:
+        messages.info(request, "No completed workout sessions found. Complete some workouts to see your progress!")
+        return await sync_to_async(render)(request, 'workouts/analysis.html')
+
+    context = {
+        'personal_records': prs,
+    }
+
+    return await sync_to_async(render)(request, 'workouts/analysis.html', context)
+
+async def _workout_stats(workout):
+    # The session overview, the template and the per-exercise stats don't
+    # depend on each other, so the three queries run concurrently
+    finished = models.Q(finished_at__isnull=False)
+    session_stats, workout_exercises, performance_stats = await concurrency.gather(
+        lambda: WorkoutSession.objects.filter(workout=workout).aggregate(
+            total_sessions=Count('id', filter=finished),
+            all_sessions=Count('id'),
+            unique_users=Count('user', filter=finished, distinct=True),
+            avg_duration=Avg(
+                ExpressionWrapper(F('finished_at') - F('started_at'), output_field=models.DurationField()),
+                filter=finished
+            ),
+        ),
+        lambda: list(workout.workoutexercise_set.select_related('exercise')),
+        # Stats and weight percentiles for every exercise of the workout
+        # come back from a single grouped query
+        lambda: list(ExercisePerformance.objects.filter(
+            workout_session__workout=workout,
+            exercise__in=WorkoutExercise.objects.filter(workout=workout).values('exercise_id'),
+            workout_session__finished_at__isnull=False
+        ).values('exercise_id').annotate(
+            avg_weight=Avg('weight', output_field=FloatField()),
+            max_weight=Max('weight'),
+            avg_reps=Avg('reps', output_field=FloatField()),
+            max_reps=Max('reps'),
+            total_sets=Count('id'),
+            max_volume=Max(SET_VOLUME),
+            total_volume=Sum(SET_VOLUME),
+            **{f'p{label}': PercentileCont('weight', q) for label, q in WEIGHT_PERCENTILES.items()}
+        ).order_by()),
     )
     
-    completion_df = pd.DataFrame(list(completion_data))
-    if not completion_df.empty:
-        fig = px.bar(
-            completion_df,
-            x='exercise__name',
-            y='completion_rate',
-            title='Exercise Completion Rate',
-            labels={'completion_rate': 'Completion Rate (%)', 'exercise__name': 'Exercise'}
-        )
-        completion_chart = fig.to_html(full_html=False)
-    else:
-        completion_chart = None
+    if not session_stats['total_sessions']:
+        return {'total_sessions': 0}
     
-    # 6. Rest Time Analysis
-    rest_times = []
-    for exercise in df['exercise__name'].unique():
-        exercise_data = df[df['exercise__name'] == exercise].sort_values('performed_at')
-        if len(exercise_data) > 1:
-            rest_time = exercise_data['performed_at'].diff().mean()
-            if pd.notnull(rest_time):
-                rest_times.append({
-                    'exercise': exercise,
-                    'avg_rest': rest_time.total_seconds() / 60  # Convert to minutes
-                })
+    total_sessions = session_stats['total_sessions']
+    unique_users = session_stats['unique_users']
+    completion_rate = total_sessions / session_stats['all_sessions'] * 100
     
-    rest_df = pd.DataFrame(rest_times)
-    if not rest_df.empty:
-        fig = px.bar(
-            rest_df,
-            x='exercise',
-            y='avg_rest',
-            title='Average Rest Time Between Sets',
-            labels={'avg_rest': 'Rest Time (minutes)', 'exercise': 'Exercise'}
-        )
-        rest_chart = fig.to_html(full_html=False)
-    else:
-        rest_chart = None
+    # Format the average duration
+    avg_duration = session_stats['avg_duration']
+    if avg_duration:
+        hours = avg_duration.total_seconds() // 3600
+        minutes = (avg_duration.total_seconds() % 3600) // 60
+        avg_duration = f"{int(hours)}h {int(minutes)}m"
+    
+    stats_by_exercise = {row.pop('exercise_id'): row for row in performance_stats}
+    
+    exercise_stats = {}
+    for exercise in workout_exercises:
+        row = stats_by_exercise.get(exercise.exercise_id)
+        if row is None:
+            continue
+        
+        percentiles = {label: row.pop(f'p{label}') for label in WEIGHT_PERCENTILES}
+        # The weight progression chart is fetched lazily from workout_chart_data
+        exercise_stats[exercise.exercise_id] = {
+            'name': exercise.exercise.name,
+            'stats': row,
+            'percentiles': {
+                'weight': percentiles
+            }
+        }
+    
+    return {
+        'total_sessions': total_sessions,
+        'unique_users': unique_users,
+        'completion_rate': completion_rate,
+        'avg_duration': avg_duration,
+        'exercise_stats': exercise_stats,
+    }
+
+async def workout_stats(workout):
+    """The workout analysis figures, from the chart cache when they are there"""
+    return await chart_cache.aget_or_render(
+        chart_cache.workout_scope(workout.pk), 'stats', partial(_workout_stats, workout)
+    )
+
+@concurrency.login_required
+async def workout_specific_analysis(request, pk):
+    try:
+        workout = await Workout.objects.aget(pk=pk)
+    except Workout.DoesNotExist:
+        raise Http404("Workout not found")
+    
+    # Check if user has access to this workout
+    if not (workout.user_id == request.user.pk or await SharedWorkout.objects.filter(
+        workout=workout, shared_with=request.user, is_accepted=True
+    ).aexists()):
+        messages.error(request, "You don't have permission to view this workout's analysis.")
+        return redirect('workouts:workout_list')
+    
+    stats = await workout_stats(workout)
+    if not stats['total_sessions']:
+        messages.info(request, "No completed sessions found for this workout yet.")
+        return redirect('workouts:workout_detail', pk=workout.pk)
     
     context = {
-        'weight_progress': weight_progress,
-        'volume_progress': volume_progress,
-        'workout_frequency': workout_frequency,
-        'personal_records': prs,
-        'completion_chart': completion_chart,
-        'rest_chart': rest_chart,
+        'workout': workout,
+        **stats,
     }
     
-    return render(request, 'workouts/analysis.html', context) 
\ No newline at end of file
+    return await sync_to_async(render)(request, 'workouts/workout_analysis.html', context)
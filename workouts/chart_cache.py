@@ -0,0 +1,122 @@
+"""
+Cache for analysis chart payloads.
+
+Entries live in the ``charts`` cache alias (see CHART_CACHE_BACKEND in
+settings) and are keyed by (scope, chart kind, exercise, data version).
+A scope is either a user, for the analysis page, or a workout, for the
+workout-specific analysis. Invalidation never deletes entries: it moves the
+scope's data version forward so old keys are simply never read again and age
+out of the cache through its normal eviction.
+
+Besides chart payloads, the analysis pages keep their own summaries here
+(the personal records, the workout statistics), so the same invalidation
+covers them.
+
+Data versions are nanosecond timestamps of the last invalidation, which lets
+the chart data endpoints use them for both ETag and Last-Modified.
+"""
+import hashlib
+import logging
+import time
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+logger = logging.getLogger(__name__)
+
+STATS_KEYS = ('hits', 'misses', 'invalidations')
+
+
+def _cache():
+    return caches['charts']
+
+
+def is_shared():
+    """Whether other processes see this one's entries and invalidations"""
+    return not isinstance(_cache(), LocMemCache)
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def workout_scope(workout_id):
+    return f'workout:{workout_id}'
+
+
+def _version_key(scope):
+    return f'charts:version:{scope}'
+
+
+def data_version(scope):
+    """Current data version of a scope, created on first use"""
+    cache = _cache()
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        # Start from a fresh timestamp so a version key that was evicted can
+        # never bring back entries built before the eviction
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def last_modified(scope):
+    return datetime.fromtimestamp(data_version(scope) / 1e9, tz=timezone.utc)
+
+
+def invalidate(scope):
+    _cache().set(_version_key(scope), time.time_ns(), timeout=None)
+    _count('invalidations')
+    logger.debug(f"Invalidated chart cache scope {scope}")
+
+
+def make_key(scope, kind, exercise=None):
+    exercise_part = hashlib.md5((exercise or '').encode()).hexdigest()
+    return f'charts:{scope}:{kind}:{exercise_part}:{data_version(scope)}'
+
+
+def _lookup(scope, kind, exercise):
+    key = make_key(scope, kind, exercise)
+    chart = _cache().get(key)
+    _count('misses' if chart is None else 'hits')
+    return key, chart
+
+
+def get_or_render(scope, kind, render, exercise=None):
+    """Return the cached chart for this key, building and storing it on a miss"""
+    key, chart = _lookup(scope, kind, exercise)
+    if chart is None:
+        chart = render()
+        _cache().set(key, chart)
+    return chart
+
+
+async def aget_or_render(scope, kind, render, exercise=None):
+    """get_or_render() for async views; ``render`` is a coroutine function"""
+    key, chart = await sync_to_async(_lookup)(scope, kind, exercise)
+    if chart is None:
+        chart = await render()
+        await sync_to_async(_cache().set)(key, chart)
+    return chart
+
+
+def _count(name):
+    cache = _cache()
+    key = f'charts:stats:{name}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def stats():
+    """Hit, miss and invalidation counters plus the hit ratio"""
+    cache = _cache()
+    counters = {name: cache.get(f'charts:stats:{name}', 0) for name in STATS_KEYS}
+    lookups = counters['hits'] + counters['misses']
+    counters['hit_ratio'] = counters['hits'] / lookups if lookups else None
+    return counters
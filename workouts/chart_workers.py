@@ -0,0 +1,131 @@
+"""
+Process pool for the CPU-bound half of chart building.
+
+Once a chart's rows are loaded, summarizing them in the engine is pure CPU
+work, and in a threaded gunicorn worker it holds the GIL against every other
+request the worker is serving. run() hands that step to a pool of
+CHART_PROCESSES worker processes, so concurrent chart requests use more than
+one core and the waiting request thread leaves the GIL to the others.
+
+Rows travel as a dict of numpy column arrays (see columns()), which pickle as
+flat buffers rather than one dict per row. The engine is called inline instead
+when:
+
+- the input has fewer than CHART_PROCESS_MIN_ROWS rows, as shipping it costs
+  more than summarizing it;
+- every worker process is already busy;
+- the pool doesn't answer within CHART_PROCESS_TIMEOUT seconds, or a worker
+  died.
+
+The workers are spawned rather than forked, so they don't inherit the
+parent's database connections or threads, and they only import the engine.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+EPOCH_ORDINAL = EPOCH.date().toordinal()
+MICROSECOND = timedelta(microseconds=1)
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+
+
+def _warm_up():
+    # Pay for the numpy and pandas imports when the pool starts, not on the
+    # first chart each worker gets
+    from . import engine  # noqa: F401
+
+
+def _pool():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                settings.CHART_PROCESSES, mp_context=multiprocessing.get_context('spawn'), initializer=_warm_up,
+            )
+            _slots = threading.BoundedSemaphore(settings.CHART_PROCESSES)
+        return _executor, _slots
+
+
+def _discard(executor):
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown():
+    """Stop the worker processes; the next run() starts a new pool"""
+    if _executor is not None:
+        _discard(_executor)
+
+
+def columns(rows, fields):
+    """
+    ``values_list(*fields)`` rows as ``{field: numpy array}``.
+
+    Decimals become floats and dates and datetimes ``datetime64`` (naive UTC),
+    the forms the engine converts them to anyway, going through ordinals and
+    epoch offsets because numpy parses date objects one by one.
+    """
+    import numpy as np
+
+    data = {}
+    for field, values in zip(fields, list(zip(*rows)) or [()] * len(fields)):
+        sample = values[0] if values else None
+        if isinstance(sample, datetime):
+            offsets = ((value - EPOCH) // MICROSECOND for value in values)
+            data[field] = np.fromiter(offsets, np.int64, len(values)).astype('datetime64[us]')
+        elif isinstance(sample, date):
+            days = np.fromiter(map(date.toordinal, values), np.int64, len(values))
+            data[field] = (days - EPOCH_ORDINAL).astype('datetime64[D]')
+        elif isinstance(sample, Decimal):
+            data[field] = np.fromiter(map(float, values), float, len(values))
+        else:
+            data[field] = np.array(values)
+    return data
+
+
+def run(func, data, *args):
+    """``func(data, *args)`` for an engine function ``func``, in the pool when it pays off"""
+    rows = len(next(iter(data.values()), ()))
+    if settings.CHART_PROCESSES <= 0 or rows < settings.CHART_PROCESS_MIN_ROWS:
+        return func(data, *args)
+
+    executor, slots = _pool()
+    if not slots.acquire(blocking=False):
+        logger.debug(f"Chart processes busy; running {func.__name__} inline")
+        return func(data, *args)
+    try:
+        future = executor.submit(func, data, *args)
+    except BrokenProcessPool:
+        slots.release()
+        _discard(executor)
+        return func(data, *args)
+    # The slot stays taken until the worker is done, even if we stop waiting
+    future.add_done_callback(lambda _: slots.release())
+
+    try:
+        return future.result(timeout=settings.CHART_PROCESS_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        logger.warning(
+            f"{func.__name__} on {rows} rows took over {settings.CHART_PROCESS_TIMEOUT}s in a chart process; "
+            f"running it inline"
+        )
+    except BrokenProcessPool:
+        logger.warning(f"A chart process died running {func.__name__}; restarting the pool")
+        _discard(executor)
+    return func(data, *args)
@@ -0,0 +1,88 @@
+"""
+Concurrent database reads for async views.
+
+Django's async ORM runs every query through ``sync_to_async`` on one shared
+thread, so an async view awaiting three querysets still runs them one after
+another. gather() instead runs independent reads on a bounded pool of
+ANALYSIS_QUERY_THREADS threads, each holding its own database connection,
+and awaits them together.
+
+Other connections can't see rows written in an uncommitted transaction (in
+tests, or with ATOMIC_REQUESTS), so inside one gather() falls back to running
+the reads in order on the request's own connection. Setting
+ANALYSIS_QUERY_THREADS to 0 does the same everywhere. When QueryStatsMiddleware
+samples the request, its recorder is installed on the pool threads'
+connections for the duration of each read, so their queries are counted.
+
+Under WSGI an async view costs an event loop per request (async_to_sync),
+which measured about 2-3 ms at the median on SQLite, while under ASGI the
+same pages got 2-6 ms faster. That overhead is kept as the price of one code
+path for both servers: run the app under ASGI to get the concurrency.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections, connection
+
+from .middleware import current_recorder
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _query_pool():
+    global _pool
+    if settings.ANALYSIS_QUERY_THREADS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.ANALYSIS_QUERY_THREADS, thread_name_prefix='query')
+        return _pool
+
+
+def _run_query(func, recorder=None):
+    # The connection housekeeping Django does around every request: drop the
+    # thread's connection once it is past CONN_MAX_AGE or unusable
+    close_old_connections()
+    try:
+        if recorder is None:
+            return func()
+        with connection.execute_wrapper(recorder):
+            return func()
+    finally:
+        close_old_connections()
+
+
+@sync_to_async
+def _in_transaction():
+    return connection.in_atomic_block
+
+
+async def gather(*queries):
+    """Run zero-argument callables that read the database; returns their results in order"""
+    pool = _query_pool()
+    if pool is None or len(queries) < 2 or await _in_transaction():
+        return [await sync_to_async(query)() for query in queries]
+    loop = asyncio.get_running_loop()
+    # Executor threads don't inherit the request's context: pass the recorder along
+    recorder = current_recorder.get()
+    return await asyncio.gather(*(loop.run_in_executor(pool, _run_query, query, recorder) for query in queries))
+
+
+def login_required(view):
+    """``login_required`` for async views, which Django's doesn't wrap before 5.1"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), settings.LOGIN_URL, REDIRECT_FIELD_NAME)
+        # Loaded already; saves the templates a second query for request.user
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
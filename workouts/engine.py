@@ -0,0 +1,235 @@
+"""
+Vectorized analysis engine shared by the analysis views.
+
+Rows are loaded into a frame with a categorical ``exercise`` column, sorted
+once by (exercise, time) and cut at the group boundaries. Exercises are told
+apart by ``exercise_id``, as two of a user's exercises may share a name; the
+names are only attached to the summaries afterwards. Rows without ids (older
+snapshots, the benchmarks) are grouped on the name instead. Every per-exercise
+series and statistic is then produced from that single pass with numpy
+``reduceat`` instead of one boolean mask per exercise and per chart.
+
+The engine has no Django dependency; callers pass it plain dicts as returned
+by ``QuerySet.values()``, a dict of column arrays or a frame read by
+``load_snapshot()``, and get plain numpy arrays and floats back.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+PERCENTILES = {'25th': 0.25, '50th': 0.50, '75th': 0.75}
+
+
+def build_frame(rows, time_col, float_cols=()):
+    """
+    Build a frame with a categorical exercise column from ``values()`` rows,
+    columns or a frame. The column holds ``exercise_id`` when the rows have
+    it, and ``exercise__name`` (or ``exercise``) otherwise.
+    """
+    if isinstance(rows, pd.DataFrame):
+        frame = rows.copy()
+    elif isinstance(rows, dict):
+        frame = pd.DataFrame(rows)
+    else:
+        frame = pd.DataFrame(list(rows))
+    if frame.empty:
+        return frame
+    if 'exercise__name' not in frame:
+        frame = frame.rename(columns={'exercise': 'exercise__name'})
+    keys = frame.pop('exercise_id') if 'exercise_id' in frame else frame['exercise__name']
+    # Keep the order in which exercises first appear, like Series.unique()
+    frame['exercise'] = pd.Categorical(keys, categories=pd.unique(keys))
+    # Naive UTC datetime64 so the time axis sorts and diffs as plain numbers;
+    # columns from chart_workers.columns() are in that form already
+    if not pd.api.types.is_datetime64_dtype(frame[time_col]):
+        frame[time_col] = pd.to_datetime(frame[time_col], utc=True).dt.tz_localize(None)
+    for column in float_cols:
+        frame[column] = frame[column].astype(float)
+    return frame
+
+
+def load_snapshot(root, table, user_id=None, columns=None):
+    """
+    Load a table written by ``manage.py snapshot_history`` into a frame.
+
+    Arrow IPC part files are memory-mapped, so their columns are read from
+    the page cache rather than copied through a database driver; Parquet
+    files are decoded from a memory map. With ``user_id`` only that user's
+    partition is read, or its rows when the snapshot isn't partitioned.
+    The frame can be passed to summarize_sets() like ``values()`` rows.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    directory = Path(root) / table
+    partitioned = user_id is not None and (directory / f'user_id={user_id}').is_dir()
+    if partitioned:
+        directory = directory / f'user_id={user_id}'
+
+    filter_rows = user_id is not None and not partitioned
+    read_columns = columns
+    if filter_rows and columns is not None and 'user_id' not in columns:
+        read_columns = [*columns, 'user_id']
+
+    tables = []
+    for path in sorted(directory.rglob('part-*')):
+        if path.suffix == '.arrow':
+            loaded = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+            if read_columns is not None:
+                loaded = loaded.select(read_columns)
+        elif path.suffix == '.parquet':
+            loaded = pq.read_table(path, columns=read_columns, memory_map=True)
+        else:
+            continue
+        if filter_rows:
+            loaded = loaded.filter(pc.equal(loaded['user_id'], user_id))
+            if columns is not None:
+                loaded = loaded.select(columns)
+        tables.append(loaded)
+    if not tables:
+        return pd.DataFrame(columns=columns or [])
+    return pa.concat_tables(tables).to_pandas()
+
+
+def iso_dates(values, unit='D'):
+    """ISO 8601 strings for a datetime64 (or date) array, truncated to ``unit``"""
+    return np.datetime_as_string(np.asarray(values, dtype=f'datetime64[{unit}]'), unit=unit).tolist()
+
+
+def _group(frame, time_col):
+    """
+    Sort a frame by (exercise, time) and return it with the group keys, the
+    names of their exercises and the group bounds
+    """
+    codes = frame['exercise'].cat.codes.to_numpy()
+    order = np.lexsort((frame[time_col].to_numpy(), codes))
+    frame = frame.iloc[order]
+    codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    keys = frame['exercise'].cat.categories[codes[starts]].tolist()
+    names = frame['exercise__name'].to_numpy()[starts].tolist()
+    bounds = np.r_[starts, len(codes)]
+    return frame, codes, keys, names, bounds
+
+
+def summarize_daily(rows):
+    """
+    Summarize ``ExerciseDailyStats`` rows per exercise.
+
+    Returns ``{exercise: {...}}``, keyed as described in build_frame(), with
+    the exercise's ``name``, the day axis, the heaviest set and the
+    summed volume per day, the all-time records and the average rest time
+    between sets (in minutes, ``None`` when there was never a gap to time).
+    The rest time is ``rest_seconds`` over ``rest_intervals``, as sets
+    logged in a batch have no gaps of their own.
+    """
+    frame = build_frame(
+        rows, 'day', float_cols=('max_weight', 'max_set_volume', 'total_volume')
+    )
+    if frame.empty:
+        return {}
+    frame, _, keys, names, bounds = _group(frame, 'day')
+    starts = bounds[:-1]
+
+    days = frame['day'].to_numpy()
+    max_weight = frame['max_weight'].to_numpy()
+    total_volume = frame['total_volume'].to_numpy()
+
+    pr_weight = np.maximum.reduceat(max_weight, starts)
+    pr_reps = np.maximum.reduceat(frame['max_reps'].to_numpy(), starts)
+    pr_volume = np.maximum.reduceat(frame['max_set_volume'].to_numpy(), starts)
+    volume_sum = np.add.reduceat(total_volume, starts)
+    rest_sum = np.add.reduceat(frame['rest_seconds'].to_numpy(), starts)
+    intervals = np.add.reduceat(frame['rest_intervals'].to_numpy(), starts)
+
+    summary = {}
+    for i, key in enumerate(keys):
+        start, end = bounds[i], bounds[i + 1]
+        summary[key] = {
+            'name': names[i],
+            'days': days[start:end],
+            'max_weight': max_weight[start:end],
+            'volume': total_volume[start:end],
+            'records': {
+                'max_weight': float(pr_weight[i]),
+                'max_volume': float(pr_volume[i]),
+                'max_reps': int(pr_reps[i]),
+                'total_volume': float(volume_sum[i]),
+            },
+            'avg_rest': float(rest_sum[i] / intervals[i] / 60) if intervals[i] > 0 else None,
+        }
+    return summary
+
+
+def summarize_sets(rows, time_col):
+    """
+    Summarize individual sets per exercise.
+
+    ``rows`` carry ``exercise_id`` and ``exercise__name`` (or just the name),
+    ``weight``, ``reps`` and ``time_col``. Returns ``{exercise: {...}}``,
+    keyed as described in build_frame(), with the exercise's ``name``, the
+    average weight and the summed
+    volume per distinct ``time_col`` value (one point per session when
+    grouping on the session start), the descriptive stats, the weight
+    percentiles and the average gap between consecutive sets in minutes.
+    """
+    frame = build_frame(rows, time_col, float_cols=('weight',))
+    if frame.empty:
+        return {}
+    frame, codes, keys, names, bounds = _group(frame, time_col)
+    starts = bounds[:-1]
+    counts = np.diff(bounds)
+
+    times = frame[time_col].to_numpy()
+    weights = frame['weight'].to_numpy()
+    reps = frame['reps'].to_numpy()
+    volume = weights * reps
+
+    weight_sum = np.add.reduceat(weights, starts)
+    reps_sum = np.add.reduceat(reps, starts)
+    max_weight = np.maximum.reduceat(weights, starts)
+    max_reps = np.maximum.reduceat(reps, starts)
+    max_volume = np.maximum.reduceat(volume, starts)
+    volume_sum = np.add.reduceat(volume, starts)
+
+    # Average weight per (exercise, time) point
+    point_starts = np.flatnonzero(
+        np.r_[True, (codes[1:] != codes[:-1]) | (times[1:] != times[:-1])]
+    )
+    point_times = times[point_starts]
+    point_avg = np.add.reduceat(weights, point_starts) / np.diff(np.r_[point_starts, len(weights)])
+    point_volume = np.add.reduceat(volume, point_starts)
+    point_bounds = np.searchsorted(point_starts, bounds)
+
+    # Percentiles from one sort by (exercise, weight), same index rule as before
+    by_weight = weights[np.lexsort((weights, codes))]
+
+    summary = {}
+    for i, key in enumerate(keys):
+        start, n = bounds[i], counts[i]
+        p_start, p_end = point_bounds[i], point_bounds[i + 1]
+        # Consecutive gaps telescope, so their mean is (last - first) / (n - 1)
+        span = times[start + n - 1] - times[start]
+        summary[key] = {
+            'name': names[i],
+            'times': point_times[p_start:p_end],
+            'avg_weight': point_avg[p_start:p_end],
+            'volume': point_volume[p_start:p_end],
+            'stats': {
+                'avg_weight': float(weight_sum[i] / n),
+                'max_weight': float(max_weight[i]),
+                'avg_reps': float(reps_sum[i] / n),
+                'max_reps': int(max_reps[i]),
+                'total_sets': int(n),
+                'max_volume': float(max_volume[i]),
+                'total_volume': float(volume_sum[i]),
+            },
+            'percentiles': {
+                label: float(by_weight[start + int(n * q)])
+                for label, q in PERCENTILES.items()
+            },
+            'avg_rest': float(span / np.timedelta64(1, 's') / (n - 1) / 60) if n > 1 else None,
+        }
+    return summary
@@ -0,0 +1,100 @@
+"""
+Streaming export of a user's training history.
+
+Every set the user logged comes out as one CSV row or JSON line, together
+with its session, workout and exercise. Rows are read with
+``.iterator(chunk_size=...)``, a server-side cursor on PostgreSQL and
+chunked fetches elsewhere, and each line is encoded as it is read. Memory
+stays flat however long the history is: nothing holds more than one chunk.
+"""
+import csv
+import json
+from datetime import datetime
+from decimal import Decimal
+from uuid import UUID
+
+from .models import ExercisePerformance
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+# (column, lookup) pairs, in export order
+COLUMNS = (
+    ('set_id', 'id'),
+    ('session_id', 'workout_session_id'),
+    ('workout', 'workout_session__workout__name'),
+    ('session_started_at', 'workout_session__started_at'),
+    ('session_finished_at', 'workout_session__finished_at'),
+    ('exercise', 'exercise__name'),
+    ('set_number', 'set_number'),
+    ('reps', 'reps'),
+    ('weight', 'weight'),
+    ('performed_at', 'performed_at'),
+    ('notes', 'notes'),
+    ('client_id', 'client_id'),
+)
+HEADER = [column for column, _ in COLUMNS]
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def history_rows(user, chunk_size=DEFAULT_CHUNK_SIZE):
+    """The user's sets as value tuples in COLUMNS order, oldest session first"""
+    return ExercisePerformance.objects.filter(
+        workout_session__user=user
+    ).order_by(
+        'workout_session__started_at', 'workout_session_id', 'performed_at', 'id'
+    ).values_list(*[lookup for _, lookup in COLUMNS]).iterator(chunk_size=chunk_size)
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+class _Echo:
+    """File-like object whose write() hands back the line csv.writer produced"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(HEADER)
+    for row in rows:
+        yield writer.writerow(['' if value is None else _plain(value) for value in row])
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(HEADER, map(_plain, row))), default=_json_default) + '\n'
+
+
+def export_lines(user, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    rows = history_rows(user, chunk_size)
+    return csv_lines(rows) if fmt == 'csv' else jsonl_lines(rows)
+
+
+def buffered(lines, size=64 * 1024):
+    """Join lines into blocks of about ``size`` characters, so a response isn't one write per set"""
+    block, length = [], 0
+    for line in lines:
+        block.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(block)
+            block, length = [], 0
+    if block:
+        yield ''.join(block)
@@ -86,13 +86,25 @@ class WorkoutSessionForm(forms.ModelForm):
         }
 
     def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
         if 'workout' in self.fields:
+            if user:
+                # The user's own workouts and accepted shared ones, with the
+                # "shared" flag and owner fetched up front for the labels
+                shared = SharedWorkout.objects.filter(
+                    workout=models.OuterRef('pk'), shared_with=user, is_accepted=True
+                )
+                self.fields['workout'].queryset = Workout.objects.annotate(
+                    is_shared=models.Exists(shared)
+                ).filter(
+                    models.Q(user=user) | models.Q(is_shared=True)
+                ).select_related('user')
             self.fields['workout'].label_from_instance = self.workout_label_from_instance
 
     @staticmethod
     def workout_label_from_instance(obj):
-        if hasattr(obj, 'sharedworkout_set') and obj.sharedworkout_set.exists():
+        if getattr(obj, 'is_shared', False):
             return f"{obj.name} (Shared by {obj.user.username})"
         return obj.name
 
@@ -113,7 +125,7 @@ class ExercisePerformanceForm(forms.ModelForm):
         if workout_session:
             # Only show exercises from the current workout, ordered by their order in the workout
             self.fields['exercise'].queryset = Exercise.objects.filter(
-                workoutexercise__workout=workout_session.workout
+                workoutexercise__workout_id=workout_session.workout_id
             ).distinct().order_by('workoutexercise__order')
         self.fields['notes'].required = False
 
@@ -141,6 +153,17 @@ class WorkoutShareForm(forms.ModelForm):
             raise forms.ValidationError("No user found with this email address")
         return email
 
+class HistoryImportForm(forms.Form):
+    file = forms.FileField(
+        help_text="CSV or JSON lines, one set per row, laid out like the history export",
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.jsonl,.ndjson,.json'})
+    )
+    format = forms.ChoiceField(
+        choices=[('', 'From the file name'), ('csv', 'CSV'), ('jsonl', 'JSON lines')],
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+
 WorkoutExerciseFormSet = forms.inlineformset_factory(
     Workout, WorkoutExercise,
     form=WorkoutExerciseForm,
@@ -156,9 +179,11 @@ WorkoutExerciseFormSet = forms.inlineformset_factory(
     }
 )
 
+# Batch set logging: blank rows are skipped, so a block of any size up to
+# ``extra`` can be entered in one submit
 ExercisePerformanceFormSet = forms.inlineformset_factory(
     WorkoutSession, ExercisePerformance,
     form=ExercisePerformanceForm,
-    extra=1,
-    can_delete=True
+    extra=4,
+    can_delete=False
 ) 
\ No newline at end of file
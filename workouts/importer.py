@@ -0,0 +1,409 @@
+"""
+Bulk import of a training history exported from another tracker.
+
+The input is CSV or JSON lines with one set per row, in the layout written by
+export.py. ``exercise``, ``reps``, ``weight`` and ``performed_at`` are
+required. ``workout`` defaults to "Imported", and ``session_started_at`` to
+the day of the set: every set of a workout on the same day then lands in one
+session. ``session_finished_at``, ``notes``, ``client_id`` and ``set_id`` are
+optional. Set numbers are assigned in file order, per session and exercise.
+
+Rows are read as a stream and written a chunk at a time. Each chunk is one
+transaction: the exercises, workouts and sessions it needs, then a single
+bulk_create of its sets. Exercises and workouts are matched by name,
+case-insensitively, against an in-memory index of the user's names.
+
+Every imported set gets a deterministic ``client_id`` derived from the user
+and the row. Importing the same file again skips the sets already there, so
+an interrupted import is resumed by running it again, and the rest of a
+session's rows go into the session the earlier run created. Sessions are
+never matched any other way: imported rows do not go into a session logged
+in the app, even one of the same workout and day.
+
+Rows of an export of this app are also skipped when they are sets the user
+already has: their ``client_id`` is one of the user's sets' as it is, or
+their ``set_id`` is the id of one of the user's sets logged at the same
+moment. Re-importing one's own export therefore adds nothing. Those rows
+only skip; their sessions are not resumed, as they may be live ones. Memory is bounded by the
+chunk size plus one index entry per session, not by the number of rows.
+"""
+import csv
+import io
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, time as day_time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import rollups
+from .models import Exercise, ExercisePerformance, SetCounter, Workout, WorkoutSession
+from .records import rebuild as rebuild_records, refresh as refresh_records
+from .signals import invalidate_charts
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_WORKOUT = 'Imported'
+MAX_ERRORS = 20
+# Past this many (exercise, day) rollup rows, rebuild the user's rollups
+# instead of refreshing the imported days one by one
+REFRESH_LIMIT = 500
+
+# Namespace of the client_id of imported sets
+IMPORT_NAMESPACE = uuid.UUID('5d0a4c1e-8f3b-4c55-9a39-3b6f1c2d7e10')
+
+
+class HistoryImportError(ValueError):
+    pass
+
+
+def detect_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row dict) from a text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        if not isinstance(row, dict):
+            row = {'__error__': "not a JSON object"}
+        yield line_number, row
+
+
+def open_upload(upload):
+    """Text stream over an uploaded file, read in place rather than loaded into memory"""
+    return io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, day_time.min))
+
+
+def _moment(value):
+    if value in (None, ''):
+        return None
+    value = str(value).strip()
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"invalid date {value!r}")
+        moment = datetime(day.year, day.month, day.day)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _set_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_row(row):
+    """The fields of one input row, or ValueError describing what is wrong with it"""
+    if '__error__' in row:
+        raise ValueError(row['__error__'])
+    exercise = str(row.get('exercise') or '').strip()
+    if not exercise:
+        raise ValueError("exercise is required")
+    try:
+        reps = int(row.get('reps'))
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid reps {row.get('reps')!r}")
+    try:
+        weight = Decimal(str(row.get('weight'))).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"invalid weight {row.get('weight')!r}")
+    if reps < 0 or not 0 <= weight < 1000:
+        raise ValueError("reps and weight must be positive, and weight below 1000")
+    performed_at = _moment(row.get('performed_at'))
+    if performed_at is None:
+        raise ValueError("performed_at is required")
+
+    started_at = _moment(row.get('session_started_at'))
+    return {
+        'workout': str(row.get('workout') or '').strip()[:100] or DEFAULT_WORKOUT,
+        'exercise': exercise[:100],
+        # Sessions without a start time are the workout's sets of one day
+        'session': started_at or timezone.localdate(performed_at),
+        'started_at': started_at or performed_at,
+        'finished_at': _moment(row.get('session_finished_at')),
+        'reps': reps,
+        'weight': weight,
+        'performed_at': performed_at,
+        'notes': str(row.get('notes') or ''),
+        'source_id': str(row.get('client_id') or ''),
+        'set_id': _set_id(row.get('set_id')),
+    }
+
+
+class ImportStats:
+    def __init__(self):
+        self.lines = 0
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+        self.error_count = 0
+        self.sessions = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(f"line {line_number}: {message}")
+
+
+class HistoryImporter:
+    """Import a stream of rows into a user's history; see the module docstring"""
+
+    def __init__(self, user, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.stats = ImportStats()
+        self.exercises = self._name_index(Exercise)
+        self.workouts = self._name_index(Workout)
+        # (workout id, start time or day) -> session id
+        self.sessions = {}
+        # (session id, exercise id) -> last set number
+        self.set_numbers = {}
+        # Sessions of an earlier, interrupted run of this import that rows go back into
+        self.resumed = set()
+        # Sessions created here without a finish time; closed at the last set
+        self.unfinished = set()
+        self.touched_workouts = set()
+        # Rollup keys of the imported sets: (exercise id, day), and session days
+        self.rollup_keys = set()
+        self.session_days = set()
+
+    def _name_index(self, model):
+        index = {}
+        for pk, name in model.objects.filter(user=self.user).order_by('pk').values_list('pk', 'name'):
+            index.setdefault(name.casefold(), pk)
+        return index
+
+    def client_id(self, record):
+        source = record['source_id'] or '|'.join(str(record[field]) for field in (
+            'workout', 'started_at', 'exercise', 'performed_at', 'reps', 'weight'
+        ))
+        return uuid.uuid5(IMPORT_NAMESPACE, f'{self.user.pk}|{source}')
+
+    def run(self, rows):
+        chunk = []
+        for line_number, row in rows:
+            self.stats.lines += 1
+            try:
+                record = parse_row(row)
+            except ValueError as e:
+                self.stats.error(line_number, e)
+                continue
+            record['client_id'] = self.client_id(record)
+            chunk.append(record)
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        self.finish()
+        return self.stats
+
+    def import_chunk(self, chunk):
+        # Drop sets an earlier run already imported, and repeats within the chunk
+        records = {record['client_id']: record for record in chunk}
+        existing = dict(ExercisePerformance.objects.filter(
+            client_id__in=list(records), workout_session__user=self.user,
+        ).values_list('client_id', 'workout_session_id'))
+        self._resume_sessions((records[client_id], session_id) for client_id, session_id in existing.items())
+        logged = self._already_logged({
+            client_id: record for client_id, record in records.items() if client_id not in existing
+        })
+        records = [
+            record for client_id, record in records.items() if client_id not in existing and client_id not in logged
+        ]
+        self.stats.skipped += len(chunk) - len(records)
+
+        if records:
+            with transaction.atomic():
+                self._resolve_names(Exercise, self.exercises, {r['exercise'] for r in records})
+                self._resolve_names(Workout, self.workouts, {r['workout'] for r in records})
+                self._resolve_sessions(records)
+                blocks = {}
+                for record in records:
+                    session_id = self.sessions[self._session_key(record)]
+                    exercise_id = self.exercises[record['exercise'].casefold()]
+                    self.rollup_keys.add((exercise_id, timezone.localdate(record['performed_at'])))
+                    self.session_days.add(timezone.localdate(record['started_at']))
+                    blocks.setdefault((session_id, exercise_id), []).append(ExercisePerformance(
+                        workout_session_id=session_id,
+                        exercise_id=exercise_id,
+                        reps=record['reps'],
+                        weight=record['weight'],
+                        notes=record['notes'],
+                        performed_at=record['performed_at'],
+                        client_id=record['client_id'],
+                    ))
+                performances = []
+                for key, block in blocks.items():
+                    session_id, exercise_id = key
+                    if session_id in self.resumed:
+                        # Someone may have logged sets there since: number
+                        # through the session's counter, like the app does
+                        first = SetCounter.allocate(session_id, exercise_id, count=len(block))
+                    else:
+                        first = self.set_numbers.get(key, 0) + 1
+                        self.set_numbers[key] = first + len(block) - 1
+                    for offset, performance in enumerate(block):
+                        performance.set_number = first + offset
+                    performances.extend(block)
+                ExercisePerformance.objects.bulk_create(performances)
+            self.stats.created += len(performances)
+
+        if self.progress:
+            self.progress(self.stats)
+
+    def _already_logged(self, records):
+        """
+        The client ids of ``records`` that are sets the user already has,
+        going by the ``client_id`` and ``set_id`` of an export of this app
+        """
+        exported_ids, set_ids = {}, {}
+        for client_id, record in records.items():
+            try:
+                exported_ids[uuid.UUID(record['source_id'])] = client_id
+            except ValueError:
+                pass
+            if record['set_id'] is not None:
+                set_ids[record['set_id']] = client_id
+
+        performances = ExercisePerformance.objects.filter(workout_session__user=self.user)
+        logged = {
+            exported_ids[exported_id]
+            for exported_id in performances.filter(client_id__in=list(exported_ids)).values_list('client_id', flat=True)
+        }
+        # Set ids from another tracker would match unrelated sets, so the
+        # time of the set has to match too
+        for pk, performed_at in performances.filter(pk__in=list(set_ids)).values_list('pk', 'performed_at'):
+            if records[set_ids[pk]]['performed_at'] == performed_at:
+                logged.add(set_ids[pk])
+        return logged
+
+    def _resolve_names(self, model, index, names):
+        missing = {}
+        for name in names:
+            missing.setdefault(name.casefold(), name)
+        for folded in list(missing):
+            if folded in index:
+                del missing[folded]
+        if missing:
+            created = model.objects.bulk_create([model(user=self.user, name=name) for name in missing.values()])
+            for obj in created:
+                index[obj.name.casefold()] = obj.pk
+
+    def _session_key(self, record):
+        return (self.workouts[record['workout'].casefold()], record['session'])
+
+    def _resume_sessions(self, skipped):
+        """
+        Map the session keys of rows an earlier run imported to the sessions
+        that run created, so the rest of their rows go back into them.
+        ``skipped`` maps those rows to their sessions. Sessions are only ever
+        found through imported sets, so one logged in the app never matches.
+        """
+        resumed = {}
+        for record, session_id in skipped:
+            workout_id = self.workouts.get(record['workout'].casefold())
+            key = (workout_id, record['session'])
+            if workout_id is not None and key not in self.sessions:
+                self.sessions[key] = session_id
+                resumed[session_id] = key
+        if resumed:
+            self.resumed.update(resumed)
+            # The interrupted run never got to close its open sessions
+            self.unfinished.update(WorkoutSession.objects.filter(
+                pk__in=list(resumed), user=self.user, finished_at__isnull=True,
+            ).values_list('pk', flat=True))
+
+    def _resolve_sessions(self, records):
+        missing = {}
+        for record in records:
+            key = self._session_key(record)
+            if key not in self.sessions:
+                missing.setdefault(key, record)
+        if not missing:
+            return
+
+        new = list(missing.items())
+        sessions = WorkoutSession.objects.bulk_create([
+            WorkoutSession(user=self.user, workout_id=key[0], finished_at=record['finished_at'])
+            for key, record in new
+        ])
+        # started_at is auto_now_add, so bulk_create stamped it with the
+        # current time; set the imported times in one more statement
+        for session, (key, record) in zip(sessions, new):
+            session.started_at = record['started_at']
+            self.sessions[key] = session.pk
+            self.touched_workouts.add(key[0])
+            if record['finished_at'] is None:
+                self.unfinished.add(session.pk)
+        WorkoutSession.objects.bulk_update(sessions, ['started_at'])
+        self.stats.sessions += len(sessions)
+
+    def finish(self):
+        """Close the imported sessions and refresh what is derived from the history"""
+        unfinished = sorted(self.unfinished)
+        last_set = ExercisePerformance.objects.filter(
+            workout_session=OuterRef('pk')
+        ).order_by('-performed_at').values('performed_at')[:1]
+        for start in range(0, len(unfinished), 1000):
+            WorkoutSession.objects.filter(pk__in=unfinished[start:start + 1000]).update(
+                finished_at=Subquery(last_set)
+            )
+
+        if self.stats.created:
+            if len(self.rollup_keys) <= REFRESH_LIMIT:
+                rollups.refresh_keys(self.user, self.rollup_keys)
+                rollups.refresh_periods(self.user, [_day_start(day) for day in self.session_days])
+                refresh_records(self.user.pk, {exercise_id for exercise_id, _ in self.rollup_keys})
+            else:
+                rollups.rebuild(user=self.user)
+                rollups.rebuild_periods(user=self.user)
+                rebuild_records(user=self.user)
+            invalidate_charts(user_id=self.user.pk)
+            for workout_id in self.touched_workouts:
+                invalidate_charts(workout_id=workout_id)
+        logger.info(
+            f"Imported {self.stats.created} sets in {self.stats.sessions} new sessions for user {self.user} "
+            f"({self.stats.skipped} already imported, {self.stats.error_count} invalid rows)"
+        )
+
+
+def import_history(user, stream, fmt, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    if fmt not in FORMATS:
+        raise HistoryImportError(f"Unknown format {fmt}")
+    try:
+        return HistoryImporter(user, chunk_size, progress).run(read_rows(stream, fmt))
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HistoryImportError(f"Could not read the file: {e}")
@@ -0,0 +1,293 @@
+"""
+Background jobs kept in the database.
+
+Work that doesn't have to be done before the response goes out (chart
+pre-rendering after a session is finished, history imports and exports) is
+queued as a Job row with enqueue() and run by ``manage.py run_workers``.
+There is no broker: workers poll the table. The rollups the charts are built
+from are not among it: a finished session is folded into them in its request.
+
+A worker claims the oldest runnable job with ``SELECT ... FOR UPDATE SKIP
+LOCKED`` and marks it running in the same transaction, so on PostgreSQL any
+number of workers poll without queueing on each other's rows. Backends
+without row locks (SQLite) run the same query unlocked; the UPDATE that
+marks the job running only matches a queued row, so one worker still wins.
+
+Handlers are registered per kind with @handler and receive the Job. Database
+errors worth another try (a dropped connection, a deadlock, a lock timeout)
+are retried in place with tenacity, up to JOB_RETRY_ATTEMPTS times with
+exponential backoff; any other exception fails the job, with the message in
+``Job.error``. A job whose worker died stays running until JOB_LOCK_TIMEOUT
+passes, and is then queued again, up to JOB_MAX_ATTEMPTS claims in all.
+
+With JOBS_RUN_INLINE (the default) a job runs in the process that queued it,
+for setups that run no workers: once the queuing transaction commits it is
+handed to a pool of JOBS_INLINE_THREADS threads, so the request that queued
+it returns straight away rather than after the job. A job queued while an
+outer transaction is still open when the callback fires (TestCase, whose
+on_commit callbacks are captured) runs in place, as another thread's
+connection couldn't see it.
+Jobs invalidate and fill the chart cache, so workers need one shared with the
+web processes; run_workers refuses to start with a local memory cache.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+from . import chart_cache, export, importer
+from .models import Job, Workout
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+HANDLERS = {}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def handler(kind):
+    """Register the function running jobs of ``kind``; its return value is stored as the result"""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, user=None, run_after=None, **payload):
+    """Queue a job; call it inside the transaction whose changes the job depends on"""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind}")
+    job = Job.objects.create(kind=kind, user=user, payload=payload, run_after=run_after or timezone.now())
+    logger.debug(f"Queued {job}")
+    if settings.JOBS_RUN_INLINE:
+        transaction.on_commit(lambda: _run_inline(job.pk))
+    return job
+
+
+def _inline_pool():
+    global _pool
+    if settings.JOBS_INLINE_THREADS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.JOBS_INLINE_THREADS, thread_name_prefix='jobs')
+        return _pool
+
+
+def _run_in_thread(pk):
+    close_old_connections()
+    try:
+        run_job(pk)
+    except Exception:
+        logger.exception(f"Could not run job {pk}")
+    finally:
+        close_old_connections()
+
+
+def _run_inline(pk):
+    pool = _inline_pool()
+    if pool is None or connection.in_atomic_block:
+        run_job(pk)
+    else:
+        pool.submit(_run_in_thread, pk)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+
+def _claim(jobs, worker):
+    """Mark the first runnable job of ``jobs`` as running for ``worker``"""
+    with transaction.atomic():
+        job = jobs.select_for_update(skip_locked=True).order_by('run_after', 'pk').first()
+        if job is None:
+            return None
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+        )
+    if not claimed:
+        return None
+    job.status, job.locked_by, job.locked_at, job.attempts = Job.RUNNING, worker, now, job.attempts + 1
+    return job
+
+
+def claim_next(worker=None):
+    return _claim(Job.objects.filter(status=Job.QUEUED, run_after__lte=timezone.now()), worker or worker_name())
+
+
+def _log_retry(job):
+    def log(state):
+        logger.warning(
+            f"{job} hit {state.outcome.exception()!r}; retry {state.attempt_number} "
+            f"in {state.next_action.sleep:.1f}s"
+        )
+        # A broken connection is replaced on the next query
+        close_old_connections()
+    return log
+
+
+def execute(job):
+    """Run a claimed job and record how it ended"""
+    started = time.perf_counter()
+    try:
+        func = HANDLERS.get(job.kind)
+        if func is None:
+            raise LookupError(f"No handler for job kind {job.kind}")
+        retrying = Retrying(
+            retry=retry_if_exception_type(TRANSIENT_ERRORS),
+            stop=stop_after_attempt(settings.JOB_RETRY_ATTEMPTS),
+            wait=wait_exponential(multiplier=settings.JOB_RETRY_WAIT, max=60),
+            before_sleep=_log_retry(job),
+            reraise=True,
+        )
+        job.result = retrying(func, job)
+        job.status = Job.DONE
+    except Exception as e:
+        logger.exception(f"{job} failed")
+        job.status, job.error = Job.FAILED, str(e) or type(e).__name__
+    job.finished_at = timezone.now()
+    Job.objects.filter(pk=job.pk).update(
+        status=job.status, result=job.result, error=job.error, finished_at=job.finished_at, locked_at=None,
+    )
+    logger.info(f"{job} finished in {time.perf_counter() - started:.2f}s")
+    return job
+
+
+def run_job(pk, worker=None):
+    """Run one queued job now, unless a worker got to it first"""
+    job = _claim(Job.objects.filter(pk=pk, status=Job.QUEUED), worker or worker_name())
+    return execute(job) if job else None
+
+
+def run_pending(worker=None, limit=None):
+    """Run runnable jobs until none are left (or ``limit`` ran); returns how many ran"""
+    count = 0
+    while limit is None or count < limit:
+        job = claim_next(worker)
+        if job is None:
+            break
+        execute(job)
+        count += 1
+    return count
+
+
+def reclaim_stale():
+    """Queue again the jobs of workers that stopped responding; returns how many"""
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT))
+    failed = stale.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).update(
+        status=Job.FAILED, error="The worker running it stopped responding", finished_at=now, locked_at=None,
+    )
+    requeued = stale.update(status=Job.QUEUED, locked_by='', locked_at=None)
+    if failed or requeued:
+        logger.warning(f"Reclaimed stale jobs: {requeued} queued again, {failed} failed")
+    return requeued
+
+
+def purge(days=None):
+    """Delete jobs finished more than ``days`` (JOB_RETENTION_DAYS) ago, with their files"""
+    cutoff = timezone.now() - timedelta(days=settings.JOB_RETENTION_DAYS if days is None else days)
+    old = Job.objects.filter(status__in=[Job.DONE, Job.FAILED], finished_at__lt=cutoff)
+    for payload, result in old.values_list('payload', 'result').iterator():
+        for name in (payload.get('file'), (result or {}).get('file')):
+            if name:
+                job_file(name).unlink(missing_ok=True)
+    count, _ = old.delete()
+    return count
+
+
+def work(stop, poll_interval=None):
+    """Worker loop: run jobs until ``stop`` (a threading.Event) is set"""
+    worker = worker_name()
+    poll_interval = settings.JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+    logger.info(f"Worker {worker} started")
+    last_purge = None
+    while not stop.is_set():
+        try:
+            job = claim_next(worker)
+            if job is not None:
+                execute(job)
+                continue
+            reclaim_stale()
+            if last_purge is None or time.monotonic() - last_purge > 3600:
+                purge()
+                last_purge = time.monotonic()
+        except TRANSIENT_ERRORS:
+            logger.exception(f"Worker {worker} lost the database; polling again in {poll_interval}s")
+        close_old_connections()
+        stop.wait(poll_interval)
+    logger.info(f"Worker {worker} stopped")
+
+
+def job_file(name):
+    return Path(settings.JOB_FILES_DIR) / name
+
+
+def save_upload(upload):
+    """Copy an uploaded file where workers can read it; returns its name for the payload"""
+    name = f'imports/{uuid.uuid4().hex}-{get_valid_filename(upload.name)}'
+    path = job_file(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as output:
+        for chunk in upload.chunks():
+            output.write(chunk)
+    return name
+
+
+# Job kinds
+
+@handler('prerender_charts')
+def prerender_charts(job):
+    """Build the analysis pages' figures and charts into the chart cache ahead of the next page view"""
+    if not settings.JOBS_RUN_INLINE and not chart_cache.is_shared():
+        # A worker's local memory cache isn't the web processes'
+        return {'charts': []}
+    from .analysis import prerender_charts
+    workout = Workout.objects.filter(pk=job.payload.get('workout_id')).first()
+    return {'charts': prerender_charts(job.user, workout)}
+
+
+@handler('import_history')
+def import_history(job):
+    path = job_file(job.payload['file'])
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        stats = importer.import_history(job.user, stream, job.payload['format'])
+    path.unlink()
+    return {
+        'created': stats.created, 'skipped': stats.skipped, 'sessions': stats.sessions,
+        'error_count': stats.error_count, 'errors': stats.errors,
+    }
+
+
+@handler('export_history')
+def export_history(job):
+    fmt = job.payload['format']
+    name = f'exports/{job.pk}.{fmt}'
+    path = job_file(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as output:
+        for line in export.export_lines(job.user, fmt):
+            output.write(line)
+            count += 1
+    return {
+        'file': name,
+        'filename': f"training-history-{timezone.localdate():%Y-%m-%d}.{fmt}",
+        'sets': count - 1 if fmt == 'csv' else count,
+    }
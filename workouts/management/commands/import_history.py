@@ -0,0 +1,48 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from workouts import importer
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a CSV or JSON lines training history into a user's account. "
+        "Sets imported before are skipped, so an interrupted import is resumed by running it again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path', help="File to import, one set per row")
+        parser.add_argument('--format', choices=importer.FORMATS, help="Default: from the file extension")
+        parser.add_argument('--chunk-size', type=int, default=importer.DEFAULT_CHUNK_SIZE,
+                            help="Rows written per transaction")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist")
+        fmt = options['format'] or importer.detect_format(options['path'])
+
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+                stats = importer.import_history(user, stream, fmt, options['chunk_size'], self.report)
+        except OSError as e:
+            raise CommandError(f"Could not open {options['path']}: {e}")
+        except importer.HistoryImportError as e:
+            raise CommandError(str(e))
+
+        for error in stats.errors:
+            self.stderr.write(f"  skipped {error}")
+        if stats.error_count > len(stats.errors):
+            self.stderr.write(f"  ... and {stats.error_count - len(stats.errors)} more invalid rows")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats.created} sets into {stats.sessions} new sessions in {stats.elapsed:.1f}s "
+            f"({stats.skipped} already imported, {stats.error_count} invalid rows)"
+        ))
+
+    def report(self, stats):
+        self.stdout.write(
+            f"  {stats.lines} rows read, {stats.created} sets imported, {stats.skipped} skipped "
+            f"({stats.elapsed:.1f}s)"
+        )
@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from workouts import records, rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-day exercise and per-week/month session rollups and the personal records from the recorded sets"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only rebuild the rows of this username")
+        parser.add_argument(
+            '--since', help="Only rebuild the days, and the weeks and months, from this date on (YYYY-MM-DD)"
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+        since = None
+        if options['since']:
+            try:
+                since = datetime.strptime(options['since'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("--since must be a YYYY-MM-DD date")
+
+        count = rollups.rebuild(user=user, since=since)
+        period_count = rollups.rebuild_periods(user=user, since=since)
+        # Records span the whole history, so --since doesn't narrow them
+        record_count = records.rebuild(user=user)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {count} daily rollup rows, {period_count} weekly/monthly rollup rows "
+            f"and {record_count} personal records"
+        ))
@@ -0,0 +1,50 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from workouts import chart_cache, jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background jobs (chart pre-rendering, imports and exports) from the job table. "
+        "Start as many of these processes as needed; they share the queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help="Worker threads in this process")
+        parser.add_argument('--poll-interval', type=float, help="Seconds between polls of an empty queue")
+        parser.add_argument('--once', action='store_true', help="Run the queued jobs, then exit")
+
+    def handle(self, *args, **options):
+        if not chart_cache.is_shared():
+            # Invalidations made here would never reach the web processes
+            raise CommandError(
+                "Workers need a chart cache shared with the web processes: "
+                "set CHART_CACHE_BACKEND to file or db, or run jobs inline"
+            )
+        if options['once']:
+            count = jobs.run_pending()
+            self.stdout.write(self.style.SUCCESS(f"Ran {count} jobs"))
+            return
+
+        stop = threading.Event()
+        workers = [
+            threading.Thread(target=jobs.work, args=(stop, options['poll_interval']), name=f'worker-{i}')
+            for i in range(options['threads'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {len(workers)} workers")
+
+        # Jobs in progress are finished before exiting
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        try:
+            while not stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            stop.set()
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS("Workers stopped"))
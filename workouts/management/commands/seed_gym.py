@@ -0,0 +1,147 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from workouts import records, rollups
+from workouts.models import Exercise, ExercisePerformance, Workout, WorkoutExercise, WorkoutSession
+
+EXERCISES = [
+    ('Back Squat', 60), ('Front Squat', 50), ('Deadlift', 80), ('Romanian Deadlift', 60),
+    ('Bench Press', 50), ('Incline Bench Press', 40), ('Overhead Press', 30), ('Barbell Row', 45),
+    ('Pull Up', 0), ('Chin Up', 0), ('Dip', 0), ('Lat Pulldown', 40),
+    ('Leg Press', 100), ('Lunge', 20), ('Hip Thrust', 60), ('Leg Curl', 30),
+    ('Leg Extension', 30), ('Calf Raise', 40), ('Biceps Curl', 12), ('Triceps Extension', 15),
+    ('Lateral Raise', 6), ('Face Pull', 15), ('Cable Fly', 12), ('Shrug', 40),
+]
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Let bulk_create keep the timestamps we generate for auto_now_add fields"""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = "Generate a deterministic synthetic training history for load and scale testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--exercises', type=int, default=12, help="Exercises per user")
+        parser.add_argument('--workouts', type=int, default=3, help="Workout templates per user")
+        parser.add_argument('--sessions', type=int, default=150, help="Sessions per user")
+        parser.add_argument('--sets', type=int, default=4, help="Average sets per exercise in a session")
+        parser.add_argument('--start', default='2022-01-01', help="Date of the first session (YYYY-MM-DD)")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='seed', help="Username prefix of the generated users")
+        parser.add_argument('--password', default='gym-ebros', help="Password of every generated user")
+        parser.add_argument('--skip-rollups', action='store_true', help="Don't rebuild the rollups and personal records afterwards")
+
+    def handle(self, *args, **options):
+        if options['exercises'] > len(EXERCISES):
+            raise CommandError(f"At most {len(EXERCISES)} exercises per user are available")
+        try:
+            start = timezone.make_aware(datetime.strptime(options['start'], '%Y-%m-%d'))
+        except ValueError:
+            raise CommandError("--start must be a YYYY-MM-DD date")
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError(f"Users prefixed '{options['prefix']}' already exist; pick another --prefix")
+
+        rng = random.Random(options['seed'])
+        password = make_password(options['password'])
+        started = time.monotonic()
+        total_sets = 0
+
+        with explicit_timestamps(WorkoutSession._meta.get_field('started_at')):
+            users = User.objects.bulk_create([
+                User(username=f"{options['prefix']}{i}", email=f"{options['prefix']}{i}@example.com", password=password)
+                for i in range(options['users'])
+            ])
+            for index, user in enumerate(users, start=1):
+                with transaction.atomic():
+                    total_sets += self.seed_user(user, rng, start, options)
+                self.stdout.write(
+                    f"  {index}/{len(users)} users, {total_sets} sets "
+                    f"({time.monotonic() - started:.1f}s)"
+                )
+
+        if not options['skip_rollups']:
+            self.stdout.write("Rebuilding rollups and personal records...")
+            rollups.rebuild()
+            rollups.rebuild_periods()
+            records.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(users)} users and {total_sets} sets in {time.monotonic() - started:.1f}s"
+        ))
+
+    def seed_user(self, user, rng, start, options):
+        exercises = Exercise.objects.bulk_create([
+            Exercise(name=name, user=user)
+            for name, _ in rng.sample(EXERCISES, options['exercises'])
+        ])
+        base_weight = {e.pk: dict(EXERCISES)[e.name] for e in exercises}
+
+        workouts = Workout.objects.bulk_create([
+            Workout(name=f"Workout {chr(ord('A') + i)}", user=user)
+            for i in range(options['workouts'])
+        ])
+        templates = {}
+        workout_exercises = []
+        for workout in workouts:
+            chosen = rng.sample(exercises, min(len(exercises), rng.randint(4, 6)))
+            templates[workout.pk] = chosen
+            workout_exercises.extend(
+                WorkoutExercise(workout=workout, exercise=exercise, suggested_sets=options['sets'],
+                                suggested_reps=rng.choice([5, 8, 10, 12]), order=order)
+                for order, exercise in enumerate(chosen, start=1)
+            )
+        WorkoutExercise.objects.bulk_create(workout_exercises)
+
+        # Sessions every one to four days, at a plausible time of day
+        sessions = []
+        day = start
+        for _ in range(options['sessions']):
+            day += timedelta(days=rng.randint(1, 4))
+            started_at = day + timedelta(hours=rng.randint(6, 20), minutes=rng.randint(0, 59))
+            sessions.append(WorkoutSession(
+                user=user, workout=rng.choice(workouts), started_at=started_at,
+                finished_at=started_at + timedelta(minutes=rng.randint(40, 100)),
+            ))
+        sessions = WorkoutSession.objects.bulk_create(sessions, batch_size=options['batch_size'])
+
+        performances = []
+        created = 0
+        for n, session in enumerate(sessions):
+            progress = 1 + 0.5 * n / max(len(sessions), 1)
+            performed_at = session.started_at
+            for exercise in templates[session.workout_id]:
+                for set_number in range(1, max(1, options['sets'] + rng.randint(-1, 1)) + 1):
+                    performed_at += timedelta(seconds=rng.randint(60, 240))
+                    weight = base_weight[exercise.pk] * progress * rng.uniform(0.9, 1.05)
+                    performances.append(ExercisePerformance(
+                        workout_session=session, exercise=exercise, set_number=set_number,
+                        reps=rng.randint(4, 12),
+                        weight=Decimal(round(weight / 2.5) * 25) / 10,
+                        performed_at=performed_at,
+                    ))
+            if len(performances) >= options['batch_size']:
+                ExercisePerformance.objects.bulk_create(performances)
+                created += len(performances)
+                performances = []
+        ExercisePerformance.objects.bulk_create(performances)
+        return created + len(performances)
@@ -0,0 +1,41 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from workouts import snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the training history as Arrow or Parquet files for offline analytics. "
+        "Runs after the first only append the finished sessions the snapshot doesn't hold yet."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', required=True, help="Snapshot directory")
+        parser.add_argument('--format', choices=sorted(snapshots.FORMATS), default='arrow')
+        parser.add_argument('--partition', choices=['none', 'user'], default='none',
+                            help="Write one directory per user")
+        parser.add_argument('--user', help="Only export this username")
+        parser.add_argument('--full', action='store_true', help="Rewrite the whole snapshot")
+        parser.add_argument('--batch-size', type=int, default=snapshots.DEFAULT_BATCH_SIZE,
+                            help="Rows fetched and written at a time")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+
+        try:
+            counts = snapshots.write_snapshot(
+                options['output'], options['format'], options['partition'], user,
+                options['full'], options['batch_size'],
+            )
+        except snapshots.SnapshotError as e:
+            raise CommandError(str(e))
+
+        for table, count in counts.items():
+            self.stdout.write(f"  {table}: {count} rows")
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['format']} snapshot to {options['output']}"))
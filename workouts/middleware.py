@@ -0,0 +1,116 @@
+"""
+Per-request SQL instrumentation.
+
+QueryStatsMiddleware wraps the database connection for a sample of requests
+(QUERY_STATS_SAMPLE_RATE) and records how many queries the view issued, how
+long they took, and which statements repeated. The totals go out as a
+``Server-Timing`` header, visible in the browser dev tools, and as a
+``query_stats`` log line on the ``workouts`` logger. A statement shape that
+repeats QUERY_STATS_REPEAT_THRESHOLD times or more is logged as a warning:
+that is almost always an N+1 loop in a view or template.
+
+The recorder of the current request is also published in ``current_recorder``
+so that queries run on other threads' connections for the request (see
+workouts.concurrency) are counted too. Their times are summed, so with
+concurrent queries the database time can exceed the time the request took.
+"""
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# "IN (%s, %s, %s)" and "VALUES (...), (...)" vary with the number of
+# parameters but are the same statement as far as N+1 detection goes
+_PLACEHOLDER_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+# The QueryRecorder measuring the current request, if it is sampled
+current_recorder = ContextVar('query_recorder', default=None)
+
+
+def statement_shape(sql):
+    return _WHITESPACE.sub(' ', _PLACEHOLDER_LIST.sub('(%s...)', sql)).strip()
+
+
+class QueryRecorder:
+    """connection.execute_wrapper hook collecting query counts and timings"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self.shapes = Counter()
+        # One request's queries may run on several threads at once
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.seconds += elapsed
+                self.count += 1
+                self.statements[(sql, repr(params))] += 1
+                self.shapes[statement_shape(sql)] += 1
+
+    @property
+    def duplicates(self):
+        """Queries that re-ran with exactly the same SQL and parameters"""
+        return sum(n - 1 for n in self.statements.values())
+
+    def repeated_shapes(self, threshold):
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+
+class QueryStatsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.QUERY_STATS_SAMPLE_RATE
+        self.repeat_threshold = settings.QUERY_STATS_REPEAT_THRESHOLD
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(recorder):
+                response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        total_ms = (time.perf_counter() - started) * 1000
+        db_ms = recorder.seconds * 1000
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={db_ms:.1f};desc="{recorder.count} queries"',
+            f'app;dur={max(total_ms - db_ms, 0):.1f}',
+            f'total;dur={total_ms:.1f}',
+        ])
+
+        match = request.resolver_match
+        view = match.view_name if match else request.path
+        repeated = recorder.repeated_shapes(self.repeat_threshold)
+        logger.info(
+            f"query_stats view={view} method={request.method} status={response.status_code} "
+            f"queries={recorder.count} duplicates={recorder.duplicates} "
+            f"db_ms={db_ms:.1f} total_ms={total_ms:.1f}"
+        )
+        for shape, count in repeated:
+            logger.warning(f"query_stats view={view} repeated={count} sql={shape[:300]!r}")
+
+        return response
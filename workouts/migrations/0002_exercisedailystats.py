@@ -0,0 +1,80 @@
+# Generated by Django 5.0 on 2026-10-17 23:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Min, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_daily_stats(apps, schema_editor):
+    ExercisePerformance = apps.get_model('workouts', 'ExercisePerformance')
+    ExerciseDailyStats = apps.get_model('workouts', 'ExerciseDailyStats')
+    volume = ExpressionWrapper(
+        F('weight') * F('reps'),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+    aggregates = ExercisePerformance.objects.filter(
+        workout_session__finished_at__isnull=False
+    ).order_by().annotate(
+        day=TruncDate('performed_at'),
+        user=F('workout_session__user'),
+    ).values('user', 'exercise', 'day').annotate(
+        max_weight=Max('weight'),
+        max_reps=Max('reps'),
+        max_set_volume=Max(volume),
+        total_volume=Sum(volume),
+        set_count=Count('id'),
+        first_performed_at=Min('performed_at'),
+        last_performed_at=Max('performed_at'),
+    )
+    ExerciseDailyStats.objects.bulk_create((
+        ExerciseDailyStats(
+            user_id=row['user'],
+            exercise_id=row['exercise'],
+            day=row['day'],
+            max_weight=row['max_weight'],
+            max_reps=row['max_reps'],
+            max_set_volume=row['max_set_volume'],
+            total_volume=row['total_volume'],
+            set_count=row['set_count'],
+            rest_seconds=(row['last_performed_at'] - row['first_performed_at']).total_seconds(),
+            first_performed_at=row['first_performed_at'],
+            last_performed_at=row['last_performed_at'],
+        )
+        for row in aggregates.iterator()
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExerciseDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('max_weight', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('max_reps', models.IntegerField()),
+                ('max_set_volume', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total_volume', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('set_count', models.IntegerField()),
+                ('rest_seconds', models.FloatField(default=0)),
+                ('first_performed_at', models.DateTimeField()),
+                ('last_performed_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('exercise', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='workouts.exercise')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['day'],
+                'unique_together': {('user', 'exercise', 'day')},
+            },
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0 on 2026-10-17 23:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0002_exercisedailystats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exerciseperformance',
+            index=models.Index(fields=['workout_session', 'performed_at'], name='perf_session_performed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exerciseperformance',
+            index=models.Index(fields=['workout_session', 'exercise', '-set_number'], name='perf_session_ex_set_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exerciseperformance',
+            index=models.Index(fields=['exercise', 'performed_at'], name='perf_exercise_performed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workoutsession',
+            index=models.Index(fields=['user', '-started_at'], name='session_user_started_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workoutsession',
+            index=models.Index(condition=models.Q(('finished_at__isnull', False)), fields=['user', 'started_at'], name='session_user_finished_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workoutsession',
+            index=models.Index(condition=models.Q(('finished_at__isnull', False)), fields=['workout', 'started_at'], name='session_workout_finished_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-17 23:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0003_performance_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='workoutsession',
+            name='session_user_started_idx',
+        ),
+        migrations.AddIndex(
+            model_name='exercise',
+            index=models.Index(fields=['user', 'name', 'id'], name='exercise_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workout',
+            index=models.Index(fields=['user', 'name', 'id'], name='workout_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workoutsession',
+            index=models.Index(fields=['user', '-started_at', '-id'], name='session_user_started_idx'),
+        ),
+    ]
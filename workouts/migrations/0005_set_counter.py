@@ -0,0 +1,62 @@
+# Generated by Django 5.0 on 2026-10-17 23:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def renumber_duplicate_sets(apps, schema_editor):
+    # Racing set logging could give two sets the same number. Renumber the
+    # affected (session, exercise) groups in logging order before the
+    # unique constraint goes on.
+    ExercisePerformance = apps.get_model('workouts', 'ExercisePerformance')
+    groups = ExercisePerformance.objects.values(
+        'workout_session', 'exercise', 'set_number'
+    ).order_by().annotate(n=Count('id')).filter(n__gt=1).values_list('workout_session', 'exercise').distinct()
+    for session_id, exercise_id in groups:
+        performances = list(ExercisePerformance.objects.filter(
+            workout_session_id=session_id, exercise_id=exercise_id
+        ).order_by('performed_at', 'id'))
+        for number, performance in enumerate(performances, start=1):
+            performance.set_number = number
+        ExercisePerformance.objects.bulk_update(performances, ['set_number'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0004_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SetCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_set_number', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='exerciseperformance',
+            name='perf_session_ex_set_idx',
+        ),
+        migrations.RunPython(renumber_duplicate_sets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='exerciseperformance',
+            constraint=models.UniqueConstraint(fields=('workout_session', 'exercise', 'set_number'), name='perf_session_ex_set_uniq'),
+        ),
+        migrations.AddField(
+            model_name='setcounter',
+            name='exercise',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='workouts.exercise'),
+        ),
+        migrations.AddField(
+            model_name='setcounter',
+            name='workout_session',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='workouts.workoutsession'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='setcounter',
+            unique_together={('workout_session', 'exercise')},
+        ),
+    ]
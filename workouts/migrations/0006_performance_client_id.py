@@ -0,0 +1,24 @@
+# Generated by Django 5.0 on 2026-10-17 23:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0005_set_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exerciseperformance',
+            name='client_id',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='exerciseperformance',
+            name='performed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.0 on 2026-10-17 23:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DateField, DecimalField, DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+
+def backfill_period_stats(apps, schema_editor):
+    WorkoutSession = apps.get_model('workouts', 'WorkoutSession')
+    ExercisePerformance = apps.get_model('workouts', 'ExercisePerformance')
+    TrainingPeriodStats = apps.get_model('workouts', 'TrainingPeriodStats')
+    volume = ExpressionWrapper(
+        F('weight') * F('reps'),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+    duration = ExpressionWrapper(F('finished_at') - F('started_at'), output_field=DurationField())
+    for period, trunc in (('week', TruncWeek), ('month', TruncMonth)):
+        rows = {}
+        sessions = WorkoutSession.objects.filter(finished_at__isnull=False).order_by().annotate(
+            start=trunc('started_at', output_field=DateField()),
+        ).values('user', 'start').annotate(session_count=Count('id'), duration=Sum(duration))
+        for row in sessions:
+            rows[(row['user'], row['start'])] = TrainingPeriodStats(
+                user_id=row['user'], period=period, start=row['start'],
+                session_count=row['session_count'],
+                duration_seconds=row['duration'].total_seconds() if row['duration'] else 0,
+            )
+        sets = ExercisePerformance.objects.filter(workout_session__finished_at__isnull=False).order_by().annotate(
+            user=F('workout_session__user'),
+            start=trunc('workout_session__started_at', output_field=DateField()),
+        ).values('user', 'start').annotate(set_count=Count('id'), total_volume=Sum(volume))
+        for row in sets:
+            stats = rows[(row['user'], row['start'])]
+            stats.set_count = row['set_count']
+            stats.total_volume = row['total_volume'] or 0
+        TrainingPeriodStats.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0006_performance_client_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainingPeriodStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('week', 'Week'), ('month', 'Month')], max_length=5)),
+                ('start', models.DateField(help_text='Monday of the week or first day of the month')),
+                ('session_count', models.IntegerField()),
+                ('duration_seconds', models.FloatField(default=0)),
+                ('set_count', models.IntegerField(default=0)),
+                ('total_volume', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['start'],
+                'unique_together': {('user', 'period', 'start')},
+            },
+        ),
+        migrations.RunPython(backfill_period_stats, migrations.RunPython.noop),
+    ]
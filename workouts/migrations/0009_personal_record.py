@@ -0,0 +1,64 @@
+# Generated by Django 5.0 on 2026-10-18 00:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, FloatField, Max, Min, Sum, Value, When
+from django.db.models.functions import Cast
+
+
+def backfill_personal_records(apps, schema_editor):
+    ExercisePerformance = apps.get_model('workouts', 'ExercisePerformance')
+    PersonalRecord = apps.get_model('workouts', 'PersonalRecord')
+    volume = ExpressionWrapper(
+        F('weight') * F('reps'),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+    estimated_1rm = Case(
+        When(reps__lt=1, then=Value(0.0)),
+        When(reps=1, then=Cast('weight', FloatField())),
+        default=Cast('weight', FloatField()) * (F('reps') + 30) / 30.0,
+        output_field=FloatField(),
+    )
+    rows = ExercisePerformance.objects.order_by().annotate(
+        user=F('workout_session__user'),
+    ).values('user', 'exercise').annotate(
+        max_weight=Max('weight'), max_reps=Max('reps'), max_set_volume=Max(volume),
+        estimated_1rm=Max(estimated_1rm), total_volume=Sum(volume), set_count=Count('id'),
+        first_performed_at=Min('performed_at'),
+    )
+    PersonalRecord.objects.bulk_create([
+        PersonalRecord(user_id=row.pop('user'), exercise_id=row.pop('exercise'), **row) for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0008_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonalRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('max_weight', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('max_reps', models.IntegerField()),
+                ('max_set_volume', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('estimated_1rm', models.DecimalField(decimal_places=2, help_text="Epley's estimate from the best set", max_digits=7)),
+                ('total_volume', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('set_count', models.IntegerField()),
+                ('first_performed_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('exercise', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='workouts.exercise')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['first_performed_at'],
+                'unique_together': {('user', 'exercise')},
+            },
+        ),
+        migrations.RunPython(backfill_personal_records, migrations.RunPython.noop),
+    ]
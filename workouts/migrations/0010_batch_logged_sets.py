@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-18 00:47
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_rest_intervals(apps, schema_editor):
+    # Sets logged before this had no flag, so every gap of a day counts
+    ExerciseDailyStats = apps.get_model('workouts', 'ExerciseDailyStats')
+    ExerciseDailyStats.objects.filter(set_count__gt=1).update(rest_intervals=F('set_count') - 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0009_personal_record'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercisedailystats',
+            name='rest_intervals',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='exerciseperformance',
+            name='batch_logged',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(backfill_rest_intervals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0 on 2026-10-18 03:40
+
+from django.db import migrations
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, FloatField, Max, Min, Sum, Value, When
+from django.db.models.functions import Cast
+
+
+def rebuild_personal_records(apps, schema_editor):
+    """The ledger used to count sets from open sessions; keep only finished ones."""
+    ExercisePerformance = apps.get_model('workouts', 'ExercisePerformance')
+    PersonalRecord = apps.get_model('workouts', 'PersonalRecord')
+    volume = ExpressionWrapper(
+        F('weight') * F('reps'),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+    estimated_1rm = Case(
+        When(reps__lt=1, then=Value(0.0)),
+        When(reps=1, then=Cast('weight', FloatField())),
+        default=Cast('weight', FloatField()) * (F('reps') + 30) / 30.0,
+        output_field=FloatField(),
+    )
+    rows = ExercisePerformance.objects.filter(
+        workout_session__finished_at__isnull=False,
+    ).order_by().annotate(
+        user=F('workout_session__user'),
+    ).values('user', 'exercise').annotate(
+        max_weight=Max('weight'), max_reps=Max('reps'), max_set_volume=Max(volume),
+        estimated_1rm=Max(estimated_1rm), total_volume=Sum(volume), set_count=Count('id'),
+        first_performed_at=Min('performed_at'),
+    )
+    PersonalRecord.objects.all().delete()
+    PersonalRecord.objects.bulk_create([
+        PersonalRecord(user_id=row.pop('user'), exercise_id=row.pop('exercise'), **row) for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workouts', '0010_batch_logged_sets'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_personal_records, migrations.RunPython.noop),
+    ]
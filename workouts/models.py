@@ -1,11 +1,18 @@
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Exercise(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # Exercise list, paged by (name, id)
+            models.Index(fields=['user', 'name', 'id'], name='exercise_user_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -18,6 +25,12 @@ class Workout(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_public = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Workout list, paged by (name, id)
+            models.Index(fields=['user', 'name', 'id'], name='workout_user_name_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} - {self.user.username}"
 
@@ -60,6 +73,23 @@ class WorkoutSession(models.Model):
     finished_at = models.DateTimeField(null=True, blank=True)
     notes = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            # Session list: a user's sessions, newest first, paged by (started_at, id)
+            models.Index(fields=['user', '-started_at', '-id'], name='session_user_started_idx'),
+            # Analysis: only finished sessions count
+            models.Index(
+                fields=['user', 'started_at'],
+                condition=models.Q(finished_at__isnull=False),
+                name='session_user_finished_idx',
+            ),
+            models.Index(
+                fields=['workout', 'started_at'],
+                condition=models.Q(finished_at__isnull=False),
+                name='session_workout_finished_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.workout.name} - {self.started_at.date()}"
 
@@ -71,10 +101,199 @@ class ExercisePerformance(models.Model):
     reps = models.IntegerField()
     weight = models.DecimalField(max_digits=5, decimal_places=2)
     notes = models.TextField(blank=True)
-    performed_at = models.DateTimeField(auto_now_add=True)
+    # Sets synced from an offline device keep the time they were logged
+    performed_at = models.DateTimeField(default=timezone.now)
+    # Idempotency key of sets created by a device's journal (see SessionSyncView)
+    client_id = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+    # Logged in a block by BatchLogSetsView: performed_at is when the block
+    # was sent, not when the set was done, so rest times leave it out
+    batch_logged = models.BooleanField(default=False, editable=False)
 
     class Meta:
         ordering = ['performed_at']
+        indexes = [
+            # Session detail: the session's sets in the order they were logged
+            models.Index(fields=['workout_session', 'performed_at'], name='perf_session_performed_idx'),
+            # Rollup refresh: an exercise's sets over a range of days
+            models.Index(fields=['exercise', 'performed_at'], name='perf_exercise_performed_idx'),
+        ]
+        constraints = [
+            # Set numbers come from SetCounter; this backs it up against any other writer
+            models.UniqueConstraint(
+                fields=['workout_session', 'exercise', 'set_number'], name='perf_session_ex_set_uniq'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.exercise.name} - Set {self.set_number}: {self.reps} reps at {self.weight}kg"
+
+class SetCounter(models.Model):
+    """Last set number handed out per exercise within a session"""
+    workout_session = models.ForeignKey(WorkoutSession, on_delete=models.CASCADE)
+    exercise = models.ForeignKey(Exercise, on_delete=models.CASCADE)
+    last_set_number = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['workout_session', 'exercise']
+
+    def __str__(self):
+        return f"{self.exercise.name} - {self.last_set_number} sets"
+
+    @classmethod
+    def allocate(cls, workout_session_id, exercise_id, count=1):
+        """
+        Reserve ``count`` consecutive set numbers and return the first one.
+
+        The counter row is bumped with a single UPDATE, which holds its row
+        lock until the surrounding transaction ends, so concurrent requests
+        queue on the row instead of reading the same last set. Call it in the
+        transaction that inserts the sets, so a failed insert gives the
+        numbers back.
+        """
+        last = cls._bump(workout_session_id, exercise_id, count)
+        if last is None:
+            # First set of this exercise in the session: start after any sets
+            # logged before counters existed. A concurrent first insert loses
+            # on the unique constraint and bumps the winner's row instead.
+            existing = ExercisePerformance.objects.filter(
+                workout_session_id=workout_session_id, exercise_id=exercise_id
+            ).aggregate(last=models.Max('set_number'))['last'] or 0
+            try:
+                with transaction.atomic():
+                    cls.objects.create(
+                        workout_session_id=workout_session_id, exercise_id=exercise_id,
+                        last_set_number=existing + count
+                    )
+                last = existing + count
+            except IntegrityError:
+                last = cls._bump(workout_session_id, exercise_id, count)
+        return last - count + 1
+
+    @classmethod
+    def _bump(cls, workout_session_id, exercise_id, count):
+        # Django's flag is about INSERT ... RETURNING, which MariaDB has
+        # without UPDATE ... RETURNING; only trust it on these two
+        if connection.vendor in ('postgresql', 'sqlite') and connection.features.can_return_columns_from_insert:
+            # PostgreSQL and SQLite 3.35+: UPDATE ... RETURNING in one round trip
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {cls._meta.db_table} SET last_set_number = last_set_number + %s "
+                    f"WHERE workout_session_id = %s AND exercise_id = %s RETURNING last_set_number",
+                    [count, workout_session_id, exercise_id]
+                )
+                row = cursor.fetchone()
+            return row[0] if row else None
+        counters = cls.objects.filter(workout_session_id=workout_session_id, exercise_id=exercise_id)
+        if not counters.update(last_set_number=models.F('last_set_number') + count):
+            return None
+        return counters.values_list('last_set_number', flat=True).get()
+
+class ExerciseDailyStats(models.Model):
+    """Per-day rollup of a user's sets for one exercise, used by the analysis page"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    exercise = models.ForeignKey(Exercise, on_delete=models.CASCADE)
+    day = models.DateField()
+    max_weight = models.DecimalField(max_digits=5, decimal_places=2)
+    max_reps = models.IntegerField()
+    max_set_volume = models.DecimalField(max_digits=10, decimal_places=2)
+    total_volume = models.DecimalField(max_digits=12, decimal_places=2)
+    set_count = models.IntegerField()
+    # Summed gaps between the day's sets, and how many gaps they are
+    rest_seconds = models.FloatField(default=0)
+    rest_intervals = models.IntegerField(default=0)
+    first_performed_at = models.DateTimeField()
+    last_performed_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'exercise', 'day']
+        ordering = ['day']
+
+    def __str__(self):
+        return f"{self.exercise.name} - {self.day}: {self.set_count} sets"
+
+class TrainingPeriodStats(models.Model):
+    """Per-week and per-month rollup of a user's finished sessions, used by the analysis page"""
+    WEEK = 'week'
+    MONTH = 'month'
+    PERIOD_CHOICES = [(WEEK, 'Week'), (MONTH, 'Month')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    start = models.DateField(help_text="Monday of the week or first day of the month")
+    session_count = models.IntegerField()
+    duration_seconds = models.FloatField(default=0)
+    set_count = models.IntegerField(default=0)
+    total_volume = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'period', 'start']
+        ordering = ['start']
+
+    def __str__(self):
+        return f"{self.get_period_display()} of {self.start}: {self.session_count} sessions"
+
+class PersonalRecord(models.Model):
+    """A user's best sets of one exercise, kept up to date as sets are logged (see workouts.records)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    exercise = models.ForeignKey(Exercise, on_delete=models.CASCADE)
+    max_weight = models.DecimalField(max_digits=5, decimal_places=2)
+    max_reps = models.IntegerField()
+    max_set_volume = models.DecimalField(max_digits=10, decimal_places=2)
+    estimated_1rm = models.DecimalField(max_digits=7, decimal_places=2, help_text="Epley's estimate from the best set")
+    total_volume = models.DecimalField(max_digits=14, decimal_places=2)
+    set_count = models.IntegerField()
+    first_performed_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'exercise']
+        ordering = ['first_performed_at']
+
+    def __str__(self):
+        return f"{self.exercise.name}: {self.max_weight}kg, {self.max_reps} reps"
+
+class Job(models.Model):
+    """Background task queued for ``manage.py run_workers`` (see workouts/jobs.py)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    run_after = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Polling: the oldest runnable job; partial, so done jobs don't slow it down
+            models.Index(
+                fields=['run_after', 'id'],
+                condition=models.Q(status='queued'),
+                name='job_queued_idx',
+            ),
+            # Reclaiming jobs of workers that died mid-run
+            models.Index(
+                fields=['locked_at'],
+                condition=models.Q(status='running'),
+                name='job_running_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
@@ -0,0 +1,91 @@
+"""
+Keyset (cursor) pagination for the list views.
+
+Pages are ordered on a unique key such as (name, id) and the next page starts
+strictly after the last row shown, so every page is an index range scan of
+page_size rows however deep the user scrolls, unlike OFFSET paging that reads
+and throws away every row before the page. The cursor is that last row's key,
+base64-encoded into the ``after`` query parameter. A cursor that doesn't
+decode to values of the ordering fields' types is answered with a 404.
+
+HTMX requests for the next page get only the rows (``partial_template_name``),
+which end with a sentinel that fetches the following page when it scrolls into
+view.
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, ordering):
+    """The values of ``ordering``'s fields in a cursor, converted to their types"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise Http404("Invalid cursor")
+    try:
+        values = [
+            model._meta.get_field(field.lstrip('-')).to_python(value)
+            for field, value in zip(ordering, values)
+        ]
+    except (ValidationError, ValueError, TypeError):
+        raise Http404("Invalid cursor")
+    # The ordering fields are never null, and None isn't a query value
+    if any(value is None for value in values):
+        raise Http404("Invalid cursor")
+    return values
+
+
+def keyset_filter(ordering, values):
+    """Rows strictly after ``values`` in ``ordering``, e.g. ('-started_at', '-id')"""
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    # The leading column bound is implied by the OR, but spelling it out lets
+    # the database turn it into an index range instead of a filter
+    first = ordering[0]
+    bound = Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]})
+    return bound & condition
+
+
+class KeysetPaginationMixin:
+    """ListView mixin paging object_list by ``ordering``, which must end in a unique field"""
+
+    ordering = ('name', 'id')
+    page_size = 24
+    partial_template_name = None
+
+    def get_template_names(self):
+        if self.request.headers.get('HX-Request') and self.partial_template_name:
+            return [self.partial_template_name]
+        return super().get_template_names()
+
+    def get_context_data(self, **kwargs):
+        queryset = self.object_list.order_by(*self.ordering)
+        cursor = self.request.GET.get('after')
+        if cursor:
+            queryset = queryset.filter(keyset_filter(self.ordering, decode_cursor(cursor, queryset.model, self.ordering)))
+
+        rows = list(queryset[:self.page_size + 1])
+        page, has_next = rows[:self.page_size], len(rows) > self.page_size
+        next_cursor = None
+        if has_next:
+            last = page[-1]
+            next_cursor = encode_cursor([getattr(last, field.lstrip('-')) for field in self.ordering])
+
+        return super().get_context_data(object_list=page, next_cursor=next_cursor, **kwargs)
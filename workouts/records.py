@@ -0,0 +1,227 @@
+"""
+Maintenance of the PersonalRecord ledger.
+
+Each row holds a user's best weight, reps, single-set volume and estimated
+one-rep max for an exercise, with the running volume and set count. Like the
+rollups the charts are drawn from, only sets of finished sessions count, so
+the records and the charts always agree, and an abandoned session never
+leaves records behind.
+
+Sets logged in an open session are only compared: flag_records() marks the
+ones that beat the ledger and the session's earlier sets, so a record is
+flagged on the session page the moment it is set, and writes nothing.
+Finishing a session folds its sets into their rows with record_sets(), which
+locks each exercise's row, compares and saves it. Sets can only be deleted
+from open sessions, which the ledger doesn't count yet. Deleting a workout
+takes its finished sessions and their sets with it, so the delete view
+refresh()es the rows of every exercise they had sets of; deleting an exercise
+takes its row along. An import refresh()es the exercises it brought sets for
+once it has closed its sessions. rebuild() recomputes everything, after
+writes that bypass all of these, such as seed_gym or changes made in the
+admin or the shell.
+"""
+import logging
+from decimal import Decimal
+from itertools import groupby, islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, FloatField, Max, Min, Sum, Value, When
+from django.db.models.functions import Cast
+
+from .models import ExercisePerformance, PersonalRecord
+from .rollups import SET_VOLUME, finished_performances
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+# Epley: weight × (1 + reps / 30). A single is its own one-rep max. In
+# floats, as SQLite keeps whole-number decimals as integers and would divide
+# them as such.
+ESTIMATED_1RM = Case(
+    When(reps__lt=1, then=Value(0.0)),
+    When(reps=1, then=Cast('weight', FloatField())),
+    default=Cast('weight', FloatField()) * (F('reps') + 30) / 30.0,
+    output_field=FloatField(),
+)
+
+# The bests, in the order they are reported, with how they read in the UI
+RECORD_FIELDS = {
+    'max_weight': "heaviest weight",
+    'max_reps': "most reps",
+    'max_set_volume': "biggest set",
+    'estimated_1rm': "estimated 1RM",
+}
+
+
+def describe(fields):
+    """Record fields as a phrase, such as "heaviest weight and estimated 1RM" """
+    labels = [RECORD_FIELDS[field] for field in fields]
+    return ' and '.join([', '.join(labels[:-1]), labels[-1]] if len(labels) > 1 else labels)
+
+
+def estimated_1rm(weight, reps):
+    if reps < 1:
+        return Decimal(0)
+    if reps == 1:
+        return weight
+    return (weight * (reps + 30) / 30).quantize(CENT)
+
+
+def _bests(performance):
+    return _set_bests(performance.weight, performance.reps)
+
+
+def _set_bests(weight, reps):
+    weight = Decimal(weight)
+    return {
+        'max_weight': weight,
+        'max_reps': reps,
+        'max_set_volume': weight * reps,
+        'estimated_1rm': estimated_1rm(weight, reps),
+    }
+
+
+def _merge(bests, other):
+    if bests is None:
+        return dict(other)
+    return {field: max(value, other[field]) for field, value in bests.items()}
+
+
+def _locked_record(user_id, exercise_id, first_performed_at):
+    """The exercise's row, locked until the transaction ends; created empty on the first set"""
+    records = PersonalRecord.objects.select_for_update().filter(user_id=user_id, exercise_id=exercise_id)
+    record = records.first()
+    if record is None:
+        # A concurrent first set loses on the unique constraint and locks the winner's row
+        try:
+            with transaction.atomic():
+                record = PersonalRecord.objects.create(
+                    user_id=user_id, exercise_id=exercise_id, max_weight=0, max_reps=0, max_set_volume=0,
+                    estimated_1rm=0, total_volume=0, set_count=0, first_performed_at=first_performed_at,
+                )
+        except IntegrityError:
+            record = records.get()
+    return record
+
+
+def _by_exercise(performances):
+    # Rows are locked in exercise order, so two writers never wait on each other crosswise
+    performances = sorted(performances, key=lambda p: (p.exercise_id, p.performed_at))
+    return groupby(performances, key=lambda p: p.exercise_id)
+
+
+def flag_records(user_id, session_id, performances):
+    """
+    Mark sets just saved in an open session with the records they set,
+    without touching the ledger.
+
+    Each performance gets a ``new_records`` list of the RECORD_FIELDS it beat,
+    counting the ledger and the sets logged before it in the session; empty
+    for the first sets of an exercise, which have nothing to beat. Returns
+    how many of the sets set a record.
+    """
+    count = 0
+    for exercise_id, block in _by_exercise(performances):
+        block = list(block)
+        bests = PersonalRecord.objects.filter(
+            user_id=user_id, exercise_id=exercise_id
+        ).values(*RECORD_FIELDS).first()
+        earlier = ExercisePerformance.objects.filter(
+            workout_session_id=session_id, exercise_id=exercise_id
+        ).exclude(pk__in=[performance.pk for performance in block]).values_list('weight', 'reps')
+        for weight, reps in earlier:
+            bests = _merge(bests, _set_bests(weight, reps))
+        for performance in block:
+            set_bests = _bests(performance)
+            performance.new_records = [] if bests is None else [
+                field for field, value in set_bests.items() if value > bests[field]
+            ]
+            count += bool(performance.new_records)
+            bests = _merge(bests, set_bests)
+    return count
+
+
+def record_sets(user_id, performances):
+    """
+    Fold the sets of a session that just finished into the ledger. Call it
+    in the transaction that finished it.
+
+    Each performance gets a ``new_records`` list of the RECORD_FIELDS it beat,
+    empty for the first sets of an exercise, which have nothing to beat.
+    Returns how many of the sets set a record.
+    """
+    count = 0
+    # Part of the caller's transaction: no savepoint of its own
+    with transaction.atomic(savepoint=False):
+        for exercise_id, block in _by_exercise(performances):
+            block = list(block)
+            record = _locked_record(user_id, exercise_id, block[0].performed_at)
+            for performance in block:
+                bests = _bests(performance)
+                beaten = [field for field, value in bests.items() if value > getattr(record, field)]
+                for field in beaten:
+                    setattr(record, field, bests[field])
+                performance.new_records = beaten if record.set_count else []
+                count += bool(performance.new_records)
+                record.total_volume += bests['max_set_volume']
+                record.set_count += 1
+                record.first_performed_at = min(record.first_performed_at, performance.performed_at)
+            record.save()
+    return count
+
+
+def aggregate_records(performances):
+    """Group performances into one ledger row per (user, exercise) in the database"""
+    return performances.order_by().annotate(
+        user=F('workout_session__user'),
+    ).values('user', 'exercise').annotate(
+        max_weight=Max('weight'),
+        max_reps=Max('reps'),
+        max_set_volume=Max(SET_VOLUME),
+        estimated_1rm=Max(ESTIMATED_1RM),
+        total_volume=Sum(SET_VOLUME),
+        set_count=Count('id'),
+        first_performed_at=Min('performed_at'),
+    )
+
+
+def _build_rows(aggregates):
+    for row in aggregates:
+        yield PersonalRecord(
+            user_id=row['user'],
+            exercise_id=row['exercise'],
+            **{field: row[field] for field in (*RECORD_FIELDS, 'total_volume', 'set_count', 'first_performed_at')},
+        )
+
+
+def refresh(user_id, exercise_ids):
+    """Recompute the ledger rows of some of a user's exercises from their finished sets"""
+    if not exercise_ids:
+        return 0
+    rows = list(_build_rows(aggregate_records(finished_performances().filter(
+        workout_session__user_id=user_id, exercise_id__in=exercise_ids,
+    ))))
+    with transaction.atomic():
+        PersonalRecord.objects.filter(user_id=user_id, exercise_id__in=exercise_ids).delete()
+        PersonalRecord.objects.bulk_create(rows)
+    logger.debug(f"Refreshed {len(rows)} personal records for user {user_id}")
+    return len(rows)
+
+
+def rebuild(user=None, batch_size=1000):
+    """Rebuild the whole ledger, or just one user's rows"""
+    performances = finished_performances()
+    existing = PersonalRecord.objects.all()
+    if user is not None:
+        performances = performances.filter(workout_session__user=user)
+        existing = existing.filter(user=user)
+
+    rows = _build_rows(aggregate_records(performances).iterator(chunk_size=batch_size))
+    count = 0
+    with transaction.atomic():
+        existing.delete()
+        while batch := list(islice(rows, batch_size)):
+            PersonalRecord.objects.bulk_create(batch)
+            count += len(batch)
+    return count
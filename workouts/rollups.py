@@ -0,0 +1,258 @@
+"""
+Maintenance of the ExerciseDailyStats and TrainingPeriodStats rollup tables.
+
+Only sets from finished sessions are rolled up, matching what the analysis
+page has always counted. Rows are recomputed per (user, exercise, day) or
+(user, period, start) key straight from ExercisePerformance and
+WorkoutSession, so refreshing a key is idempotent. Sessions fall in the week
+and month they started in, in the current time zone.
+
+The rest time of a day is taken from its sets' times. Sets logged in a batch
+all carry the moment the batch was sent rather than when they were done, so
+they are left out of it: rest_seconds and rest_intervals only cover the
+other sets.
+
+Deleting a workout takes its sessions and sets with it in a cascade that
+sends no per-key signal, so the delete view collects the day keys and the
+session start times first and refreshes both tables once the rows are gone.
+"""
+import logging
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Count, DateField, DecimalField, DurationField, ExpressionWrapper, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import ExerciseDailyStats, ExercisePerformance, TrainingPeriodStats, WorkoutSession
+
+logger = logging.getLogger(__name__)
+
+# Sets whose performed_at says when they were done
+TIMED = Q(batch_logged=False)
+
+SET_VOLUME = ExpressionWrapper(
+    F('weight') * F('reps'),
+    output_field=DecimalField(max_digits=12, decimal_places=2)
+)
+
+PERIOD_TRUNC = {
+    TrainingPeriodStats.WEEK: TruncWeek,
+    TrainingPeriodStats.MONTH: TruncMonth,
+}
+
+
+def finished_performances():
+    return ExercisePerformance.objects.filter(workout_session__finished_at__isnull=False)
+
+
+def aggregate_daily(performances):
+    """Group performances into one row per (user, exercise, day) in the database"""
+    return performances.order_by().annotate(
+        day=TruncDate('performed_at'),
+        user=F('workout_session__user'),
+    ).values('user', 'exercise', 'day').annotate(
+        max_weight=Max('weight'),
+        max_reps=Max('reps'),
+        max_set_volume=Max(SET_VOLUME),
+        total_volume=Sum(SET_VOLUME),
+        set_count=Count('id'),
+        first_performed_at=Min('performed_at'),
+        last_performed_at=Max('performed_at'),
+        timed_count=Count('id', filter=TIMED),
+        first_timed_at=Min('performed_at', filter=TIMED),
+        last_timed_at=Max('performed_at', filter=TIMED),
+    )
+
+
+def _build_rows(aggregates):
+    for row in aggregates:
+        # Gaps between consecutive sets of a day telescope to last - first
+        intervals = max(row['timed_count'] - 1, 0)
+        rest = (row['last_timed_at'] - row['first_timed_at']).total_seconds() if intervals else 0
+        yield ExerciseDailyStats(
+            user_id=row['user'],
+            exercise_id=row['exercise'],
+            day=row['day'],
+            max_weight=row['max_weight'],
+            max_reps=row['max_reps'],
+            max_set_volume=row['max_set_volume'],
+            total_volume=row['total_volume'],
+            set_count=row['set_count'],
+            rest_seconds=rest,
+            rest_intervals=intervals,
+            first_performed_at=row['first_performed_at'],
+            last_performed_at=row['last_performed_at'],
+        )
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def refresh_keys(user, keys):
+    """Recompute the rollup rows for the given (exercise_id, day) keys of a user"""
+    keys = set(keys)
+    if not keys:
+        return 0
+    exercise_ids = {exercise_id for exercise_id, _ in keys}
+    days = {day for _, day in keys}
+
+    # A plain range on performed_at (rather than __date) can use the
+    # (exercise, performed_at) index; rows outside the keys are dropped below
+    aggregates = aggregate_daily(finished_performances().filter(
+        workout_session__user=user,
+        exercise_id__in=exercise_ids,
+        performed_at__gte=_day_start(min(days)),
+        performed_at__lt=_day_start(max(days) + timedelta(days=1)),
+    ))
+    rows = [r for r in _build_rows(aggregates) if (r.exercise_id, r.day) in keys]
+
+    with transaction.atomic():
+        stale = Q()
+        for exercise_id, day in keys:
+            stale |= Q(exercise_id=exercise_id, day=day)
+        ExerciseDailyStats.objects.filter(stale, user=user).delete()
+        ExerciseDailyStats.objects.bulk_create(rows)
+    logger.debug(f"Refreshed {len(rows)} rollup rows for user {user.pk}")
+    return len(rows)
+
+
+def session_keys(sessions):
+    """The (exercise_id, day) keys the sets of some sessions are rolled up under"""
+    return ExercisePerformance.objects.filter(
+        workout_session__in=sessions
+    ).order_by().annotate(
+        day=TruncDate('performed_at')
+    ).values_list('exercise_id', 'day').distinct()
+
+
+def refresh_session(session):
+    """Fold the sets of a (finished) session into the rollup tables"""
+    refresh_periods(session.user, [session.started_at])
+    return refresh_keys(session.user, session_keys([session]))
+
+
+def rebuild(user=None, since=None, batch_size=1000):
+    """Rebuild the whole daily rollup table, or just one user's rows or the days from ``since`` on"""
+    performances = finished_performances()
+    existing = ExerciseDailyStats.objects.all()
+    if user is not None:
+        performances = performances.filter(workout_session__user=user)
+        existing = existing.filter(user=user)
+    if since is not None:
+        performances = performances.filter(performed_at__gte=_day_start(since))
+        existing = existing.filter(day__gte=since)
+
+    # Streamed a batch at a time, so a full rebuild never holds every row
+    rows = _build_rows(aggregate_daily(performances).iterator(chunk_size=batch_size))
+    count = 0
+    with transaction.atomic():
+        existing.delete()
+        while batch := list(islice(rows, batch_size)):
+            ExerciseDailyStats.objects.bulk_create(batch)
+            count += len(batch)
+    return count
+
+
+def period_start(period, day):
+    if period == TrainingPeriodStats.WEEK:
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def _period_end(period, start):
+    if period == TrainingPeriodStats.WEEK:
+        return start + timedelta(days=7)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def _finished_sessions(prefix='', user=None, start=None, end=None):
+    """Filter on finished sessions, optionally of a user and started in [start, end)"""
+    condition = Q(**{f'{prefix}finished_at__isnull': False})
+    if user is not None:
+        condition &= Q(**{f'{prefix}user': user})
+    if start is not None:
+        condition &= Q(**{f'{prefix}started_at__gte': _day_start(start)})
+    if end is not None:
+        condition &= Q(**{f'{prefix}started_at__lt': _day_start(end)})
+    return condition
+
+
+def aggregate_periods(period, user=None, start=None, end=None):
+    """One TrainingPeriodStats row per (user, period start), from two grouped queries"""
+    trunc = PERIOD_TRUNC[period]
+    session_totals = WorkoutSession.objects.filter(
+        _finished_sessions('', user, start, end)
+    ).order_by().annotate(
+        start=trunc('started_at', output_field=DateField()),
+    ).values('user', 'start').annotate(
+        session_count=Count('id'),
+        duration=Sum(ExpressionWrapper(F('finished_at') - F('started_at'), output_field=DurationField())),
+    )
+    rows = {
+        (row['user'], row['start']): TrainingPeriodStats(
+            user_id=row['user'],
+            period=period,
+            start=row['start'],
+            session_count=row['session_count'],
+            duration_seconds=row['duration'].total_seconds() if row['duration'] else 0,
+        )
+        for row in session_totals
+    }
+
+    # Summed separately: joining the sets to the sessions above would count
+    # every session once per set
+    set_totals = ExercisePerformance.objects.filter(
+        _finished_sessions('workout_session__', user, start, end)
+    ).order_by().annotate(
+        user=F('workout_session__user'),
+        start=trunc('workout_session__started_at', output_field=DateField()),
+    ).values('user', 'start').annotate(
+        set_count=Count('id'),
+        total_volume=Sum(SET_VOLUME),
+    )
+    for row in set_totals:
+        stats = rows[(row['user'], row['start'])]
+        stats.set_count = row['set_count']
+        stats.total_volume = row['total_volume'] or 0
+    return list(rows.values())
+
+
+def refresh_periods(user, moments):
+    """Recompute the weekly and monthly rows of a user covering the given session start times"""
+    days = {timezone.localdate(moment) for moment in moments}
+    if not days:
+        return 0
+    count = 0
+    with transaction.atomic():
+        for period in PERIOD_TRUNC:
+            starts = {period_start(period, day) for day in days}
+            rows = [
+                r for r in aggregate_periods(period, user, min(starts), _period_end(period, max(starts)))
+                if r.start in starts
+            ]
+            TrainingPeriodStats.objects.filter(user=user, period=period, start__in=starts).delete()
+            TrainingPeriodStats.objects.bulk_create(rows)
+            count += len(rows)
+    logger.debug(f"Refreshed {count} period rollup rows for user {user.pk}")
+    return count
+
+
+def rebuild_periods(user=None, since=None, batch_size=1000):
+    """Rebuild the weekly and monthly rollups, or just one user's rows or the periods from ``since`` on"""
+    count = 0
+    with transaction.atomic():
+        for period in PERIOD_TRUNC:
+            start = period_start(period, since) if since is not None else None
+            existing = TrainingPeriodStats.objects.filter(period=period)
+            if user is not None:
+                existing = existing.filter(user=user)
+            if start is not None:
+                existing = existing.filter(start__gte=start)
+            rows = aggregate_periods(period, user, start)
+            existing.delete()
+            TrainingPeriodStats.objects.bulk_create(rows, batch_size=batch_size)
+            count += len(rows)
+    return count
@@ -0,0 +1,87 @@
+from weakref import WeakKeyDictionary
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import chart_cache
+from .models import ExercisePerformance, Workout, WorkoutExercise, WorkoutSession
+
+# Owners already looked up during a delete, per delete origin: a bulk delete
+# sends post_delete once per row, and every row would look up the same owner
+_owners = WeakKeyDictionary()
+
+
+def invalidate_charts(user_id=None, workout_id=None):
+    """Bump the chart data versions once the surrounding transaction commits"""
+    def bump():
+        if user_id is not None:
+            chart_cache.invalidate(chart_cache.user_scope(user_id))
+        if workout_id is not None:
+            chart_cache.invalidate(chart_cache.workout_scope(workout_id))
+    transaction.on_commit(bump)
+
+
+def _remembered(origin, key, lookup):
+    try:
+        memo = _owners.setdefault(origin, {})
+    except TypeError:
+        # No origin (a save), or one that can't be weakly referenced
+        return lookup()
+    if key not in memo:
+        memo[key] = lookup()
+    return memo[key]
+
+
+def _session_owner(performance, origin=None):
+    """(user id, workout id) of a set's session, without loading the session when it can be helped"""
+    if ExercisePerformance.workout_session.is_cached(performance):
+        session = performance.workout_session
+        return session.user_id, session.workout_id
+    # Deleted along with its session or workout, which is known already
+    if isinstance(origin, WorkoutSession) and origin.pk == performance.workout_session_id:
+        return origin.user_id, origin.workout_id
+    return _remembered(origin, ('session', performance.workout_session_id), lambda: tuple(
+        WorkoutSession.objects.filter(pk=performance.workout_session_id).values_list('user_id', 'workout_id').get()
+    ))
+
+
+def _workout_user(workout_exercise, origin=None):
+    if WorkoutExercise.workout.is_cached(workout_exercise):
+        return workout_exercise.workout.user_id
+    if isinstance(origin, Workout) and origin.pk == workout_exercise.workout_id:
+        return origin.user_id
+    return _remembered(origin, ('workout', workout_exercise.workout_id), lambda: (
+        Workout.objects.filter(pk=workout_exercise.workout_id).values_list('user_id', flat=True).get()
+    ))
+
+
+@receiver(post_save, sender=ExercisePerformance)
+def performance_saved(sender, instance, created, **kwargs):
+    if created:
+        invalidate_charts(*_session_owner(instance))
+
+
+@receiver(post_delete, sender=ExercisePerformance)
+def performance_deleted(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Workout):
+        # The workout's sessions go too, and session_deleted covers the same scopes
+        return
+    invalidate_charts(*_session_owner(instance, origin))
+
+
+@receiver(post_save, sender=WorkoutSession)
+def session_saved(sender, instance, **kwargs):
+    if instance.finished_at:
+        invalidate_charts(instance.user_id, instance.workout_id)
+
+
+@receiver(post_delete, sender=WorkoutSession)
+def session_deleted(sender, instance, **kwargs):
+    invalidate_charts(instance.user_id, instance.workout_id)
+
+
+@receiver([post_save, post_delete], sender=WorkoutExercise)
+def workout_exercise_changed(sender, instance, origin=None, **kwargs):
+    # Completion rates and the workout analysis both follow the template
+    invalidate_charts(_workout_user(instance, origin), instance.workout_id)
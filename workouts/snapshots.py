@@ -0,0 +1,280 @@
+"""
+Columnar snapshots of the training history for offline analytics.
+
+``manage.py snapshot_history`` writes three tables under an output directory:
+
+- ``performances``: the sets of finished sessions, one row per set
+- ``sessions``: finished sessions
+- ``workout_exercises``: the workout templates
+
+Columns are named after the ``values()`` lookups the analysis views use, so
+``engine.load_snapshot()`` frames go straight into ``engine.summarize_sets()``.
+Files are Arrow IPC (memory-mappable, the default) or Parquet, either one
+file set for everyone or partitioned per user as ``user_id=<id>/``
+directories.
+
+Finished sessions no longer change, so ``performances`` and ``sessions`` are
+exported incrementally: each run appends new part files holding only the
+finished sessions the snapshot doesn't have yet, and their sets; a run that
+finds none appends nothing. Which those are comes from the ids in the
+``sessions`` table already written, not from a finish time: imported
+sessions finish in the past, and a session can commit after others that
+finished later. ``_watermark.json`` records the layout and the user the
+snapshot was written for. Templates do change, so ``workout_exercises`` is
+rewritten on every run.
+
+pyarrow is only needed here and by ``engine.load_snapshot()``; it isn't a
+dependency of the web app.
+"""
+import json
+import logging
+import shutil
+from datetime import timezone as dt_timezone
+from itertools import chain, groupby, islice
+from pathlib import Path
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ExercisePerformance, WorkoutExercise, WorkoutSession
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'arrow': '.arrow', 'parquet': '.parquet'}
+WATERMARK_FILE = '_watermark.json'
+DEFAULT_BATCH_SIZE = 10000
+# Session ids per query when exporting a selection of sessions
+SESSION_CHUNK_SIZE = 500
+# Part files being written; readers skip them
+PENDING_SUFFIX = '.pending'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise SnapshotError("Snapshots need pyarrow, which isn't installed: pip install pyarrow")
+    return pyarrow
+
+
+def _tables(pa):
+    """(queryset factory, session id lookup for incremental runs, Arrow schema) per table"""
+    timestamp = pa.timestamp('us', tz='UTC')
+    return {
+        'performances': (
+            lambda: ExercisePerformance.objects.annotate(
+                user_id=F('workout_session__user_id'),
+                workout_id=F('workout_session__workout_id'),
+            ),
+            'workout_session_id',
+            pa.schema([
+                ('id', pa.int64()),
+                ('user_id', pa.int64()),
+                ('workout_session_id', pa.int64()),
+                ('workout_id', pa.int64()),
+                ('exercise_id', pa.int64()),
+                ('exercise__name', pa.string()),
+                ('set_number', pa.int32()),
+                ('reps', pa.int32()),
+                ('weight', pa.decimal128(5, 2)),
+                ('performed_at', timestamp),
+                ('workout_session__started_at', timestamp),
+            ]),
+        ),
+        'sessions': (
+            lambda: WorkoutSession.objects.all(),
+            'pk',
+            pa.schema([
+                ('id', pa.int64()),
+                ('user_id', pa.int64()),
+                ('workout_id', pa.int64()),
+                ('workout__name', pa.string()),
+                ('started_at', timestamp),
+                ('finished_at', timestamp),
+            ]),
+        ),
+        'workout_exercises': (
+            lambda: WorkoutExercise.objects.annotate(user_id=F('workout__user_id')),
+            None,
+            pa.schema([
+                ('id', pa.int64()),
+                ('user_id', pa.int64()),
+                ('workout_id', pa.int64()),
+                ('exercise_id', pa.int64()),
+                ('exercise__name', pa.string()),
+                ('suggested_sets', pa.int32()),
+                ('suggested_reps', pa.int32()),
+                ('order', pa.int32()),
+            ]),
+        ),
+    }
+
+
+def read_watermark(root):
+    path = Path(root) / WATERMARK_FILE
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def _write_watermark(root, fmt, partition, user):
+    (Path(root) / WATERMARK_FILE).write_text(json.dumps({
+        'format': fmt,
+        'partition': partition,
+        'user': user.pk if user is not None else None,
+        'written_at': timezone.now().isoformat(),
+    }, indent=2))
+
+
+def _exported_session_ids(pa, root):
+    """Ids of the sessions the snapshot below ``root`` already holds"""
+    ids = set()
+    for path in (Path(root) / 'sessions').rglob('part-*'):
+        if path.suffix == '.arrow':
+            table = pa.ipc.open_file(pa.memory_map(str(path))).read_all().select(['id'])
+        elif path.suffix == '.parquet':
+            table = pa.parquet.read_table(path, columns=['id'], memory_map=True)
+        else:
+            continue
+        ids.update(table.column('id').to_pylist())
+    return ids
+
+
+def _open_writer(pa, path, schema, fmt):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == 'parquet':
+        return pa.parquet.ParquetWriter(str(path), schema)
+    return pa.ipc.new_file(str(path), schema)
+
+
+def _batches(pa, rows, schema, batch_size):
+    names = schema.names
+    while chunk := list(islice(rows, batch_size)):
+        columns = list(zip(*chunk))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)], names=names
+        )
+
+
+def _selected_rows(queryset, session_field, session_ids, names, batch_size):
+    """The rows of ``queryset`` belonging to ``session_ids``, queried a chunk of ids at a time"""
+    for start in range(0, len(session_ids), SESSION_CHUNK_SIZE):
+        chunk = queryset.filter(**{f'{session_field}__in': session_ids[start:start + SESSION_CHUNK_SIZE]})
+        yield from chunk.values_list(*names).iterator(chunk_size=batch_size)
+
+
+def _export_table(pa, root, name, queryset, schema, fmt, partition, part, batch_size, written,
+                  session_field=None, session_ids=None):
+    """
+    Write ``queryset`` as part files of table ``name``, only the rows of
+    ``session_ids`` when given; returns the number of rows. Files get a
+    temporary name, added to ``written``, until the whole run has succeeded.
+    """
+    if partition == 'user':
+        queryset = queryset.order_by('user_id', 'pk')
+    else:
+        queryset = queryset.order_by('pk')
+    if session_ids is None:
+        rows = queryset.values_list(*schema.names).iterator(chunk_size=batch_size)
+    else:
+        # Ids come sorted by user when partitioned, so a user's rows stay together across chunks
+        rows = _selected_rows(queryset, session_field, session_ids, schema.names, batch_size)
+
+    user_index = schema.names.index('user_id')
+    groups = groupby(rows, key=lambda row: row[user_index]) if partition == 'user' else [(None, rows)]
+    count = 0
+    for user_id, group in groups:
+        first = next(group, None)
+        if first is None:
+            # Nothing new since the last run; an empty part would only pile up
+            continue
+        group = chain([first], group)
+        directory = Path(root) / name
+        if user_id is not None:
+            directory = directory / f'user_id={user_id}'
+        path = directory / f'part-{part}{FORMATS[fmt]}{PENDING_SUFFIX}'
+        written.append(path)
+        writer = _open_writer(pa, path, schema, fmt)
+        try:
+            for batch in _batches(pa, group, schema, batch_size):
+                writer.write_batch(batch)
+                count += batch.num_rows
+        finally:
+            writer.close()
+    return count
+
+
+def write_snapshot(root, fmt='arrow', partition='none', user=None, full=False, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Export the history below ``root``; see the module docstring.
+
+    Returns ``{table: rows written}``. A full export, or the first one,
+    replaces whatever snapshot ``root`` held.
+    """
+    pa = _pyarrow()
+    if fmt not in FORMATS:
+        raise SnapshotError(f"Unknown format {fmt}")
+    root = Path(root)
+    state = None if full else read_watermark(root)
+    if state and (state['format'], state['partition']) != (fmt, partition):
+        raise SnapshotError(
+            f"{root} holds a {state['format']} snapshot partitioned by {state['partition']}; "
+            f"export it in full to change the layout"
+        )
+    user_id = user.pk if user is not None else None
+    if state and state.get('user') != user_id:
+        held = f"user {state['user']}" if state.get('user') is not None else "every user"
+        raise SnapshotError(f"{root} holds a snapshot of {held}; export it in full to change whose history it holds")
+
+    tables = _tables(pa)
+    if state is None:
+        for name in tables:
+            shutil.rmtree(root / name, ignore_errors=True)
+        exported = set()
+    else:
+        # Left by a run that failed part way
+        for path in root.rglob(f'part-*{PENDING_SUFFIX}'):
+            path.unlink()
+        exported = _exported_session_ids(pa, root)
+
+    # Fix the sessions to export up front, so both tables hold the same ones
+    # even as sessions finish while this runs
+    finished = WorkoutSession.objects.filter(finished_at__isnull=False)
+    if user is not None:
+        finished = finished.filter(user=user)
+    order = ('user_id', 'pk') if partition == 'user' else ('pk',)
+    session_ids = [
+        pk for pk in finished.order_by(*order).values_list('pk', flat=True).iterator(chunk_size=batch_size)
+        if pk not in exported
+    ]
+
+    part = timezone.now().astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    counts = {}
+    written = []
+    for name, (queryset, session_field, schema) in tables.items():
+        queryset = queryset()
+        if user is not None:
+            queryset = queryset.filter(user_id=user.pk)
+        counts[name] = _export_table(
+            pa, root, name, queryset, schema, fmt, partition, part, batch_size, written,
+            session_field, session_ids if session_field else None,
+        )
+
+    # Publish the new parts only now, sessions last: a failed run adds no
+    # sets without their sessions, and no sessions without their sets.
+    # Templates are rewritten, so their previous parts go.
+    for path in (root / 'workout_exercises').rglob('part-*'):
+        if path.suffix != PENDING_SUFFIX:
+            path.unlink()
+    for path in sorted(written, key=lambda path: path.parts[len(root.parts)] == 'sessions'):
+        path.rename(path.with_name(path.name.removesuffix(PENDING_SUFFIX)))
+    # A run that found no new sessions leaves the watermark as it was
+    if state is None or session_ids:
+        _write_watermark(root, fmt, partition, user)
+    logger.info(f"Wrote {fmt} snapshot to {root}: {counts}")
+    return counts
@@ -1,3 +1,1688 @@
-from django.test import TestCase
+import csv
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import chart_cache, chart_workers, concurrency, engine, importer, jobs, records, rollups, snapshots
+from .export import HEADER
+from .middleware import QueryRecorder, current_recorder, statement_shape
+from .pagination import encode_cursor, keyset_filter
+from .models import (
+    Exercise, ExerciseDailyStats, ExercisePerformance, Job, PersonalRecord, SetCounter, SharedWorkout,
+    TrainingPeriodStats, Workout, WorkoutExercise, WorkoutSession,
+)
+
+
+class QueryPlanTests(TestCase):
+    """The hot query paths keep using the indexes declared on the models"""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.users = User.objects.bulk_create([User(username=f'user{i}') for i in range(5)])
+        sessions = []
+        for user in cls.users:
+            exercises = Exercise.objects.bulk_create([
+                Exercise(name=f'Exercise {i}', user=user) for i in range(5)
+            ])
+            workout = Workout.objects.create(name='Workout', user=user)
+            WorkoutExercise.objects.bulk_create([
+                WorkoutExercise(workout=workout, exercise=exercise, suggested_sets=3, suggested_reps=10, order=i)
+                for i, exercise in enumerate(exercises)
+            ])
+            for day in range(40):
+                sessions.append(WorkoutSession(
+                    user=user, workout=workout,
+                    finished_at=now - timedelta(days=day) if day else None,
+                ))
+        sessions = WorkoutSession.objects.bulk_create(sessions)
+        exercises = {user.pk: list(Exercise.objects.filter(user=user)) for user in cls.users}
+        ExercisePerformance.objects.bulk_create([
+            ExercisePerformance(
+                workout_session=session, exercise=exercise,
+                set_number=set_number, reps=10, weight=50,
+            )
+            for session in sessions
+            for exercise in exercises[session.user_id]
+            for set_number in range(1, 4)
+        ])
+        cls.user = cls.users[0]
+        cls.session = WorkoutSession.objects.filter(user=cls.user).first()
+        cls.exercise = exercises[cls.user.pk][0]
+
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+                # The seeded tables are small enough for a sequential scan to
+                # win, so rule it out to see which index the planner picks
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+        elif connection.vendor == 'sqlite':
+            plan = queryset.explain()
+        else:
+            self.skipTest(f"No query plan assertions for {connection.vendor}")
+        self.assertIn(index_name, plan)
+
+    def test_session_performances(self):
+        self.assertUsesIndex(
+            ExercisePerformance.objects.filter(workout_session=self.session).order_by('performed_at'),
+            'perf_session_performed_idx'
+        )
+
+    def test_session_list(self):
+        self.assertUsesIndex(
+            WorkoutSession.objects.filter(user=self.user).order_by('-started_at'),
+            'session_user_started_idx'
+        )
+
+    def test_finished_sessions_per_user(self):
+        self.assertUsesIndex(
+            WorkoutSession.objects.filter(user=self.user, finished_at__isnull=False).order_by('started_at'),
+            'session_user_finished_idx'
+        )
+
+    def test_finished_sessions_per_workout(self):
+        self.assertUsesIndex(
+            WorkoutSession.objects.filter(
+                workout=self.session.workout, finished_at__isnull=False
+            ).order_by('started_at'),
+            'session_workout_finished_idx'
+        )
+
+    def test_exercise_sets_by_time_range(self):
+        now = timezone.now()
+        self.assertUsesIndex(
+            ExercisePerformance.objects.filter(
+                exercise=self.exercise,
+                performed_at__gte=now - timedelta(days=1),
+                performed_at__lt=now,
+            ),
+            'perf_exercise_performed_idx'
+        )
+
+
+class QueryStatsMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lifter', password='secret')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    @override_settings(QUERY_STATS_SAMPLE_RATE=1.0)
+    def test_server_timing_header(self):
+        with self.assertLogs('workouts.middleware', 'INFO') as logs:
+            response = self.client.get(reverse('workouts:exercise_list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", app;dur=')
+        self.assertIn('query_stats view=workouts:exercise_list method=GET status=200', logs.output[0])
+
+    @override_settings(QUERY_STATS_SAMPLE_RATE=0)
+    def test_disabled(self):
+        response = self.client.get(reverse('workouts:exercise_list'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_repeated_statements_are_flagged(self):
+        Exercise.objects.bulk_create([Exercise(name=f'Exercise {i}', user=self.user) for i in range(5)])
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for exercise in Exercise.objects.all():
+                User.objects.get(pk=exercise.user_id)
+        self.assertEqual(recorder.count, 6)
+        self.assertEqual(recorder.duplicates, 4)
+        [(shape, count)] = recorder.repeated_shapes(3)
+        self.assertEqual(count, 5)
+        self.assertIn('auth_user', shape)
+
+    def test_statement_shape_ignores_parameter_count(self):
+        self.assertEqual(
+            statement_shape('SELECT 1 FROM t WHERE id IN (%s, %s)'),
+            statement_shape('SELECT 1 FROM t WHERE id IN (%s, %s, %s, %s)'),
+        )
+
+
+class ListQueryCountTests(TestCase):
+    """List pages issue the same number of queries whatever their length"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lifter', password='secret')
+        cls.friend = User.objects.create_user(username='friend', password='secret')
+        cls.exercise = Exercise.objects.create(name='Squat', user=cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def create_workouts(self, n):
+        workouts = Workout.objects.bulk_create([Workout(name=f'Workout {i}', user=self.user) for i in range(n)])
+        WorkoutExercise.objects.bulk_create([
+            WorkoutExercise(workout=workout, exercise=self.exercise, suggested_sets=3, suggested_reps=10, order=1)
+            for workout in workouts
+        ])
+        return workouts
+
+    def create_shared_workouts(self, n):
+        workouts = Workout.objects.bulk_create([Workout(name=f'Shared {i}', user=self.friend) for i in range(n)])
+        SharedWorkout.objects.bulk_create([
+            SharedWorkout(workout=workout, shared_by=self.friend, shared_with=self.user, is_accepted=True)
+            for workout in workouts
+        ])
+
+    def test_workout_list(self):
+        self.create_workouts(10)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('workouts:workout_list'))
+        self.assertContains(response, '1 exercises', count=10)
+        self.create_workouts(990)
+        with self.assertNumQueries(3):
+            self.client.get(reverse('workouts:workout_list'))
+
+    def test_session_list(self):
+        workout = self.create_workouts(1)[0]
+        for n in (10, 1000):
+            WorkoutSession.objects.all().delete()
+            WorkoutSession.objects.bulk_create([WorkoutSession(user=self.user, workout=workout) for _ in range(n)])
+            with self.subTest(rows=n), self.assertNumQueries(3):
+                response = self.client.get(reverse('workouts:session_list'))
+            self.assertContains(response, 'Workout 0', count=min(n, 20))
+
+    def test_start_session_form(self):
+        self.create_workouts(5)
+        self.create_shared_workouts(5)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('workouts:start_session'))
+        self.assertContains(response, '(Shared by friend)', count=5)
+        self.assertNotContains(response, '(Shared by lifter)')
+        self.create_workouts(495)
+        self.create_shared_workouts(495)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('workouts:start_session'))
+        self.assertContains(response, '(Shared by friend)', count=500)
+
+    def test_start_session_rejects_unshared_workout(self):
+        other = Workout.objects.create(name='Private', user=self.friend)
+        response = self.client.post(reverse('workouts:start_session'), {'workout': other.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(WorkoutSession.objects.filter(workout=other).exists())
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lifter', password='secret')
+        cls.workout = Workout.objects.create(name='Workout', user=cls.user)
+        # Runs of equal started_at values make the id tie-break matter
+        now = timezone.now()
+        cls.sessions = WorkoutSession.objects.bulk_create([
+            WorkoutSession(user=cls.user, workout=cls.workout) for _ in range(45)
+        ])
+        for i, session in enumerate(cls.sessions):
+            session.started_at = now - timedelta(hours=i // 4)
+        WorkoutSession.objects.bulk_update(cls.sessions, ['started_at'])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_pages_cover_every_session_once(self):
+        url = reverse('workouts:session_list')
+        seen = []
+        params = {}
+        while True:
+            with self.assertNumQueries(3):
+                response = self.client.get(url, params, HTTP_HX_REQUEST='true')
+            self.assertTemplateUsed(response, 'workouts/partials/session_cards.html')
+            self.assertTemplateNotUsed(response, 'workouts/session_list.html')
+            seen.extend(session.pk for session in response.context['sessions'])
+            if not response.context['next_cursor']:
+                break
+            params = {'after': response.context['next_cursor']}
+        expected = WorkoutSession.objects.order_by('-started_at', '-id').values_list('pk', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_exercise_pages_by_name(self):
+        Exercise.objects.bulk_create([Exercise(name=f'Exercise {i % 7}', user=self.user) for i in range(30)])
+        first = self.client.get(reverse('workouts:exercise_list'))
+        self.assertEqual(len(first.context['exercises']), 24)
+        second = self.client.get(reverse('workouts:exercise_list'), {'after': first.context['next_cursor']})
+        names = [(e.name, e.pk) for e in list(first.context['exercises']) + list(second.context['exercises'])]
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(len(names), 30)
+        self.assertIsNone(second.context['next_cursor'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('workouts:session_list'), {'after': 'bm90IGpzb24'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_values_of_the_wrong_type(self):
+        for name, values in (
+            ('session_list', ['x', 'y']),
+            ('session_list', ['2020-01-01', 'abc']),
+            ('session_list', ['2020-02-30T10:00:00', 1]),
+            ('session_list', [None, 1]),
+            ('session_list', [[1], {'a': 1}]),
+            ('exercise_list', ['Squat', 'abc']),
+            ('exercise_list', ['Squat', None]),
+        ):
+            with self.subTest(name=name, values=values):
+                response = self.client.get(reverse(f'workouts:{name}'), {'after': encode_cursor(values)})
+                self.assertEqual(response.status_code, 404)
+
+    def test_deep_page_uses_index(self):
+        session = self.sessions[30]
+        after = keyset_filter(('-started_at', '-id'), [session.started_at, session.pk])
+        plan = WorkoutSession.objects.filter(user=self.user).filter(after).order_by('-started_at', '-id')[:21].explain()
+        self.assertIn('session_user_started_idx', plan)
+        if connection.vendor == 'sqlite':
+            # Rows come out of the index already in page order
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+class WorkoutAnalysisStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lifter', password='secret')
+        cls.workout = Workout.objects.create(name='Workout', user=cls.user)
+        cls.session = WorkoutSession.objects.create(user=cls.user, workout=cls.workout, finished_at=timezone.now())
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.addCleanup(caches['charts'].clear)
+
+    def add_exercises(self, n, weights=(40, 50, 60, 100)):
+        start = self.workout.workoutexercise_set.count()
+        exercises = Exercise.objects.bulk_create([
+            Exercise(name=f'Exercise {start + i}', user=self.user) for i in range(n)
+        ])
+        WorkoutExercise.objects.bulk_create([
+            WorkoutExercise(workout=self.workout, exercise=exercise, suggested_sets=4, suggested_reps=5, order=start + i)
+            for i, exercise in enumerate(exercises)
+        ])
+        ExercisePerformance.objects.bulk_create([
+            ExercisePerformance(workout_session=self.session, exercise=exercise, set_number=i, reps=5, weight=weight)
+            for exercise in exercises
+            for i, weight in enumerate(weights, start=1)
+        ])
+        # bulk_create sends no signals
+        chart_cache.invalidate(chart_cache.workout_scope(self.workout.pk))
+
+    def test_percentiles_and_stats(self):
+        self.add_exercises(1)
+        response = self.client.get(reverse('workouts:workout_analysis', args=[self.workout.pk]))
+        data = response.context['exercise_stats'][Exercise.objects.get().pk]
+        self.assertEqual(data['name'], 'Exercise 0')
+        # percentile_cont interpolates between the two nearest weights
+        self.assertEqual(data['percentiles']['weight'], {'25th': 47.5, '50th': 55.0, '75th': 70.0})
+        self.assertEqual(data['stats']['total_sets'], 4)
+        self.assertEqual(data['stats']['avg_weight'], 62.5)
+        self.assertEqual(data['stats']['max_weight'], 100)
+        self.assertEqual(data['stats']['total_volume'], 1250)
+
+    def test_query_count_does_not_grow_with_exercises(self):
+        url = reverse('workouts:workout_analysis', args=[self.workout.pk])
+        self.add_exercises(2)
+        with self.assertNumQueries(6):
+            self.client.get(url)
+        self.add_exercises(10)
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['exercise_stats']), 12)
+        # Session, user and workout; the statistics come from the chart cache
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['exercise_stats']), 12)
+
+    def test_same_named_exercises_stay_apart(self):
+        first, second = Exercise.objects.bulk_create([Exercise(name='Squat', user=self.user) for _ in range(2)])
+        for order, (exercise, weight) in enumerate(((first, 100), (second, 60))):
+            WorkoutExercise.objects.create(
+                workout=self.workout, exercise=exercise, suggested_sets=3, suggested_reps=5, order=order
+            )
+            ExercisePerformance.objects.create(
+                workout_session=self.session, exercise=exercise, set_number=1, reps=5, weight=weight
+            )
+        response = self.client.get(reverse('workouts:workout_analysis', args=[self.workout.pk]))
+        self.assertEqual(
+            {pk: (data['name'], data['stats']['max_weight']) for pk, data in response.context['exercise_stats'].items()},
+            {first.pk: ('Squat', 100), second.pk: ('Squat', 60)},
+        )
+        url = reverse('workouts:workout_chart_data', args=[self.workout.pk, 'session_weight'])
+        for exercise, weight in ((first, 100), (second, 60)):
+            self.assertEqual(self.client.get(f'{url}?exercise={exercise.pk}').json()['y'], [weight])
+        # Only the workout's own exercises are charted
+        self.assertEqual(self.client.get(f'{url}?exercise=0').status_code, 404)
+        self.assertEqual(self.client.get(f'{url}?exercise=Squat').status_code, 404)
+
+
+
+class ConcurrentAnalysisTests(TransactionTestCase):
+    def test_queries_run_on_the_pool(self):
+        user = User.objects.create_user(username='lifter', password='secret')
+        workout = Workout.objects.create(name='Legs', user=user)
+        threads = set()
+
+        def count():
+            threads.add(threading.current_thread().name)
+            return Workout.objects.count()
+
+        self.assertEqual(async_to_sync(concurrency.gather)(count, count, count), [1, 1, 1])
+        self.assertTrue(threads)
+        self.assertTrue(all(name.startswith('query') for name in threads))
+
+        squat = Exercise.objects.create(name='Squat', user=user)
+        WorkoutExercise.objects.create(workout=workout, exercise=squat, suggested_sets=3, suggested_reps=5, order=1)
+        session = WorkoutSession.objects.create(user=user, workout=workout, finished_at=timezone.now())
+        ExercisePerformance.objects.create(workout_session=session, exercise=squat, set_number=1, reps=5, weight=100)
+        self.client.force_login(user)
+        response = self.client.get(reverse('workouts:workout_analysis', args=[workout.pk]))
+        self.assertEqual(response.context['exercise_stats'][squat.pk]['stats']['total_volume'], 500)
+
+    def test_pool_queries_are_recorded(self):
+        Workout.objects.create(name='Legs', user=User.objects.create_user(username='lifter', password='secret'))
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        try:
+            async_to_sync(concurrency.gather)(Workout.objects.count, Workout.objects.count)
+        finally:
+            current_recorder.reset(token)
+        self.assertEqual(recorder.count, 2)
+
+        # The request's header counts the same queries, whichever thread ran them
+        user = User.objects.get()
+        self.client.force_login(user)
+        url = reverse('workouts:workout_analysis', args=[Workout.objects.get().pk])
+        counts = []
+        for threads in (0, 4):
+            with override_settings(ANALYSIS_QUERY_THREADS=threads, QUERY_STATS_SAMPLE_RATE=1.0):
+                caches['charts'].clear()
+                counts.append(self.client.get(url)['Server-Timing'].split('desc="')[1].split()[0])
+        self.assertEqual(counts[0], counts[1])
+
+
+
+class ChartCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lifter', password='secret')
+        cls.workout = Workout.objects.create(name='Legs', user=cls.user)
+        cls.squat = Exercise.objects.create(name='Squat', user=cls.user)
+        cls.session = WorkoutSession.objects.create(user=cls.user, workout=cls.workout)
+
+    def setUp(self):
+        caches['charts'].clear()
+        self.addCleanup(caches['charts'].clear)
+
+    def versions(self):
+        return (
+            chart_cache.data_version(chart_cache.user_scope(self.user.pk)),
+            chart_cache.data_version(chart_cache.workout_scope(self.workout.pk)),
+        )
+
+    def assertBumpsVersions(self, change):
+        before = self.versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        after = self.versions()
+        self.assertNotEqual(before[0], after[0])
+        self.assertNotEqual(before[1], after[1])
+
+    def test_hits_and_misses(self):
+        render = mock.Mock(return_value={'x': [], 'y': []})
+        scope = chart_cache.user_scope(self.user.pk)
+        for _ in range(3):
+            self.assertEqual(chart_cache.get_or_render(scope, 'prs', render), {'x': [], 'y': []})
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(chart_cache.stats(), {'hits': 2, 'misses': 1, 'invalidations': 0, 'hit_ratio': 2 / 3})
+
+        chart_cache.invalidate(scope)
+        chart_cache.get_or_render(scope, 'prs', render)
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(chart_cache.stats()['invalidations'], 1)
+
+    def test_sets_bump_versions(self):
+        performance = ExercisePerformance(workout_session_id=self.session.pk, exercise=self.squat, set_number=1,
+                                          reps=5, weight=100)
+        self.assertBumpsVersions(performance.save)
+        self.assertBumpsVersions(ExercisePerformance.objects.get().delete)
+
+    def test_bulk_delete_looks_up_the_session_once(self):
+        ExercisePerformance.objects.bulk_create([
+            ExercisePerformance(workout_session=self.session, exercise=self.squat, set_number=n, reps=5, weight=100)
+            for n in range(1, 6)
+        ])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertBumpsVersions(ExercisePerformance.objects.filter(workout_session=self.session).delete)
+        lookups = [query['sql'] for query in queries if 'FROM "workouts_workoutsession"' in query['sql']]
+        self.assertEqual(len(lookups), 1)
+
+    def test_template_changes_bump_the_workout_version(self):
+        WorkoutExercise.objects.create(
+            workout=self.workout, exercise=self.squat, suggested_sets=3, suggested_reps=5, order=1
+        )
+        template = WorkoutExercise.objects.get()
+        template.suggested_sets = 4
+        self.assertBumpsVersions(template.save)
+        self.assertBumpsVersions(WorkoutExercise.objects.filter(workout=self.workout).delete)
+
+    def test_chart_endpoints_answer_conditional_requests(self):
+        WorkoutExercise.objects.create(workout=self.workout, exercise=self.squat, suggested_sets=3, suggested_reps=5, order=1)
+        self.client.force_login(self.user)
+        urls = [
+            reverse('workouts:analysis_chart_data', args=['volume']) + f'?exercise={self.squat.pk}',
+            reverse('workouts:workout_chart_data', args=[self.workout.pk, 'session_weight']) + f'?exercise={self.squat.pk}',
+        ]
+        etags = {}
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etags[url] = response['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('workouts:session_detail', args=[self.session.pk]),
+                             {'exercise': self.squat.pk, 'reps': 5, 'weight': 100})
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etags[url])
+
+    def test_deleting_a_workout_looks_up_no_owners(self):
+        ExercisePerformance.objects.create(workout_session=self.session, exercise=self.squat, set_number=1, reps=5, weight=100)
+        WorkoutExercise.objects.create(workout=self.workout, exercise=self.squat, suggested_sets=3, suggested_reps=5, order=1)
+        workout = Workout.objects.get()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertBumpsVersions(workout.delete)
+        # Only the collector's own reads, no single-row owner lookups
+        self.assertFalse([query for query in queries if query['sql'].endswith('LIMIT 21')])
+
+
+class AnalysisEngineTests(SimpleTestCase):
+    """The engine tells exercises apart by id; two of them may share a name"""
+
+    def test_summarize_daily(self):
+        rows = {
+            'exercise_id': [1, 2, 1, 3],
+            'exercise__name': ['Squat', 'Squat', 'Squat', 'Lunge'],
+            'day': [date(2024, 5, 2), date(2024, 5, 1), date(2024, 5, 1), date(2024, 5, 1)],
+            'max_weight': [Decimal('105'), Decimal('60'), Decimal('100'), Decimal('20')],
+            'max_reps': [5, 8, 5, 10],
+            'max_set_volume': [Decimal('525'), Decimal('480'), Decimal('500'), Decimal('200')],
+            'total_volume': [Decimal('1050'), Decimal('480'), Decimal('1500'), Decimal('400')],
+            'rest_intervals': [1, 0, 2, 1],
+            'rest_seconds': [180, 0, 240, 90],
+        }
+        summary = engine.summarize_daily(rows)
+        self.assertEqual(list(summary), [1, 2, 3])
+        self.assertEqual([data['name'] for data in summary.values()], ['Squat', 'Squat', 'Lunge'])
+
+        squat = summary[1]
+        self.assertEqual(engine.iso_dates(squat['days']), ['2024-05-01', '2024-05-02'])
+        self.assertEqual(squat['max_weight'].tolist(), [100, 105])
+        self.assertEqual(squat['volume'].tolist(), [1500, 1050])
+        self.assertEqual(squat['records'], {'max_weight': 105, 'max_volume': 525, 'max_reps': 5, 'total_volume': 2550})
+        # 420s over the three gaps of its two days
+        self.assertAlmostEqual(squat['avg_rest'], 420 / 3 / 60)
+
+        self.assertEqual(summary[2]['records']['max_weight'], 60)
+        self.assertIsNone(summary[2]['avg_rest'])
+        self.assertEqual(summary[3]['avg_rest'], 1.5)
+        self.assertEqual(engine.summarize_daily({field: [] for field in rows}), {})
+
+    def test_summarize_sets(self):
+        first, second = datetime(2024, 5, 1, 18), datetime(2024, 5, 3, 18)
+        rows = [
+            {'exercise_id': 1, 'exercise__name': 'Squat', 'weight': Decimal('100'), 'reps': 5, 'started_at': first},
+            {'exercise_id': 1, 'exercise__name': 'Squat', 'weight': Decimal('110'), 'reps': 3, 'started_at': first},
+            {'exercise_id': 2, 'exercise__name': 'Squat', 'weight': Decimal('60'), 'reps': 8, 'started_at': first},
+            {'exercise_id': 1, 'exercise__name': 'Squat', 'weight': Decimal('120'), 'reps': 2, 'started_at': second},
+        ]
+        summary = engine.summarize_sets(rows, 'started_at')
+        self.assertEqual(list(summary), [1, 2])
+
+        squat = summary[1]
+        self.assertEqual(squat['name'], 'Squat')
+        self.assertEqual(engine.iso_dates(squat['times'], unit='m'), ['2024-05-01T18:00', '2024-05-03T18:00'])
+        self.assertEqual(squat['avg_weight'].tolist(), [105, 120])
+        self.assertEqual(squat['volume'].tolist(), [830, 240])
+        self.assertEqual(squat['stats'], {
+            'avg_weight': 110, 'max_weight': 120, 'avg_reps': 10 / 3, 'max_reps': 5, 'total_sets': 3,
+            'max_volume': 500, 'total_volume': 1070,
+        })
+        self.assertEqual(squat['percentiles'], {'25th': 100, '50th': 110, '75th': 120})
+        # Two days between its three sets' sessions, over two gaps
+        self.assertEqual(squat['avg_rest'], 24 * 60)
+
+        self.assertEqual(summary[2]['name'], 'Squat')
+        self.assertEqual(summary[2]['stats']['total_sets'], 1)
+        self.assertIsNone(summary[2]['avg_rest'])
+
+        # Without ids, as in older snapshots, exercises are told apart by name
+        summary = engine.summarize_sets([{k: v for k, v in row.items() if k != 'exercise_id'} for row in rows],
+                                        'started_at')
+        self.assertEqual(list(summary), ['Squat'])
+        self.assertEqual(summary['Squat']['stats']['total_sets'], 4)
+
+
+class ChartWorkerTests(TestCase):
+    FIELDS = ('exercise__name', 'weight', 'reps', 'workout_session__started_at')
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='lifter', password='secret')
+        workout = Workout.objects.create(name='Legs', user=user)
+        exercises = [Exercise.objects.create(name=name, user=user) for name in ('Squat', 'Lunge')]
+        for day in range(3):
+            session = WorkoutSession.objects.create(
+                user=user, workout=workout, started_at=timezone.now() - timedelta(days=day), finished_at=timezone.now()
+            )
+            ExercisePerformance.objects.bulk_create([
+                ExercisePerformance(workout_session=session, exercise=exercise, set_number=n, reps=5 + n,
+                                    weight=f'{60 + 2.5 * n + day}')
+                for exercise in exercises
+                for n in range(1, 4)
+            ])
+        cls.performances = ExercisePerformance.objects.order_by('pk')
+
+    def summarize(self, rows):
+        return engine.summarize_sets(rows, 'workout_session__started_at')
+
+    def assertSameSummary(self, summary, expected):
+        self.assertEqual(summary.keys(), expected.keys())
+        for name, data in expected.items():
+            self.assertEqual(summary[name]['stats'], data['stats'])
+            self.assertEqual(list(summary[name]['times']), list(data['times']))
+            self.assertEqual(list(summary[name]['volume']), list(data['volume']))
+
+    def test_columns_summarize_like_rows(self):
+        rows = chart_workers.columns(self.performances.values_list(*self.FIELDS), self.FIELDS)
+        self.assertEqual(rows['workout_session__started_at'].dtype.kind, 'M')
+        self.assertSameSummary(self.summarize(rows), self.summarize(self.performances.values(*self.FIELDS)))
+        self.assertEqual(self.summarize(chart_workers.columns([], self.FIELDS)), {})
+
+    @override_settings(CHART_PROCESSES=1, CHART_PROCESS_MIN_ROWS=0)
+    def test_pool_and_timeout_fallback(self):
+        self.addCleanup(chart_workers.shutdown)
+        rows = chart_workers.columns(self.performances.values_list(*self.FIELDS), self.FIELDS)
+        expected = self.summarize(rows)
+        with self.assertNoLogs('workouts.chart_workers'):
+            self.assertSameSummary(chart_workers.run(engine.summarize_sets, rows, 'workout_session__started_at'), expected)
+        # No round trip to a worker answers within 0s, so this one runs inline
+        with override_settings(CHART_PROCESS_TIMEOUT=0), self.assertLogs('workouts.chart_workers', 'WARNING'):
+            self.assertSameSummary(chart_workers.run(engine.summarize_sets, rows, 'workout_session__started_at'), expected)
+
+
+class DailyRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lifter', password='secret')
+        cls.workout = Workout.objects.create(name='Workout', user=cls.user)
+        cls.squat = Exercise.objects.create(name='Squat', user=cls.user)
+        cls.bench = Exercise.objects.create(name='Bench', user=cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.addCleanup(caches['charts'].clear)
+
+    def session(self, started, sets, workout=None, finished=True):
+        started = timezone.make_aware(started)
+        session = WorkoutSession.objects.create(user=self.user, workout=workout or self.workout)
+        WorkoutSession.objects.filter(pk=session.pk).update(
+            started_at=started, finished_at=started + timedelta(hours=1) if finished else None
+        )
+        ExercisePerformance.objects.bulk_create([
+            ExercisePerformance(workout_session=session, exercise=exercise, set_number=i, reps=reps,
+                                weight=weight, performed_at=started + timedelta(minutes=3 * i))
+            for i, (exercise, reps, weight) in enumerate(sets, start=1)
+        ])
+        return session
+
+    def stats(self):
+        return {
+            (row.exercise_id, row.day): (row.set_count, row.max_weight, row.total_volume, row.rest_seconds)
+            for row in ExerciseDailyStats.objects.filter(user=self.user)
+        }
+
+    def test_refresh_keys(self):
+        self.session(datetime(2025, 3, 3, 10), [(self.squat, 5, 100), (self.squat, 5, 110), (self.bench, 5, 60)])
+        self.session(datetime(2025, 3, 5, 10), [(self.squat, 5, 120)], finished=False)
+        self.assertEqual(rollups.refresh_keys(self.user, [(self.squat.pk, date(2025, 3, 3))]), 1)
+        # Only the given key is written, with the time between its sets as rest
+        self.assertEqual(self.stats(), {(self.squat.pk, date(2025, 3, 3)): (2, 110, 1050, 180)})
+
+        # A key left without finished sets loses its row
+        ExercisePerformance.objects.filter(exercise=self.squat).delete()
+        self.assertEqual(rollups.refresh_keys(self.user, [(self.squat.pk, date(2025, 3, 3))]), 0)
+        self.assertEqual(self.stats(), {})
+
+    def test_rebuild(self):
+        self.session(datetime(2025, 3, 3, 10), [(self.squat, 5, 100), (self.bench, 5, 60)])
+        self.session(datetime(2025, 3, 5, 10), [(self.squat, 3, 120)])
+        self.session(datetime(2025, 3, 6, 10), [(self.squat, 5, 130)], finished=False)
+        self.assertEqual(rollups.rebuild(user=self.user), 3)
+        self.assertEqual(self.stats(), {
+            (self.squat.pk, date(2025, 3, 3)): (1, 100, 500, 0),
+            (self.bench.pk, date(2025, 3, 3)): (1, 60, 300, 0),
+            (self.squat.pk, date(2025, 3, 5)): (1, 120, 360, 0),
+        })
+
+        # Rows before ``since`` are left as they are
+        ExercisePerformance.objects.all().delete()
+        self.assertEqual(rollups.rebuild(user=self.user, since=date(2025, 3, 4)), 0)
+        self.assertEqual(set(self.stats()), {(self.squat.pk, date(2025, 3, 3)), (self.bench.pk, date(2025, 3, 3))})
+
+    def test_deleting_a_workout_refreshes_its_days(self):
+        other = Workout.objects.create(name='Other', user=self.user)
+        deleted = self.session(datetime(2025, 3, 3, 10), [(self.squat, 5, 100), (self.bench, 5, 60)])
+        self.session(datetime(2025, 3, 3, 18), [(self.squat, 5, 80)], workout=other)
+        rollups.rebuild(user=self.user)
+
+        response = self.client.post(reverse('workouts:workout_delete', args=[self.workout.pk]))
+        self.assertRedirects(response, reverse('workouts:workout_list'))
+        self.assertFalse(WorkoutSession.objects.filter(pk=deleted.pk).exists())
+        # The day keeps the other workout's set and nothing of the deleted one
+        self.assertEqual(self.stats(), {(self.squat.pk, date(2025, 3, 3)): (1, 80, 400, 0)})
+
+    def test_batch_logged_sets_have_no_rest_time(self):
+        session = self.session(datetime(2025, 3, 3, 10), [(self.squat, 5, 100), (self.squat, 5, 110)])
+        # A block logged at the end: the sets share the time it was sent
+        logged_at = timezone.make_aware(datetime(2025, 3, 3, 10, 45))
+        ExercisePerformance.objects.bulk_create([
+            ExercisePerformance(workout_session=session, exercise=self.squat, set_number=n, reps=5, weight=120,
+                                performed_at=logged_at, batch_logged=True)
+            for n in (3, 4)
+        ])
+        rollups.refresh_session(session)
+        row = ExerciseDailyStats.objects.get(user=self.user)
+        self.assertEqual((row.set_count, row.rest_seconds, row.rest_intervals), (4, 180, 1))
+
+        response = self.client.get(reverse('workouts:analysis_chart_data', args=['rest']))
+        self.assertEqual(response.json()['y'], [3.0])
+
+
+class PeriodRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lifter', password='secret')
+        cls.workout = Workout.objects.create(name='Workout', user=cls.user)
+        cls.exercise = Exercise.objects.create(name='Squat', user=cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        # Finishing a session pre-renders charts, which later tests' users would be served
+        self.addCleanup(caches['charts'].clear)
+
+    def session(self, started, minutes=60, weights=(100, 100)):
+        started = timezone.make_aware(started)
+        session = WorkoutSession.objects.create(user=self.user, workout=self.workout)
+        WorkoutSession.objects.filter(pk=session.pk).update(
+            started_at=started, finished_at=started + timedelta(minutes=minutes) if minutes else None
+        )
+        ExercisePerformance.objects.bulk_create([
+            ExercisePerformance(workout_session=session, exercise=self.exercise, set_number=i, reps=5,
+                                weight=weight, performed_at=started + timedelta(minutes=i))
+            for i, weight in enumerate(weights, start=1)
+        ])
+        session.refresh_from_db()
+        return session
+
+    def stats(self, period):
+        return {
+            row.start: (row.session_count, row.duration_seconds, row.set_count, row.total_volume)
+            for row in TrainingPeriodStats.objects.filter(user=self.user, period=period)
+        }
+
+    def test_rebuild(self):
+        self.session(datetime(2025, 3, 31, 10), minutes=60)
+        self.session(datetime(2025, 4, 2, 10), minutes=30, weights=(50,))
+        self.session(datetime(2025, 4, 3, 10), minutes=None)
+        self.assertEqual(rollups.rebuild_periods(), 3)
+        self.assertEqual(self.stats(TrainingPeriodStats.WEEK), {date(2025, 3, 31): (2, 5400, 3, 1250)})
+        self.assertEqual(self.stats(TrainingPeriodStats.MONTH), {
+            date(2025, 3, 1): (1, 3600, 2, 1000), date(2025, 4, 1): (1, 1800, 1, 250),
+        })
+
+    def test_finishing_a_session_refreshes_its_periods(self):
+        self.session(datetime(2025, 3, 31, 10))
+        session = self.session(datetime(2025, 4, 2, 10), minutes=None)
+        self.client.post(reverse('workouts:session_detail', args=[session.pk]), {'finish_workout': 1})
+        jobs.run_pending()
+        weeks = self.stats(TrainingPeriodStats.WEEK)
+        self.assertEqual(weeks[date(2025, 3, 31)][0], 2)
+        # Only the periods of the finished session are recomputed
+        self.assertEqual(list(self.stats(TrainingPeriodStats.MONTH)), [date(2025, 4, 1)])
+
+    def test_deleting_a_workout_refreshes_its_periods(self):
+        self.session(datetime(2025, 3, 31, 10))
+        other = Workout.objects.create(name='Other', user=self.user)
+        kept = self.session(datetime(2025, 4, 2, 10), minutes=30, weights=(50,))
+        WorkoutSession.objects.filter(pk=kept.pk).update(workout=other)
+        rollups.rebuild_periods()
+
+        self.client.post(reverse('workouts:workout_delete', args=[self.workout.pk]))
+        self.assertEqual(self.stats(TrainingPeriodStats.WEEK), {date(2025, 3, 31): (1, 1800, 1, 250)})
+        self.assertEqual(self.stats(TrainingPeriodStats.MONTH), {date(2025, 4, 1): (1, 1800, 1, 250)})
+
+    def test_deleting_an_exercise_refreshes_its_periods(self):
+        bench = Exercise.objects.create(name='Bench', user=self.user)
+        session = self.session(datetime(2025, 3, 31, 10))
+        ExercisePerformance.objects.create(workout_session=session, exercise=bench, set_number=1, reps=5, weight=60)
+        rollups.rebuild_periods()
+        self.assertEqual(self.stats(TrainingPeriodStats.MONTH), {date(2025, 3, 1): (1, 3600, 3, 1300)})
+
+        response = self.client.post(reverse('workouts:exercise_delete', args=[self.exercise.pk]))
+        self.assertRedirects(response, reverse('workouts:exercise_list'))
+        # The session stays, with only the other exercise's set
+        self.assertEqual(self.stats(TrainingPeriodStats.WEEK), {date(2025, 3, 31): (1, 3600, 1, 300)})
+        self.assertEqual(self.stats(TrainingPeriodStats.MONTH), {date(2025, 3, 1): (1, 3600, 1, 300)})
+
+    def test_rebuild_since(self):
+        january = self.session(datetime(2025, 1, 6, 10))
+        self.session(datetime(2025, 3, 10, 10))
+        rollups.rebuild_periods()
+        ExercisePerformance.objects.filter(workout_session=january).delete()
+
+        out = StringIO()
+        call_command('rebuild_rollups', since='2025-03-12', stdout=out)
+        self.assertIn('2 weekly/monthly rollup rows', out.getvalue())
+        # January is left alone; March is rebuilt from the start of its week and month
+        self.assertEqual(self.stats(TrainingPeriodStats.WEEK)[date(2025, 1, 6)][2], 2)
+        self.assertEqual(self.stats(TrainingPeriodStats.MONTH)[date(2025, 3, 1)][0], 1)
+
+    def test_frequency_chart(self):
+        self.session(datetime(2025, 1, 6, 10))
+        self.session(datetime(2025, 1, 8, 10))
+        self.session(datetime(2025, 3, 31, 10))
+        rollups.rebuild_periods()
+        # Session, user and one read of the weekly rows
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('workouts:analysis_chart_data', args=['frequency']))
+        self.assertEqual(response.json()['x'], ['2025-W02', '2025-W14'])
+        self.assertEqual(response.json()['y'], [2, 1])
+        response = self.client.get(reverse('workouts:analysis_chart_data', args=['monthly']))
+        self.assertEqual(response.json()['x'], ['2025-01', '2025-03'])
+        self.assertEqual(response.json()['y'], [2000.0, 1000.0])
+
+
+class ExportHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lifter', password='secret')
+        other = User.objects.create_user(username='other', password='secret')
+        cls.workout = Workout.objects.create(name='Legs', user=cls.user)
+        squat = Exercise.objects.create(name='Squat', user=cls.user)
+        for owner in (cls.user, other):
+            session = WorkoutSession.objects.create(user=owner, workout=cls.workout, finished_at=timezone.now())
+            ExercisePerformance.objects.bulk_create([
+                ExercisePerformance(workout_session=session, exercise=squat, set_number=n, reps=5,
+                                    weight='102.50', notes='felt, "heavy"' if n == 1 else '')
+                for n in range(1, 31)
+            ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export(self, fmt):
+        response = self.client.get(reverse('workouts:export_history'), {'format': fmt})
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        rows = list(csv.reader(self.export('csv').splitlines()))
+        self.assertEqual(rows[0], HEADER)
+        self.assertEqual(len(rows), 31)
+        first = dict(zip(HEADER, rows[1]))
+        self.assertEqual((first['workout'], first['exercise'], first['weight']), ('Legs', 'Squat', '102.50'))
+        self.assertEqual(first['notes'], 'felt, "heavy"')
+        self.assertEqual([int(row[HEADER.index('set_number')]) for row in rows[1:]], list(range(1, 31)))
+
+    def test_jsonl(self):
+        lines = [json.loads(line) for line in self.export('jsonl').splitlines()]
+        self.assertEqual(len(lines), 30)
+        self.assertEqual(lines[0]['weight'], 102.5)
+        self.assertIsNone(lines[0]['client_id'])
+
+    def test_reads_in_chunks(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.export('csv')
+        self.assertEqual(sum('workouts_exerciseperformance' in q['sql'] for q in queries), 1)
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse('workouts:export_history'), {'format': 'xlsx'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_history', 'lifter', '--format', 'jsonl', '--chunk-size', '7', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 30)
+
+
+class ImportHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lifter', password='secret')
+        cls.squat = Exercise.objects.create(name='Squat', user=cls.user)
+
+    def rows(self):
+        return [
+            {'workout': 'Legs', 'exercise': 'squat', 'reps': 5, 'weight': 100, 'performed_at': '2024-05-01T18:00:00'},
+            {'workout': 'Legs', 'exercise': 'Squat', 'reps': 5, 'weight': 105, 'performed_at': '2024-05-01T18:04:00'},
+            {'workout': 'Legs', 'exercise': 'Lunge', 'reps': 8, 'weight': 20, 'performed_at': '2024-05-01T18:10:00'},
+            {'workout': 'Legs', 'exercise': 'Squat', 'reps': 5, 'weight': 107.5, 'performed_at': '2024-05-04T18:00:00'},
+        ]
+
+    def run_import(self, rows, chunk_size=importer.DEFAULT_CHUNK_SIZE):
+        stream = StringIO(''.join(json.dumps(row) + '\n' for row in rows))
+        return importer.import_history(self.user, stream, 'jsonl', chunk_size)
+
+    def test_sessions_per_workout_day(self):
+        stats = self.run_import(self.rows())
+        self.assertEqual((stats.created, stats.sessions), (4, 2))
+        # Exercises are matched by name whatever the case
+        self.assertEqual(Exercise.objects.filter(user=self.user).count(), 2)
+        first = WorkoutSession.objects.get(user=self.user, started_at__date=date(2024, 5, 1))
+        self.assertEqual(first.workout.name, 'Legs')
+        self.assertEqual(first.finished_at, timezone.make_aware(datetime(2024, 5, 1, 18, 10)))
+        self.assertEqual(list(first.exerciseperformance_set.filter(exercise=self.squat).values_list('set_number', flat=True)), [1, 2])
+        self.assertTrue(TrainingPeriodStats.objects.filter(user=self.user).exists())
+
+    def test_reimport_and_resume(self):
+        self.run_import(self.rows()[:2], chunk_size=1)
+        stats = self.run_import(self.rows(), chunk_size=2)
+        self.assertEqual((stats.created, stats.skipped, stats.sessions), (2, 2, 1))
+        self.assertEqual(ExercisePerformance.objects.filter(workout_session__user=self.user).count(), 4)
+        session = WorkoutSession.objects.get(user=self.user, started_at__date=date(2024, 5, 1))
+        self.assertEqual(sorted(session.exerciseperformance_set.values_list('set_number', flat=True)), [1, 1, 2])
+
+        stats = self.run_import(self.rows())
+        self.assertEqual((stats.created, stats.skipped), (0, 4))
+
+    def test_live_sessions_are_left_alone(self):
+        # A session logged in the app on the same workout and day as imported rows
+        legs = Workout.objects.create(name='Legs', user=self.user)
+        WorkoutExercise.objects.create(workout=legs, exercise=self.squat, order=1, suggested_sets=3, suggested_reps=5)
+        live = WorkoutSession.objects.create(user=self.user, workout=legs)
+        WorkoutSession.objects.filter(pk=live.pk).update(started_at=timezone.make_aware(datetime(2024, 5, 1, 7, 0)))
+        self.client.force_login(self.user)
+        url = reverse('workouts:session_detail', args=[live.pk])
+        self.client.post(url, {'exercise': self.squat.pk, 'reps': 5, 'weight': 90})
+
+        stats = self.run_import(self.rows())
+        self.assertEqual(stats.sessions, 2)
+        self.assertEqual(live.exerciseperformance_set.count(), 1)
+        live.refresh_from_db()
+        self.assertIsNone(live.finished_at)
+
+        # The app keeps numbering the live session's sets
+        self.client.post(url, {'exercise': self.squat.pk, 'reps': 5, 'weight': 95})
+        self.assertEqual(list(live.exerciseperformance_set.values_list('set_number', flat=True)), [1, 2])
+
+    def test_resumed_sessions_number_after_logged_sets(self):
+        self.run_import(self.rows()[:1])
+        session = WorkoutSession.objects.get(user=self.user)
+        SetCounter.allocate(session.pk, self.squat.pk)
+        ExercisePerformance.objects.create(
+            workout_session=session, exercise=self.squat, set_number=2, reps=3, weight=110,
+            performed_at=timezone.make_aware(datetime(2024, 5, 1, 18, 2)),
+        )
+        self.run_import(self.rows()[:2])
+        self.assertEqual(sorted(session.exerciseperformance_set.values_list('set_number', flat=True)), [1, 2, 3])
+
+    def test_invalid_rows_are_reported(self):
+        rows = self.rows()
+        rows[1]['weight'] = 'heavy'
+        del rows[2]['performed_at']
+        stats = self.run_import(rows)
+        self.assertEqual((stats.created, stats.error_count), (2, 2))
+        self.assertIn('line 2: invalid weight', stats.errors[0])
+
+    def test_round_trip_from_export(self):
+        self.run_import(self.rows())
+        self.client.force_login(self.user)
+        exported = b''.join(self.client.get(reverse('workouts:export_history')).streaming_content)
+
+        other = User.objects.create_user(username='other', password='secret')
+        self.client.force_login(other)
+        upload = SimpleUploadedFile('history.csv', exported, content_type='text/csv')
+        with override_settings(JOB_FILES_DIR=tempfile.mkdtemp()):
+            response = self.client.post(reverse('workouts:import_history'), {'file': upload})
+            job = Job.objects.get(kind='import_history')
+            self.assertRedirects(response, reverse('workouts:job_detail', args=[job.pk]))
+            jobs.run_pending()
+        self.assertContains(self.client.get(reverse('workouts:job_detail', args=[job.pk])), 'Imported 4 sets')
+        self.assertEqual(ExercisePerformance.objects.filter(workout_session__user=other).count(), 4)
+        self.assertEqual(
+            list(WorkoutSession.objects.filter(user=other).order_by('started_at').values_list('started_at', 'finished_at')),
+            list(WorkoutSession.objects.filter(user=self.user).order_by('started_at').values_list('started_at', 'finished_at')),
+        )
+
+    def test_reimporting_an_export_adds_nothing(self):
+        self.run_import(self.rows())
+        # Sets logged in the app, one synced with a client id, in a live session
+        live = WorkoutSession.objects.create(user=self.user, workout=Workout.objects.get(name='Legs'))
+        ExercisePerformance.objects.create(workout_session=live, exercise=self.squat, set_number=1, reps=5, weight=90)
+        ExercisePerformance.objects.create(workout_session=live, exercise=self.squat, set_number=2, reps=5, weight=95,
+                                           client_id=uuid.uuid4())
+        self.client.force_login(self.user)
+        exported = b''.join(self.client.get(reverse('workouts:export_history')).streaming_content).decode()
+
+        stats = importer.import_history(self.user, StringIO(exported), 'csv')
+        self.assertEqual((stats.created, stats.skipped, stats.sessions), (0, 6, 0))
+        self.assertEqual(ExercisePerformance.objects.filter(workout_session__user=self.user).count(), 6)
+        live.refresh_from_db()
+        self.assertIsNone(live.finished_at)
+
+    def test_set_ids_from_other_trackers_are_not_matched(self):
+        self.run_import(self.rows()[:1])
+        row = {**self.rows()[1], 'set_id': ExercisePerformance.objects.get().pk}
+        self.assertEqual(self.run_import([row]).created, 1)
+
+    def test_command(self):
+        path = os.path.join(tempfile.gettempdir(), f'import-{uuid.uuid4()}.jsonl')
+        self.addCleanup(os.remove, path)
+        with open(path, 'w') as f:
+            f.writelines(json.dumps(row) + '\n' for row in self.rows())
+        out = StringIO()
+        call_command('import_history', 'lifter', path, '--chunk-size', '3', stdout=out)
+        self.assertIn('3 rows read', out.getvalue())
+        self.assertIn('Imported 4 sets into 2 new sessions', out.getvalue())
+
+
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+
+class SnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lifter', password='secret')
+        cls.other = User.objects.create_user(username='other', password='secret')
+        cls.workout = Workout.objects.create(name='Legs', user=cls.user)
+        cls.squat = Exercise.objects.create(name='Squat', user=cls.user)
+        WorkoutExercise.objects.create(workout=cls.workout, exercise=cls.squat, suggested_sets=3, suggested_reps=5, order=1)
+        for owner in (cls.user, cls.other):
+            cls.log_session(owner, weight=100)
+        # Still in progress, so left out until it finishes
+        cls.open_session = cls.log_session(cls.user, weight=110, finished=False)
+
+    @classmethod
+    def log_session(cls, owner, weight, finished=True):
+        session = WorkoutSession.objects.create(
+            user=owner, workout=cls.workout, finished_at=timezone.now() if finished else None
+        )
+        ExercisePerformance.objects.bulk_create([
+            ExercisePerformance(workout_session=session, exercise=cls.squat, set_number=n, reps=5, weight=weight)
+            for n in (1, 2)
+        ])
+        return session
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    @skipUnless(HAS_PYARROW, "pyarrow isn't installed")
+    def test_incremental_export(self):
+        counts = snapshots.write_snapshot(self.root)
+        self.assertEqual(counts, {'performances': 4, 'sessions': 2, 'workout_exercises': 1})
+
+        self.open_session.finished_at = timezone.now()
+        self.open_session.save()
+        counts = snapshots.write_snapshot(self.root)
+        self.assertEqual(counts, {'performances': 2, 'sessions': 1, 'workout_exercises': 1})
+        self.assertEqual(len(engine.load_snapshot(self.root, 'performances')), 6)
+        self.assertEqual(len(engine.load_snapshot(self.root, 'workout_exercises')), 1)
+
+        with self.assertRaises(snapshots.SnapshotError):
+            snapshots.write_snapshot(self.root, fmt='parquet')
+
+    @skipUnless(HAS_PYARROW, "pyarrow isn't installed")
+    def test_incremental_export_with_nothing_new(self):
+        def parts(table):
+            return sorted(os.listdir(os.path.join(self.root, table)))
+
+        snapshots.write_snapshot(self.root)
+        watermark = snapshots.read_watermark(self.root)
+        performances, sessions = parts('performances'), parts('sessions')
+
+        counts = snapshots.write_snapshot(self.root)
+        self.assertEqual(counts, {'performances': 0, 'sessions': 0, 'workout_exercises': 1})
+        self.assertEqual((parts('performances'), parts('sessions')), (performances, sessions))
+        self.assertEqual(snapshots.read_watermark(self.root), watermark)
+        self.assertEqual(len(engine.load_snapshot(self.root, 'performances')), 4)
+
+    @skipUnless(HAS_PYARROW, "pyarrow isn't installed")
+    def test_partitioned_parquet_feeds_the_engine(self):
+        call_command('snapshot_history', '--output', self.root, '--format', 'parquet', '--partition', 'user',
+                     stdout=StringIO())
+        self.assertTrue(os.path.isdir(os.path.join(self.root, 'performances', f'user_id={self.user.pk}')))
+
+        frame = engine.load_snapshot(self.root, 'performances', user_id=self.user.pk,
+                                     columns=['exercise__name', 'weight', 'reps', 'workout_session__started_at'])
+        rows = ExercisePerformance.objects.filter(
+            workout_session__user=self.user, workout_session__finished_at__isnull=False,
+        ).values('exercise__name', 'weight', 'reps', 'workout_session__started_at')
+        self.assertEqual(
+            engine.summarize_sets(frame, 'workout_session__started_at')['Squat']['stats'],
+            engine.summarize_sets(rows, 'workout_session__started_at')['Squat']['stats'],
+        )
+
+    @skipUnless(HAS_PYARROW, "pyarrow isn't installed")
+    def test_sessions_finished_in_the_past_are_exported(self):
+        snapshots.write_snapshot(self.root)
+        # An imported session, finished long before the last export
+        imported = self.log_session(self.user, weight=90)
+        WorkoutSession.objects.filter(pk=imported.pk).update(finished_at=timezone.now() - timedelta(days=365))
+        counts = snapshots.write_snapshot(self.root)
+        self.assertEqual((counts['performances'], counts['sessions']), (2, 1))
+        self.assertEqual(snapshots.write_snapshot(self.root)['sessions'], 0)
+        frame = engine.load_snapshot(self.root, 'sessions', columns=['id'])
+        self.assertEqual(sorted(frame['id']), sorted(WorkoutSession.objects.filter(
+            finished_at__isnull=False).values_list('pk', flat=True)))
+
+    @skipUnless(HAS_PYARROW, "pyarrow isn't installed")
+    def test_user_filter_must_match(self):
+        snapshots.write_snapshot(self.root, user=self.user)
+        for user in (None, self.other):
+            with self.assertRaisesMessage(snapshots.SnapshotError, f'user {self.user.pk}'):
+                snapshots.write_snapshot(self.root, user=user)
+        self.assertEqual(snapshots.write_snapshot(self.root, user=self.other, full=True)['sessions'], 1)
+
+    @skipUnless(HAS_PYARROW, "pyarrow isn't installed")
+    def test_single_user_rows(self):
+        snapshots.write_snapshot(self.root)
+        frame = engine.load_snapshot(self.root, 'sessions', user_id=self.other.pk, columns=['id'])
+        self.assertEqual(list(frame['id']), list(WorkoutSession.objects.filter(user=self.other).values_list('pk', flat=True)))
+
+    @skipIf(HAS_PYARROW, "pyarrow is installed")
+    def test_command_without_pyarrow(self):
+        with self.assertRaisesMessage(CommandError, 'pyarrow'):
+            call_command('snapshot_history', '--output', self.root)
+
+
+
+@override_settings(JOB_RETRY_WAIT=0)
+class JobQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lifter', password='secret')
+        workout = Workout.objects.create(name='Legs', user=cls.user)
+        squat = Exercise.objects.create(name='Squat', user=cls.user)
+        cls.session = WorkoutSession.objects.create(user=cls.user, workout=workout)
+        ExercisePerformance.objects.create(
+            workout_session=cls.session, exercise=squat, set_number=1, reps=5, weight=100
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        files = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, files)
+        override = override_settings(JOB_FILES_DIR=files)
+        override.enable()
+        self.addCleanup(override.disable)
+        # Pre-rendered charts would otherwise be served to later tests' users
+        self.addCleanup(caches['charts'].clear)
+
+    def finish(self):
+        self.client.post(reverse('workouts:session_detail', args=[self.session.pk]), {'finish_workout': 1})
+
+    @override_settings(JOBS_RUN_INLINE=False)
+    def test_finishing_a_session_refreshes_the_rollups_in_the_request(self):
+        self.finish()
+        # With no worker running, the charts are still right
+        self.assertTrue(ExerciseDailyStats.objects.filter(user=self.user).exists())
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(
+            list(Job.objects.values_list('kind', 'status', 'attempts')), [('prerender_charts', Job.DONE, 1)],
+        )
+
+    @override_settings(JOBS_RUN_INLINE=True)
+    def test_inline(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.finish()
+        self.assertTrue(ExerciseDailyStats.objects.filter(user=self.user).exists())
+        self.assertFalse(Job.objects.exclude(status=Job.DONE).exists())
+        self.assertEqual(jobs.run_pending(), 0)
+
+    @override_settings(JOBS_RUN_INLINE=True)
+    def test_finishing_a_session_prerenders_the_analysis_pages(self):
+        WorkoutExercise.objects.create(
+            workout=self.session.workout, exercise=Exercise.objects.get(), suggested_sets=3, suggested_reps=5, order=1
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.finish()
+        self.assertEqual(Job.objects.get(kind='prerender_charts').result['charts'], [
+            'prs', 'frequency', 'monthly', 'completion', 'rest', 'weight', 'volume', 'workout_stats',
+            'session_weight',
+        ])
+
+        # Session and user only: the personal records are already rendered
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('workouts:analysis'))
+        squat = Exercise.objects.get()
+        self.assertEqual(response.context['personal_records'][squat.pk]['max_weight'], 100)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('workouts:workout_analysis', args=[self.session.workout_id]))
+        self.assertEqual(response.context['exercise_stats'][squat.pk]['stats']['total_sets'], 1)
+        for url, queries in (
+            (reverse('workouts:analysis_chart_data', args=['volume']) + f'?exercise={squat.pk}', 2),
+            (reverse('workouts:analysis_chart_data', args=['rest']), 2),
+            # Plus the workout, for the access check
+            (reverse('workouts:workout_chart_data', args=[self.session.workout_id, 'session_weight'])
+             + f'?exercise={squat.pk}', 3),
+        ):
+            with self.subTest(url=url), self.assertNumQueries(queries):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_workers_need_a_shared_chart_cache(self):
+        with self.assertRaisesMessage(CommandError, 'CHART_CACHE_BACKEND'):
+            call_command('run_workers', '--once', stdout=StringIO())
+
+    def test_transient_errors_are_retried(self):
+        calls = []
+
+        def flaky(job):
+            calls.append(job.pk)
+            if len(calls) < 3:
+                raise OperationalError("server closed the connection unexpectedly")
+            return {'ok': True}
+
+        def broken(job):
+            calls.append(job.pk)
+            raise ValueError("bad payload")
+
+        with mock.patch.dict(jobs.HANDLERS, {'flaky': flaky, 'broken': broken}), self.assertLogs('workouts.jobs'):
+            flaky_job = jobs.enqueue('flaky')
+            broken_job = jobs.enqueue('broken')
+            jobs.run_pending()
+        flaky_job.refresh_from_db()
+        broken_job.refresh_from_db()
+        self.assertEqual((flaky_job.status, flaky_job.result), (Job.DONE, {'ok': True}))
+        # Only database errors are retried
+        self.assertEqual((broken_job.status, broken_job.error), (Job.FAILED, 'bad payload'))
+        self.assertEqual(calls.count(broken_job.pk), 1)
+
+    @override_settings(JOB_MAX_ATTEMPTS=2)
+    def test_stale_jobs_are_reclaimed(self):
+        first = jobs.enqueue('prerender_charts', user=self.user)
+        second = jobs.enqueue('prerender_charts', user=self.user)
+        self.assertEqual(jobs.claim_next('a').pk, first.pk)
+        self.assertEqual(jobs.claim_next('b').pk, second.pk)
+        self.assertIsNone(jobs.claim_next('c'))
+
+        long_ago = timezone.now() - timedelta(hours=1)
+        Job.objects.filter(pk=first.pk).update(locked_at=long_ago)
+        with self.assertLogs('workouts.jobs', 'WARNING'):
+            self.assertEqual(jobs.reclaim_stale(), 1)
+        self.assertEqual(jobs.claim_next('c').attempts, 2)
+        Job.objects.filter(pk=first.pk).update(locked_at=long_ago)
+        with self.assertLogs('workouts.jobs', 'WARNING'):
+            self.assertEqual(jobs.reclaim_stale(), 0)
+        self.assertEqual(Job.objects.get(pk=first.pk).status, Job.FAILED)
+
+    def test_background_export(self):
+        response = self.client.post(reverse('workouts:queue_export'), {'format': 'jsonl'})
+        job = Job.objects.get(kind='export_history')
+        self.assertRedirects(response, reverse('workouts:job_detail', args=[job.pk]))
+        self.assertContains(self.client.get(response.url, HTTP_HX_REQUEST='true'), 'hx-trigger="every 2s"')
+
+        out = StringIO()
+        charts = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, charts)
+        shared = {**settings.CACHES, 'charts': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': charts,
+        }}
+        with override_settings(CACHES=shared):
+            call_command('run_workers', '--once', stdout=out)
+        self.assertIn('Ran 1 jobs', out.getvalue())
+        status = self.client.get(response.url, HTTP_HX_REQUEST='true')
+        self.assertNotContains(status, 'hx-trigger')
+        self.assertContains(status, 'export of 1 sets')
+        download = self.client.get(reverse('workouts:job_download', args=[job.pk]))
+        self.assertEqual(json.loads(b''.join(download.streaming_content))['weight'], 100.0)
+
+        other = User.objects.create_user(username='other', password='secret')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('workouts:job_download', args=[job.pk])).status_code, 404)
+
+
+class InlineJobTests(TransactionTestCase):
+    @override_settings(JOBS_RUN_INLINE=True, JOBS_INLINE_THREADS=1)
+    def test_inline_jobs_run_after_the_queuing_request(self):
+        user = User.objects.create_user(username='lifter', password='secret')
+        release = threading.Event()
+        threads = []
+
+        def probe(job):
+            threads.append(threading.current_thread().name)
+            release.wait(5)
+            return {}
+
+        with mock.patch.dict(jobs.HANDLERS, {'probe': probe}):
+            # Committed straight away, and handed to a job thread
+            job = jobs.enqueue('probe', user=user)
+            self.assertNotEqual(Job.objects.get(pk=job.pk).status, Job.DONE)
+            release.set()
+            deadline = time.monotonic() + 5
+            while Job.objects.get(pk=job.pk).status != Job.DONE and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.DONE)
+        self.assertTrue(threads[0].startswith('jobs'))
+
+
+class PersonalRecordTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lifter', password='secret')
+        cls.workout = Workout.objects.create(name='Workout', user=cls.user)
+        cls.squat = Exercise.objects.create(name='Squat', user=cls.user)
+        WorkoutExercise.objects.create(
+            workout=cls.workout, exercise=cls.squat, suggested_sets=3, suggested_reps=5, order=1
+        )
+        cls.session = WorkoutSession.objects.create(user=cls.user, workout=cls.workout)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.addCleanup(caches['charts'].clear)
+
+    def log_set(self, reps, weight, session=None):
+        return self.client.post(
+            reverse('workouts:session_detail', args=[(session or self.session).pk]),
+            {'exercise': self.squat.pk, 'reps': reps, 'weight': weight}, HTTP_HX_REQUEST='true'
+        )
+
+    def finish(self, session=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('workouts:session_detail', args=[(session or self.session).pk]), {'finish_workout': '1'}
+            )
+
+    def record(self):
+        return PersonalRecord.objects.values(
+            'max_weight', 'max_reps', 'max_set_volume', 'estimated_1rm', 'total_volume', 'set_count'
+        ).get(user=self.user, exercise=self.squat)
+
+    def assertMatchesRebuild(self):
+        ledger = self.record()
+        records.rebuild(user=self.user)
+        self.assertEqual(ledger, self.record())
+
+    def test_records_are_flagged_as_sets_are_logged(self):
+        # The first set has nothing to beat
+        self.assertNotContains(self.log_set(5, '100'), 'New PR!')
+        self.assertNotContains(self.log_set(5, '90'), 'New PR!')
+        self.assertContains(self.log_set(3, '110'), 'New PR!')
+
+        response = self.client.post(
+            reverse('workouts:batch_log_sets', args=[self.session.pk]),
+            json.dumps([{'exercise': self.squat.pk, 'reps': 12, 'weight': 60},
+                        {'exercise': self.squat.pk, 'reps': 1, 'weight': 120}]),
+            content_type='application/json',
+        )
+        self.assertEqual([s['new_records'] for s in response.json()['sets']], [
+            ['max_reps', 'max_set_volume'], ['max_weight'],
+        ])
+        # The session is still open
+        self.assertFalse(PersonalRecord.objects.exists())
+
+        self.finish()
+        self.assertEqual(self.record(), {
+            'max_weight': Decimal('120'), 'max_reps': 12, 'max_set_volume': Decimal('720'),
+            'estimated_1rm': Decimal('121'), 'total_volume': Decimal('2120'), 'set_count': 5,
+        })
+        self.assertMatchesRebuild()
+
+        # The next session is compared against the ledger
+        session = WorkoutSession.objects.create(user=self.user, workout=self.workout)
+        self.assertNotContains(self.log_set(5, '100', session), 'New PR!')
+        self.assertContains(self.log_set(1, '125', session), 'New PR!')
+        self.finish(session)
+        self.assertEqual(self.record()['max_weight'], 125)
+        self.assertMatchesRebuild()
+
+    def test_deleting_sets_from_an_open_session(self):
+        for reps, weight in ((5, '100'), (3, '110')):
+            self.log_set(reps, weight)
+        heaviest = self.session.exerciseperformance_set.get(weight=110)
+        self.client.post(reverse('workouts:delete_performance', args=[self.session.pk, heaviest.pk]))
+
+        # The deleted set is no longer there to beat
+        self.assertContains(self.log_set(3, '105'), 'New PR!')
+        self.finish()
+        self.assertEqual(self.record()['max_weight'], 105)
+        self.assertEqual(self.record()['set_count'], 2)
+        self.assertMatchesRebuild()
+
+    def test_abandoned_sessions_set_no_records(self):
+        self.log_set(5, '100')
+        self.finish()
+        session = WorkoutSession.objects.create(user=self.user, workout=self.workout)
+        self.log_set(5, '150', session)
+
+        response = self.client.get(reverse('workouts:analysis'))
+        self.assertEqual(response.context['personal_records'][self.squat.pk]['max_weight'], 100)
+        self.assertEqual(self.record()['set_count'], 1)
+        self.assertMatchesRebuild()
+
+    def test_deleting_a_workout(self):
+        self.log_set(5, '100')
+        self.finish()
+        other = Workout.objects.create(name='Other', user=self.user)
+        WorkoutExercise.objects.create(workout=other, exercise=self.squat, suggested_sets=3, suggested_reps=5, order=1)
+        session = WorkoutSession.objects.create(user=self.user, workout=other)
+        self.log_set(5, '120', session)
+        self.finish(session)
+        self.assertEqual(self.record()['max_weight'], 120)
+
+        self.client.post(reverse('workouts:workout_delete', args=[other.pk]))
+        self.assertEqual(self.record()['max_weight'], 100)
+        self.assertMatchesRebuild()
+
+        self.client.post(reverse('workouts:workout_delete', args=[self.workout.pk]))
+        self.assertFalse(PersonalRecord.objects.exists())
+
+    def test_estimated_1rm(self):
+        for reps, weight, expected in ((0, 80, 0), (1, 140, 140), (5, 100, Decimal('116.67')), (10, 60, 80)):
+            with self.subTest(reps=reps):
+                self.assertEqual(records.estimated_1rm(Decimal(weight), reps), expected)
+
+    def test_analysis_reads_the_ledger(self):
+        self.log_set(5, '100')
+        self.finish()
+        # Finishing prerendered the page
+        caches['charts'].clear()
+        # Session, user and the records
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('workouts:analysis'))
+        self.assertEqual(response.context['personal_records'][self.squat.pk]['estimated_1rm'], Decimal('116.67'))
+
+
+class SetNumberingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lifter', password='secret')
+        cls.workout = Workout.objects.create(name='Workout', user=cls.user)
+        cls.squat, cls.bench = Exercise.objects.bulk_create([
+            Exercise(name='Squat', user=cls.user), Exercise(name='Bench', user=cls.user),
+        ])
+        WorkoutExercise.objects.bulk_create([
+            WorkoutExercise(workout=cls.workout, exercise=exercise, suggested_sets=3, suggested_reps=5, order=i)
+            for i, exercise in enumerate([cls.squat, cls.bench])
+        ])
+        cls.session = WorkoutSession.objects.create(user=cls.user, workout=cls.workout)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def log_set(self, exercise):
+        return self.client.post(
+            reverse('workouts:session_detail', args=[self.session.pk]),
+            {'exercise': exercise.pk, 'reps': 5, 'weight': '100'}
+        )
+
+    def set_numbers(self, exercise):
+        return list(self.session.exerciseperformance_set.filter(exercise=exercise).values_list('set_number', flat=True))
+
+    def test_sets_are_numbered_per_exercise(self):
+        for exercise in (self.squat, self.squat, self.bench, self.squat):
+            self.assertEqual(self.log_set(exercise).status_code, 302)
+        self.assertEqual(self.set_numbers(self.squat), [1, 2, 3])
+        self.assertEqual(self.set_numbers(self.bench), [1])
+
+    def test_counter_starts_after_existing_sets(self):
+        ExercisePerformance.objects.bulk_create([
+            ExercisePerformance(workout_session=self.session, exercise=self.squat, set_number=n, reps=5, weight=100)
+            for n in (1, 2)
+        ])
+        self.log_set(self.squat)
+        self.assertEqual(self.set_numbers(self.squat), [1, 2, 3])
+
+    def test_batch_form_post(self):
+        self.log_set(self.squat)
+        data = {'sets-TOTAL_FORMS': 4, 'sets-INITIAL_FORMS': 0}
+        for i, exercise in enumerate([self.squat, self.bench, self.squat]):
+            data.update({f'sets-{i}-exercise': exercise.pk, f'sets-{i}-reps': 5, f'sets-{i}-weight': '100'})
+        url = reverse('workouts:batch_log_sets', args=[self.session.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data, HTTP_HX_REQUEST='true')
+        inserts = [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "workouts_exerciseperformance"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(response['HX-Reswap'], 'beforeend')
+        self.assertTemplateUsed(response, 'workouts/partials/performance_rows.html')
+        self.assertContains(response, '<tr>', count=3)
+        self.assertEqual(self.set_numbers(self.squat), [1, 2, 3])
+        self.assertEqual(self.set_numbers(self.bench), [1])
+        # Only the block is flagged as logged after the fact
+        self.assertEqual(
+            list(self.session.exerciseperformance_set.order_by('pk').values_list('batch_logged', flat=True)),
+            [False, True, True, True],
+        )
+
+    def test_htmx_record_set_returns_fragments(self):
+        self.log_set(self.squat)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('workouts:session_detail', args=[self.session.pk]),
+                {'exercise': self.squat.pk, 'reps': 5, 'weight': '100'}, HTTP_HX_REQUEST='true'
+            )
+        inserts = [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "workouts_exerciseperformance"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(response['HX-Retarget'], '#performance-rows')
+        self.assertTemplateNotUsed(response, 'workouts/session_detail.html')
+        self.assertContains(response, '<tr>', count=1)
+        self.assertContains(response, f'id="progress-{self.squat.pk}"')
+        self.assertContains(response, '2 / 3 sets')
+        self.assertNotContains(response, f'id="progress-{self.bench.pk}"')
+
+    def test_htmx_invalid_set_returns_form(self):
+        response = self.client.post(
+            reverse('workouts:session_detail', args=[self.session.pk]),
+            {'exercise': self.squat.pk, 'reps': 5}, HTTP_HX_REQUEST='true'
+        )
+        self.assertTemplateUsed(response, 'workouts/partials/performance_form.html')
+        self.assertTemplateNotUsed(response, 'workouts/session_detail.html')
+        self.assertContains(response, 'invalid-feedback')
+
+    def test_htmx_delete_set(self):
+        self.log_set(self.squat)
+        performance = self.session.exerciseperformance_set.get()
+        response = self.client.post(
+            reverse('workouts:delete_performance', args=[self.session.pk, performance.pk]), HTTP_HX_REQUEST='true'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'hx-swap-oob="true"', count=1)
+        self.assertContains(response, '0 / 3 sets')
+        self.assertFalse(self.session.exerciseperformance_set.exists())
+
+    def test_htmx_finished_session_redirects(self):
+        self.session.finished_at = timezone.now()
+        self.session.save()
+        response = self.client.post(
+            reverse('workouts:session_detail', args=[self.session.pk]),
+            {'exercise': self.squat.pk, 'reps': 5, 'weight': '100'}, HTTP_HX_REQUEST='true'
+        )
+        self.assertEqual(response['HX-Redirect'], reverse('workouts:session_detail', args=[self.session.pk]))
+
+    def test_batch_json_is_validated_together(self):
+        url = reverse('workouts:batch_log_sets', args=[self.session.pk])
+        sets = [{'exercise': self.squat.pk, 'reps': 5, 'weight': 100}, {'exercise': self.squat.pk, 'reps': 0}]
+        response = self.client.post(url, json.dumps(sets), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('weight', response.json()['errors'][1])
+        self.assertFalse(self.session.exerciseperformance_set.exists())
+
+        sets[1]['weight'] = 102.5
+        response = self.client.post(url, json.dumps({'sets': sets}), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([s['set_number'] for s in response.json()['sets']], [1, 2])
+
+    def test_batch_rejects_finished_session(self):
+        self.session.finished_at = timezone.now()
+        self.session.save()
+        url = reverse('workouts:batch_log_sets', args=[self.session.pk])
+        response = self.client.post(url, json.dumps([]), content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+
+    def sync(self, events, cursor=0):
+        return self.client.post(
+            reverse('workouts:session_sync', args=[self.session.pk]),
+            json.dumps({'cursor': cursor, 'events': events}), content_type='application/json'
+        )
+
+    def test_sync_is_idempotent(self):
+        started = self.session.started_at = timezone.now() - timedelta(hours=1)
+        self.session.save()
+        events = [
+            {'id': str(uuid.uuid4()), 'type': 'add', 'exercise': self.squat.pk, 'reps': 5, 'weight': 100,
+             'at': (started + timedelta(minutes=minutes)).isoformat()}
+            for minutes in (3, 1, 2)
+        ]
+        first = self.sync(events).json()
+        self.assertEqual([r['status'] for r in first['results']], ['applied'] * 3)
+        # Numbered in the order the device logged them, stamped with its times
+        self.assertEqual([r['set_number'] for r in first['results']], [3, 1, 2])
+        self.assertEqual(
+            ExercisePerformance.objects.get(pk=first['results'][1]['set']).performed_at,
+            started + timedelta(minutes=1)
+        )
+        self.assertEqual(len(first['sets']), 3)
+
+        again = self.sync(events + [{'id': str(uuid.uuid4()), 'type': 'add', 'exercise': self.squat.pk}],
+                          cursor=first['cursor']).json()
+        self.assertEqual([r['status'] for r in again['results']], ['duplicate'] * 3 + ['rejected'])
+        self.assertIn('reps', again['results'][3]['errors'])
+        self.assertEqual(again['sets'], [])
+        self.assertEqual(self.set_numbers(self.squat), [1, 2, 3])
+
+    def test_synced_sets_count_towards_rest_times(self):
+        started = self.session.started_at = timezone.now() - timedelta(hours=1)
+        self.session.save()
+        events = [
+            {'id': str(uuid.uuid4()), 'type': 'add', 'exercise': self.squat.pk, 'reps': 5, 'weight': 100,
+             'at': (started + timedelta(minutes=2 * n)).isoformat()}
+            for n in range(5)
+        ]
+        self.sync(events)
+        self.assertFalse(self.session.exerciseperformance_set.filter(batch_logged=True).exists())
+
+        self.session.finished_at = timezone.now()
+        self.session.save()
+        rollups.refresh_session(self.session)
+        # Summed over the days, in case the sets straddle midnight
+        rows = ExerciseDailyStats.objects.filter(user=self.user, exercise=self.squat)
+        intervals = sum(row.rest_intervals for row in rows)
+        self.assertEqual(intervals, 4 - (len(rows) - 1))
+        self.assertEqual(sum(row.rest_seconds for row in rows), 120 * intervals)
+
+    def test_sync_rejects_impossible_times(self):
+        events = [
+            {'id': str(uuid.uuid4()), 'type': 'add', 'exercise': self.squat.pk, 'reps': 5, 'weight': 100, 'at': at}
+            for at in ('2024-02-30T10:00:00', '2024-02-29T10:00:00')
+        ]
+        response = self.sync(events)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], ['rejected', 'applied'])
+        self.assertIn('at', results[0]['errors'])
+        self.assertEqual(self.set_numbers(self.squat), [1])
+
+    def test_sync_delete(self):
+        add = {'id': str(uuid.uuid4()), 'type': 'add', 'exercise': self.bench.pk, 'reps': 5, 'weight': 60}
+        self.log_set(self.bench)
+        online = self.session.exerciseperformance_set.get()
+        delete_synced = {'id': str(uuid.uuid4()), 'type': 'delete', 'set': add['id']}
+        delete_online = {'id': str(uuid.uuid4()), 'type': 'delete', 'set': online.pk}
+        response = self.sync([add, delete_synced, delete_online, delete_synced]).json()
+        self.assertEqual([r['status'] for r in response['results']], ['applied', 'applied', 'applied', 'applied'])
+        self.assertEqual(response['set_ids'], [])
+        self.assertFalse(self.session.exerciseperformance_set.exists())
+
+    def test_sync_respects_finished_session(self):
+        self.session.finished_at = timezone.now()
+        self.session.save()
+        response = self.sync([{'id': str(uuid.uuid4()), 'type': 'add', 'exercise': self.squat.pk, 'reps': 5, 'weight': 100}])
+        self.assertEqual(response.json()['results'][0]['status'], 'rejected')
+        self.assertIsNotNone(response.json()['finished_at'])
+        self.assertFalse(self.session.exerciseperformance_set.exists())
+
+    def test_allocate_block(self):
+        self.assertEqual(SetCounter.allocate(self.session.pk, self.squat.pk, count=3), 1)
+        self.assertEqual(SetCounter.allocate(self.session.pk, self.squat.pk), 4)
+
+    def test_allocate_without_update_returning(self):
+        # MariaDB reports INSERT ... RETURNING but can't UPDATE ... RETURNING
+        with mock.patch.object(connection, 'vendor', 'mysql'), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(SetCounter.allocate(self.session.pk, self.squat.pk, count=2), 1)
+            self.assertEqual(SetCounter.allocate(self.session.pk, self.squat.pk), 3)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertTrue(updates)
+        self.assertFalse(any('RETURNING' in sql for sql in updates))
+
+
+@skipIf(connection.vendor == 'sqlite',
+        "needs concurrent writers: run the suite against PostgreSQL, the default DATABASE_URL")
+class ConcurrentSetNumberingTests(TransactionTestCase):
+    """
+    Parallel set logging from several devices never duplicates a set number.
+
+    SQLite's in-memory test database can't take concurrent writers, so this
+    only runs against a server database, such as the default PostgreSQL one.
+    """
+
+    threads = 8
+    sets_per_thread = 25
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='lifter', password='secret')
+        workout = Workout.objects.create(name='Workout', user=self.user)
+        self.exercise = Exercise.objects.create(name='Squat', user=self.user)
+        WorkoutExercise.objects.create(workout=workout, exercise=self.exercise, suggested_sets=3, suggested_reps=5, order=1)
+        self.session = WorkoutSession.objects.create(user=self.user, workout=workout)
+
+    def test_parallel_posts(self):
+        url = reverse('workouts:session_detail', args=[self.session.pk])
+        start = threading.Barrier(self.threads)
+        statuses = []
+
+        def device():
+            client = Client()
+            client.force_login(self.user)
+            start.wait()
+            try:
+                for _ in range(self.sets_per_thread):
+                    statuses.append(client.post(url, {'exercise': self.exercise.pk, 'reps': 5, 'weight': '100'}).status_code)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=device) for _ in range(self.threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        total = self.threads * self.sets_per_thread
+        self.assertEqual(statuses, [302] * total)
+        numbers = sorted(ExercisePerformance.objects.filter(workout_session=self.session).values_list('set_number', flat=True))
+        self.assertEqual(numbers, list(range(1, total + 1)))
+        # Requests queue on the counter row only for the length of one insert
+        self.assertLess(elapsed, total * 0.1)
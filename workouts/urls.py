@@ -1,6 +1,6 @@
 from django.urls import path
 from . import views
-from .analysis import workout_analysis
+from . import analysis
 
 app_name = 'workouts'
 
@@ -15,16 +15,26 @@ urlpatterns = [
     path('workouts/<int:pk>/', views.WorkoutDetailView.as_view(), name='workout_detail'),
     path('workouts/<int:pk>/edit/', views.WorkoutUpdateView.as_view(), name='workout_edit'),
     path('workouts/<int:pk>/delete/', views.WorkoutDeleteView.as_view(), name='workout_delete'),
-    path('workouts/<int:pk>/analysis/', views.workout_specific_analysis, name='workout_analysis'),
+    path('workouts/<int:pk>/analysis/', analysis.workout_specific_analysis, name='workout_analysis'),
+    path('workouts/<int:pk>/analysis/data/<str:kind>/', analysis.workout_chart_data, name='workout_chart_data'),
     path('workouts/add-exercise-form/', views.add_exercise_form, name='add_exercise_form'),
     path('sessions/', views.WorkoutSessionListView.as_view(), name='session_list'),
     path('sessions/start/', views.start_workout_session, name='start_session'),
     path('sessions/<int:pk>/', views.WorkoutSessionDetailView.as_view(), name='session_detail'),
+    path('sessions/<int:pk>/sets/batch/', views.BatchLogSetsView.as_view(), name='batch_log_sets'),
+    path('sessions/<int:pk>/sync/', views.SessionSyncView.as_view(), name='session_sync'),
     path('sessions/<int:session_pk>/performance/<int:performance_pk>/delete/',
          views.DeletePerformanceView.as_view(), name='delete_performance'),
+    path('sessions/export/', views.export_history, name='export_history'),
+    path('sessions/import/', views.import_history, name='import_history'),
+    path('sessions/export/queue/', views.queue_export, name='queue_export'),
+    path('jobs/<int:pk>/', views.job_detail, name='job_detail'),
+    path('jobs/<int:pk>/download/', views.job_download, name='job_download'),
     
     # Analysis URL
-    path('analysis/', workout_analysis, name='analysis'),
+    path('analysis/', analysis.workout_analysis, name='analysis'),
+    path('analysis/data/<str:kind>/', analysis.analysis_chart_data, name='analysis_chart_data'),
+    path('analysis/cache-stats/', views.chart_cache_stats, name='chart_cache_stats'),
     
     # Sharing URLs
     path('workouts/<int:pk>/share/', views.share_workout, name='share_workout'),
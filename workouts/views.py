@@ -1,27 +1,30 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, resolve_url, get_object_or_404
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView, View
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.conf import settings
 from django.urls import reverse_lazy
 from django.contrib import messages
-from django.db import transaction, models
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-from django.http import HttpResponse, JsonResponse
-from django.db.models import Max, Avg, Count, F, ExpressionWrapper, FloatField, Q
-from django.db.models.functions import ExtractWeek, ExtractYear
-from .models import Exercise, Workout, WorkoutExercise, WorkoutSession, ExercisePerformance, SharedWorkout
+from django.utils.dateparse import parse_datetime
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from .models import Exercise, Workout, WorkoutExercise, WorkoutSession, ExercisePerformance, SharedWorkout, SetCounter, Job
 from .forms import (
     ExerciseForm, WorkoutForm, WorkoutExerciseFormSet,
     WorkoutSessionForm, ExercisePerformanceForm, ExercisePerformanceFormSet,
-    WorkoutShareForm
+    WorkoutShareForm, HistoryImportForm
 )
 from django.core.exceptions import ValidationError
 import logging
 import json
-from .analysis import workout_analysis
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import uuid
+from . import chart_cache, export, importer, jobs, records, rollups
+from .signals import invalidate_charts
+from .pagination import KeysetPaginationMixin
 from datetime import timedelta
 from django.contrib.auth.models import User
 
@@ -64,10 +67,12 @@ def debug_form_data(request, form=None, formset=None):
                 logger.debug("Formset Non-Form Errors:")
                 logger.debug(json.dumps(formset.non_form_errors(), indent=2))
 
-class ExerciseListView(LoginRequiredMixin, ListView):
+class ExerciseListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Exercise
     template_name = 'workouts/exercise_list.html'
+    partial_template_name = 'workouts/partials/exercise_cards.html'
     context_object_name = 'exercises'
+    ordering = ('name', 'id')
 
     def get_queryset(self):
         try:
@@ -144,30 +149,36 @@ class ExerciseDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         exercise = self.get_object()
         return exercise.user == self.request.user
 
-    def delete(self, request, *args, **kwargs):
-        try:
-            exercise = self.get_object()
-            logger.info(f"Deleting exercise {exercise.id}")
-            response = super().delete(request, *args, **kwargs)
-            messages.success(self.request, 'Exercise deleted successfully!')
-            return response
-        except Exception as e:
-            logger.error(f"Error deleting exercise {kwargs.get('pk')}: {str(e)}", exc_info=True)
-            messages.error(self.request, f"Error deleting exercise: {str(e)}")
-            return redirect('workouts:exercise_list')
+    def form_valid(self, form):
+        # The exercise's sets go with it, and so do its daily rollup rows and
+        # records; the weekly and monthly rows of the sessions the sets were
+        # in are recomputed once they are gone
+        started = list(WorkoutSession.objects.filter(
+            exerciseperformance__exercise=self.object, finished_at__isnull=False
+        ).order_by().values_list('started_at', flat=True).distinct())
+        logger.info(f"Deleting exercise {self.object.id}")
+        with transaction.atomic():
+            response = super().form_valid(form)
+            rollups.refresh_periods(self.request.user, started)
+        messages.success(self.request, 'Exercise deleted successfully!')
+        return response
 
     def handle_no_permission(self):
         logger.warning(f"Unauthorized delete attempt for exercise {self.kwargs.get('pk')} by user {self.request.user}")
         messages.error(self.request, "You don't have permission to delete this exercise.")
         return redirect('workouts:exercise_list')
 
-class WorkoutListView(LoginRequiredMixin, ListView):
+class WorkoutListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Workout
     template_name = 'workouts/workout_list.html'
+    partial_template_name = 'workouts/partials/workout_cards.html'
     context_object_name = 'workouts'
+    ordering = ('name', 'id')
 
     def get_queryset(self):
-        return Workout.objects.filter(user=self.request.user)
+        return Workout.objects.filter(user=self.request.user).annotate(
+            exercise_count=Count('workoutexercise')
+        )
 
 class WorkoutDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
     model = Workout
@@ -373,9 +384,23 @@ class WorkoutDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         workout = self.get_object()
         return workout.user == self.request.user
 
-    def delete(self, request, *args, **kwargs):
+    def form_valid(self, form):
+        # The workout's sessions and sets go with it: note the rollup rows
+        # they count towards, and recompute those once they are gone
+        sessions = WorkoutSession.objects.filter(workout=self.object, finished_at__isnull=False)
+        keys = list(rollups.session_keys(sessions))
+        started = list(sessions.values_list('started_at', flat=True))
+        # The records only count finished sessions too
+        exercise_ids = set(ExercisePerformance.objects.filter(
+            workout_session__in=sessions
+        ).order_by().values_list('exercise_id', flat=True).distinct())
+        with transaction.atomic():
+            response = super().form_valid(form)
+            rollups.refresh_keys(self.request.user, keys)
+            rollups.refresh_periods(self.request.user, started)
+            records.refresh(self.request.user.pk, exercise_ids)
         messages.success(self.request, 'Workout deleted successfully!')
-        return super().delete(request, *args, **kwargs)
+        return response
 
 @login_required(login_url='accounts:login')
 def index(request):
@@ -384,18 +409,21 @@ def index(request):
         'total_workouts': Workout.objects.filter(user=request.user).count(),
     })
 
-class WorkoutSessionListView(LoginRequiredMixin, ListView):
+class WorkoutSessionListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = WorkoutSession
     template_name = 'workouts/session_list.html'
+    partial_template_name = 'workouts/partials/session_cards.html'
     context_object_name = 'sessions'
+    ordering = ('-started_at', '-id')
+    page_size = 20
 
     def get_queryset(self):
-        return WorkoutSession.objects.filter(user=self.request.user).order_by('-started_at')
+        return WorkoutSession.objects.filter(user=self.request.user).select_related('workout')
 
 @login_required
 def start_workout_session(request):
     if request.method == 'POST':
-        form = WorkoutSessionForm(request.POST)
+        form = WorkoutSessionForm(request.POST, user=request.user)
         if form.is_valid():
             session = form.save(commit=False)
             session.user = request.user
@@ -403,12 +431,8 @@ def start_workout_session(request):
             messages.success(request, 'Workout session started!')
             return redirect('workouts:session_detail', pk=session.pk)
     else:
-        form = WorkoutSessionForm()
-        # Show both user's workouts and accepted shared workouts
-        form.fields['workout'].queryset = Workout.objects.filter(
-            Q(user=request.user) |  # User's own workouts
-            Q(sharedworkout__shared_with=request.user, sharedworkout__is_accepted=True)  # Shared workouts
-        ).distinct()
+        # Shows both the user's workouts and accepted shared workouts
+        form = WorkoutSessionForm(user=request.user)
     
     return render(request, 'workouts/session_form.html', {'form': form})
 
@@ -418,9 +442,10 @@ class WorkoutSessionDetailView(LoginRequiredMixin, View):
     def get_context_data(self, session):
         return {
             'session': session,
-            'workout_exercises': session.workout.workoutexercise_set.all(),
-            'performances': session.exerciseperformance_set.all().order_by('performed_at'),
-            'form': ExercisePerformanceForm(workout_session=session)
+            'workout_exercises': exercise_progress(session),
+            'performances': session.exerciseperformance_set.select_related('exercise').order_by('performed_at'),
+            'form': ExercisePerformanceForm(workout_session=session),
+            'batch_formset': batch_formset(session),
         }
 
     def get(self, request, pk):
@@ -432,14 +457,21 @@ class WorkoutSessionDetailView(LoginRequiredMixin, View):
         
         if 'finish_workout' in request.POST:
             if not session.finished_at:
-                session.finished_at = timezone.now()
-                session.save()
+                with transaction.atomic():
+                    session.finished_at = timezone.now()
+                    session.save()
+                    # The charts read the rollups and the records, so both
+                    # take the session's sets here; only warming the chart
+                    # cache is left to a job
+                    rollups.refresh_session(session)
+                    records.record_sets(session.user_id, list(session.exerciseperformance_set.all()))
+                    jobs.enqueue('prerender_charts', user=request.user, workout_id=session.workout_id)
                 messages.success(request, "Workout session completed!")
             return redirect('workouts:session_list')
 
         if session.finished_at:
             messages.error(request, "Cannot modify a finished workout session.")
-            return redirect('workouts:session_detail', pk=pk)
+            return htmx_redirect(request, 'workouts:session_detail', pk=pk)
 
         form = ExercisePerformanceForm(request.POST, workout_session=session)
         if form.is_valid():
@@ -447,32 +479,347 @@ class WorkoutSessionDetailView(LoginRequiredMixin, View):
             performance.workout_session = session
             performance.performed_at = timezone.now()
             
-            # Get the last set number for this exercise in this session
-            last_set = ExercisePerformance.objects.filter(
-                workout_session=session,
-                exercise=performance.exercise
-            ).order_by('-set_number').first()
-            
-            performance.set_number = (last_set.set_number + 1) if last_set else 1
-            performance.save()
+            # Numbered from the session's per-exercise counter, so double
+            # submits and several devices never share a set number
+            with transaction.atomic():
+                performance.set_number = SetCounter.allocate(session.pk, performance.exercise_id)
+                performance.save()
+                records.flag_records(session.user_id, session.pk, [performance])
             
-            messages.success(request, "Set recorded successfully!")
+            if request.headers.get('HX-Request'):
+                return render_logged_sets(request, session, [performance])
+            if performance.new_records:
+                messages.success(request, f"Set recorded. New PR: {records.describe(performance.new_records)}!")
+            else:
+                messages.success(request, "Set recorded successfully!")
             return redirect('workouts:session_detail', pk=pk)
 
+        if request.headers.get('HX-Request'):
+            return render(request, 'workouts/partials/performance_form.html', {
+                'session': session, 'form': form
+            })
         return render(request, self.template_name, {
             **self.get_context_data(session),
             'form': form
         })
 
+class BatchLogSetsView(LoginRequiredMixin, View):
+    """
+    Log a block of sets in one request.
+
+    Accepts the ExercisePerformanceFormSet from the session page (prefix
+    ``sets``) or a JSON array of ``{exercise, reps, weight, notes}`` objects.
+    Every set is validated before any is saved and they are inserted with a
+    single bulk_create. HTMX requests get the new table rows back, JSON
+    requests the created sets, and plain form posts a redirect.
+
+    The sets all get the time of the request, as the block is typically
+    logged after the fact, so they are flagged ``batch_logged`` and left out
+    of the rest times on the analysis page.
+    """
+    prefix = 'sets'
+    fields = ('exercise', 'reps', 'weight', 'notes')
+
+    def post(self, request, pk):
+        session = get_object_or_404(WorkoutSession, pk=pk, user=request.user)
+        is_json = request.content_type == 'application/json'
+        
+        if session.finished_at:
+            message = "Cannot modify a finished workout session."
+            if is_json:
+                return JsonResponse({'error': message}, status=409)
+            messages.error(request, message)
+            return htmx_redirect(request, 'workouts:session_detail', pk=pk)
+        
+        if is_json:
+            try:
+                data = self.json_to_formset_data(json.loads(request.body))
+            except (ValueError, TypeError):
+                return JsonResponse({'error': "Expected a JSON array of sets"}, status=400)
+        else:
+            data = request.POST
+        
+        formset = batch_formset(session, data)
+        if not formset.is_valid():
+            if is_json:
+                return JsonResponse({
+                    'errors': formset.errors, 'non_form_errors': formset.non_form_errors()
+                }, status=400)
+            if request.headers.get('HX-Request'):
+                return render(request, 'workouts/partials/batch_sets_form.html', {
+                    'session': session, 'batch_formset': formset
+                })
+            return render(request, WorkoutSessionDetailView.template_name, {
+                **WorkoutSessionDetailView().get_context_data(session),
+                'batch_formset': formset
+            })
+        
+        performances = formset.save(commit=False)
+        if performances:
+            performances = self.save_block(session, performances, batch_logged=True)
+        logger.info(f"Logged {len(performances)} sets in session {session.pk} for user {request.user}")
+        
+        if is_json:
+            return JsonResponse({'sets': [
+                {'id': p.pk, 'exercise': p.exercise_id, 'set_number': p.set_number, 'new_records': p.new_records}
+                for p in performances
+            ]}, status=201)
+        if request.headers.get('HX-Request'):
+            return render_logged_sets(request, session, performances)
+        new_records = sum(bool(p.new_records) for p in performances)
+        messages.success(request, f"{len(performances)} sets recorded!" + (
+            f" {new_records} of them set a new PR." if new_records else ""
+        ))
+        return redirect('workouts:session_detail', pk=pk)
+
+    def json_to_formset_data(self, payload):
+        rows = payload.get('sets') if isinstance(payload, dict) else payload
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("Expected a list of sets")
+        data = {
+            f'{self.prefix}-TOTAL_FORMS': len(rows),
+            f'{self.prefix}-INITIAL_FORMS': 0,
+        }
+        for i, row in enumerate(rows):
+            for field in self.fields:
+                if row.get(field) is not None:
+                    data[f'{self.prefix}-{i}-{field}'] = row[field]
+        return data
+
+    @staticmethod
+    def save_block(session, performances, batch_logged=False):
+        # One counter bump per exercise reserves the block's set numbers in
+        # submission order, then a single insert writes every set. Only
+        # blocks sent from the batch form are flagged: synced sets come
+        # with the times the device logged them at.
+        by_exercise = {}
+        for performance in performances:
+            by_exercise.setdefault(performance.exercise_id, []).append(performance)
+        with transaction.atomic():
+            for exercise_id, block in by_exercise.items():
+                first = SetCounter.allocate(session.pk, exercise_id, count=len(block))
+                for offset, performance in enumerate(block):
+                    performance.workout_session = session
+                    performance.set_number = first + offset
+                    performance.batch_logged = batch_logged
+            performances = ExercisePerformance.objects.bulk_create(performances)
+            records.flag_records(session.user_id, session.pk, performances)
+            # bulk_create sends no post_save, so do what its receiver would
+            invalidate_charts(session.user_id, session.workout_id)
+        return performances
+
+class SessionSyncView(LoginRequiredMixin, View):
+    """
+    Apply a device's offline journal of set events and return the server delta.
+
+    The body is ``{"cursor": <int>, "events": [...]}``, where each event has a
+    client-generated UUID ``id`` and is either
+    ``{"type": "add", "exercise", "reps", "weight", "notes", "at"}`` or
+    ``{"type": "delete", "set": <uuid of the add, or a set id>}``.
+    Replaying an event is harmless: adds are keyed on their UUID and deletes
+    of missing sets succeed. Every event is answered with ``applied``,
+    ``duplicate`` or ``rejected``, so the device can clear its queue. The
+    response also carries the sets added since ``cursor``, the ids of every
+    live set (for deletions made elsewhere) and the new cursor.
+    """
+    max_events = 500
+
+    def post(self, request, pk):
+        try:
+            payload = json.loads(request.body)
+            events = payload.get('events', [])
+            cursor = int(payload.get('cursor') or 0)
+            if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+                raise ValueError("events must be a list of objects")
+        except (ValueError, TypeError, AttributeError):
+            return JsonResponse({'error': "Expected {\"cursor\": ..., \"events\": [...]}"}, status=400)
+        if len(events) > self.max_events:
+            return JsonResponse({'error': f"At most {self.max_events} events per sync"}, status=400)
+        
+        try:
+            with transaction.atomic():
+                # Locking the session row keeps it from being finished mid-sync
+                session = get_object_or_404(
+                    WorkoutSession.objects.select_for_update(), pk=pk, user=request.user
+                )
+                if session.finished_at:
+                    results = [
+                        {'id': event.get('id'), 'status': 'rejected', 'errors': {'session': ["Session is finished"]}}
+                        for event in events
+                    ]
+                else:
+                    results = self.apply(session, events)
+        except IntegrityError:
+            # Another sync of the same journal committed first; replaying
+            # will report its events as duplicates
+            return JsonResponse({'error': "Concurrent sync, retry"}, status=409)
+        
+        applied = sum(result['status'] == 'applied' for result in results)
+        logger.info(f"Synced session {session.pk} for user {request.user}: {applied}/{len(events)} events applied")
+        return JsonResponse({'results': results, **self.delta(session, cursor)})
+
+    def apply(self, session, events):
+        results = {}
+        adds, add_ids, deletes = {}, set(), []
+        for index, event in enumerate(events):
+            try:
+                event_id = uuid.UUID(str(event.get('id')))
+            except ValueError:
+                results[index] = {'id': event.get('id'), 'status': 'rejected', 'errors': {'id': ["Not a valid UUID"]}}
+                continue
+            if event.get('type') == 'add':
+                if event_id in add_ids:
+                    results[index] = {'id': str(event_id), 'status': 'duplicate'}
+                else:
+                    adds[index] = event_id
+                    add_ids.add(event_id)
+            elif event.get('type') == 'delete':
+                deletes.append((index, event_id, event.get('set')))
+            else:
+                results[index] = {'id': str(event_id), 'status': 'rejected', 'errors': {'type': ["Unknown event type"]}}
+        
+        # Adds: one lookup for the UUIDs already applied, one insert for the rest
+        seen = set(ExercisePerformance.objects.filter(
+            client_id__in=add_ids
+        ).values_list('client_id', flat=True))
+        pending = []
+        for index, event_id in adds.items():
+            if event_id in seen:
+                results[index] = {'id': str(event_id), 'status': 'duplicate'}
+                continue
+            event = events[index]
+            form = ExercisePerformanceForm(
+                {field: event.get(field) for field in ('exercise', 'reps', 'weight', 'notes') if event.get(field) is not None},
+                workout_session=session
+            )
+            if not form.is_valid():
+                results[index] = {'id': str(event_id), 'status': 'rejected', 'errors': form.errors}
+                continue
+            try:
+                performed_at = self.client_time(event.get('at'), session)
+            except ValueError:
+                # Well formed but impossible, such as February 30th
+                results[index] = {'id': str(event_id), 'status': 'rejected', 'errors': {'at': ["Not a valid date and time"]}}
+                continue
+            performance = form.save(commit=False)
+            performance.client_id = event_id
+            performance.performed_at = performed_at
+            pending.append((index, performance))
+        if pending:
+            # Number the sets in the order they were logged on the device
+            pending.sort(key=lambda item: item[1].performed_at)
+            BatchLogSetsView.save_block(session, [performance for _, performance in pending])
+            for index, performance in pending:
+                results[index] = {
+                    'id': str(performance.client_id), 'status': 'applied',
+                    'set': performance.pk, 'set_number': performance.set_number,
+                    'new_records': performance.new_records,
+                }
+        
+        # Deletes: by the add event's UUID or by set id, in one query
+        if deletes:
+            targets = [str(target) for _, _, target in deletes]
+            client_ids, pks = [], []
+            for target in targets:
+                try:
+                    client_ids.append(uuid.UUID(target))
+                except ValueError:
+                    if target.isdigit():
+                        pks.append(int(target))
+            ExercisePerformance.objects.filter(
+                Q(client_id__in=client_ids) | Q(pk__in=pks), workout_session=session
+            ).delete()
+            for index, event_id, _ in deletes:
+                results[index] = {'id': str(event_id), 'status': 'applied'}
+        
+        return [results[index] for index in range(len(events))]
+
+    @staticmethod
+    def client_time(value, session):
+        # Trust the device clock only within the session's lifetime so far.
+        # Raises ValueError for a date that doesn't exist.
+        now = timezone.now()
+        logged_at = parse_datetime(value) if isinstance(value, str) else None
+        if logged_at is None:
+            return now
+        if timezone.is_naive(logged_at):
+            logged_at = timezone.make_aware(logged_at)
+        return min(max(logged_at, session.started_at), now)
+
+    @staticmethod
+    def delta(session, cursor):
+        sets = session.exerciseperformance_set.order_by('pk')
+        live_ids = list(sets.values_list('pk', flat=True))
+        return {
+            'finished_at': session.finished_at,
+            'cursor': max([cursor, *live_ids]),
+            'sets': list(sets.filter(pk__gt=cursor).values(
+                'id', 'client_id', 'exercise', 'exercise__name', 'set_number',
+                'reps', 'weight', 'notes', 'performed_at'
+            )),
+            'set_ids': live_ids,
+        }
+
+def htmx_redirect(request, to, *args, **kwargs):
+    """redirect(), except HTMX requests get a full page load rather than a page swapped into a fragment"""
+    if request.headers.get('HX-Request'):
+        return HttpResponse(headers={'HX-Redirect': resolve_url(to, *args, **kwargs)})
+    return redirect(to, *args, **kwargs)
+
+def exercise_progress(session, exercise_ids=None):
+    """The session's workout exercises, each annotated with the number of sets logged so far"""
+    logged = (ExercisePerformance.objects
+              .filter(workout_session=session, exercise=OuterRef('exercise'))
+              .values('exercise').annotate(count=Count('pk')).values('count'))
+    queryset = (WorkoutExercise.objects.filter(workout_id=session.workout_id)
+                .select_related('exercise').annotate(logged=Coalesce(Subquery(logged), 0)))
+    if exercise_ids is not None:
+        queryset = queryset.filter(exercise_id__in=exercise_ids)
+    return queryset
+
+def render_logged_sets(request, session, performances):
+    """HTMX response appending new rows to the session table and refreshing their exercises' progress"""
+    response = render(request, 'workouts/partials/sets_logged.html', {
+        'session': session,
+        'performances': performances,
+        'workout_exercises': exercise_progress(session, {p.exercise_id for p in performances}),
+    })
+    # Rows go to the end of the session table, progress rows swap out of band
+    # and the form that posted clears itself
+    response['HX-Retarget'] = '#performance-rows'
+    response['HX-Reswap'] = 'beforeend'
+    response['HX-Trigger'] = 'sets-logged'
+    return response
+
+def batch_formset(session, data=None):
+    formset = ExercisePerformanceFormSet(
+        data, instance=session, queryset=ExercisePerformance.objects.none(),
+        prefix=BatchLogSetsView.prefix, form_kwargs={'workout_session': session}
+    )
+    if data is None:
+        # Every row offers the same exercises: load them once for all the selects
+        choices = list(formset.forms[0].fields['exercise'].choices)
+        for form in formset.forms:
+            form.fields['exercise'].choices = choices
+    return formset
+
 class DeletePerformanceView(LoginRequiredMixin, View):
     def post(self, request, session_pk, performance_pk):
         session = get_object_or_404(WorkoutSession, pk=session_pk, user=request.user)
         if session.finished_at:
             messages.error(request, "Cannot modify a finished workout session.")
-            return redirect('workouts:session_detail', pk=session_pk)
+            return htmx_redirect(request, 'workouts:session_detail', pk=session_pk)
 
         performance = get_object_or_404(ExercisePerformance, pk=performance_pk, workout_session=session)
+        performance.workout_session = session
+        # The session is open, so the set doesn't count towards the records yet
         performance.delete()
+        if request.headers.get('HX-Request'):
+            # The deleted row is swapped for an empty body; only its
+            # exercise's progress row comes back
+            return render(request, 'workouts/partials/exercise_progress.html', {
+                'workout_exercises': exercise_progress(session, [performance.exercise_id]), 'oob': True
+            })
         messages.success(request, "Set deleted successfully!")
         return redirect('workouts:session_detail', pk=session_pk)
 
@@ -599,126 +946,69 @@ def decline_shared_workout(request, pk):
     messages.success(request, f'You have declined the workout "{shared_workout.workout.name}"')
     return redirect('workouts:shared_workouts')
 
+@staff_member_required
+def chart_cache_stats(request):
+    """Hit/miss counters of the analysis chart cache"""
+    return JsonResponse({
+        'backend': settings.CHART_CACHE_BACKEND,
+        **chart_cache.stats(),
+    })
+
 @login_required
-def workout_specific_analysis(request, pk):
-    workout = get_object_or_404(Workout, pk=pk)
-    
-    # Check if user has access to this workout
-    if not (workout.user == request.user or SharedWorkout.objects.filter(
-        workout=workout, shared_with=request.user, is_accepted=True
-    ).exists()):
-        messages.error(request, "You don't have permission to view this workout's analysis.")
-        return redirect('workouts:workout_list')
-    
-    # Get all sessions for this workout
-    sessions = WorkoutSession.objects.filter(
-        workout=workout,
-        finished_at__isnull=False
-    ).select_related('user')
-    
-    if not sessions.exists():
-        messages.info(request, "No completed sessions found for this workout yet.")
-        return redirect('workouts:workout_detail', pk=workout.pk)
-    
-    # Overall Statistics
-    total_sessions = sessions.count()
-    unique_users = sessions.values('user').distinct().count()
-    completion_rate = (sessions.filter(finished_at__isnull=False).count() / 
-                      WorkoutSession.objects.filter(workout=workout).count() * 100)
-    
-    # Calculate average duration and format it
-    avg_duration = sessions.exclude(
-        finished_at__isnull=True
-    ).annotate(
-        duration=ExpressionWrapper(
-            F('finished_at') - F('started_at'),
-            output_field=models.DurationField()
-        )
-    ).aggregate(avg=Avg('duration'))['avg']
-    
-    if avg_duration:
-        hours = avg_duration.total_seconds() // 3600
-        minutes = (avg_duration.total_seconds() % 3600) // 60
-        avg_duration = f"{int(hours)}h {int(minutes)}m"
-    
-    # Exercise Performance Analysis
-    exercise_stats = {}
-    for exercise in workout.workoutexercise_set.all():
-        performances = ExercisePerformance.objects.filter(
-            workout_session__workout=workout,
-            exercise=exercise.exercise,
-            workout_session__finished_at__isnull=False
-        ).order_by('workout_session__started_at')
-        
-        if performances.exists():
-            # Weight progression
-            weight_data = performances.values(
-                'workout_session__started_at'
-            ).annotate(
-                avg_weight=Avg('weight')
-            ).order_by('workout_session__started_at')
-            
-            # Create weight progression chart with adjusted size and layout
-            fig = px.line(
-                x=[d['workout_session__started_at'] for d in weight_data],
-                y=[d['avg_weight'] for d in weight_data],
-                title=f'Weight Progression - {exercise.exercise.name}',
-                labels={'x': 'Date', 'y': 'Average Weight (kg)'}
-            )
-            
-            # Update layout for better readability
-            fig.update_layout(
-                height=400,
-                margin=dict(l=50, r=30, t=50, b=50),
-                title_x=0.5,
-                title_y=0.95,
-                title=dict(font=dict(size=16)),
-                xaxis=dict(title_font=dict(size=12)),
-                yaxis=dict(title_font=dict(size=12))
-            )
-            
-            # Calculate statistics
-            stats = performances.aggregate(
-                avg_weight=Avg('weight'),
-                max_weight=Max('weight'),
-                avg_reps=Avg('reps'),
-                max_reps=Max('reps'),
-                total_sets=Count('id')
-            )
-            
-            # Calculate percentiles
-            weight_values = list(performances.values_list('weight', flat=True))
-            if weight_values:
-                weight_values.sort()
-                n = len(weight_values)
-                stats['percentile_25'] = weight_values[int(n * 0.25)]
-                stats['percentile_50'] = weight_values[int(n * 0.50)]
-                stats['percentile_75'] = weight_values[int(n * 0.75)]
-            else:
-                stats['percentile_25'] = 0
-                stats['percentile_50'] = 0
-                stats['percentile_75'] = 0
-            
-            # Add to exercise stats
-            exercise_stats[exercise.exercise.name] = {
-                'chart': fig.to_html(full_html=False, config={'displayModeBar': False}),
-                'stats': stats,
-                'percentiles': {
-                    'weight': {
-                        '25th': stats['percentile_25'],
-                        '50th': stats['percentile_50'],
-                        '75th': stats['percentile_75']
-                    }
-                }
-            }
+def export_history(request):
+    """Stream the user's whole training history as CSV or JSON lines"""
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        raise Http404(f"Unknown export format {fmt}")
     
-    context = {
-        'workout': workout,
-        'total_sessions': total_sessions,
-        'unique_users': unique_users,
-        'completion_rate': completion_rate,
-        'avg_duration': avg_duration,
-        'exercise_stats': exercise_stats,
-    }
+    response = StreamingHttpResponse(
+        export.buffered(export.export_lines(request.user, fmt)), content_type=export.FORMATS[fmt]
+    )
+    filename = f"training-history-{timezone.localdate():%Y-%m-%d}.{fmt}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    logger.info(f"Exporting training history as {fmt} for user {request.user}")
+    return response
+
+@login_required
+def queue_export(request):
+    """Write the user's history to a file in the background, for a later download"""
+    if request.method != 'POST':
+        return redirect('workouts:session_list')
+    fmt = request.POST.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        raise Http404(f"Unknown export format {fmt}")
+    job = jobs.enqueue('export_history', user=request.user, format=fmt)
+    messages.info(request, "Your export is being prepared; it can be downloaded from this page when ready.")
+    return redirect('workouts:job_detail', pk=job.pk)
+
+@login_required
+def import_history(request):
+    """Queue an import of sets exported from another tracker into the user's history"""
+    form = HistoryImportForm(request.POST or None, request.FILES or None)
+    if request.method == 'POST' and form.is_valid():
+        upload = form.cleaned_data['file']
+        fmt = form.cleaned_data['format'] or importer.detect_format(upload.name)
+        job = jobs.enqueue('import_history', user=request.user, file=jobs.save_upload(upload), format=fmt)
+        messages.info(request, f"{upload.name} is queued for import.")
+        return redirect('workouts:job_detail', pk=job.pk)
     
-    return render(request, 'workouts/workout_analysis.html', context)
+    return render(request, 'workouts/import_history.html', {'form': form})
+
+@login_required
+def job_detail(request, pk):
+    """Progress and outcome of a background import or export; polled over HTMX until it ends"""
+    job = get_object_or_404(Job, pk=pk, user=request.user)
+    if request.headers.get('HX-Request'):
+        return render(request, 'workouts/partials/job_status.html', {'job': job})
+    return render(request, 'workouts/job_detail.html', {'job': job})
+
+@login_required
+def job_download(request, pk):
+    job = get_object_or_404(Job, pk=pk, user=request.user, kind='export_history', status=Job.DONE)
+    path = jobs.job_file(job.result['file'])
+    if not path.exists():
+        raise Http404("The export file is no longer available")
+    return FileResponse(
+        open(path, 'rb'), as_attachment=True, filename=job.result['filename'],
+        content_type=export.FORMATS[job.payload['format']],
+    )